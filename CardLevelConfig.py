@@ -50,6 +50,22 @@ DEATH_NOTE: dict[int, int] = {
 }
 
 
+def card_levels(card_id: int) -> list[int]:
+    """
+    返回卡牌的 [卡牌等级, C位技能等级, 普通技能等级]，未在 CARD_CACHE 中配置时使用默认值。
+    """
+    # 尝试从缓存中获取自定义等级，如果不存在则使用默认满级
+    levels = CARD_CACHE.get(card_id, None)
+    if levels == None:
+        levels = [
+            default_card_level[int(str(card_id)[4])],
+            default_center_skill_level,
+            default_skill_level
+        ]
+        CARD_CACHE[card_id] = levels
+    return levels
+
+
 def convert_deck_to_simulator_format(
     deck_card_ids_list: list[int]
 ) -> list[tuple[int, list[int]]]:
@@ -59,16 +75,7 @@ def convert_deck_to_simulator_format(
 
     result_deck_data = []
     for card_id in deck_card_ids_list:
-        # 尝试从缓存中获取自定义等级，如果不存在则使用默认满级
-        levels = CARD_CACHE.get(card_id, None)
-        if levels == None:
-            levels = [
-                default_card_level[int(str(card_id)[4])],
-                default_center_skill_level,
-                default_skill_level
-            ]
-            CARD_CACHE[card_id] = levels
-        result_deck_data.append((card_id, levels))
+        result_deck_data.append((card_id, card_levels(card_id)))
     return result_deck_data
 
 
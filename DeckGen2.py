@@ -1,14 +1,17 @@
 import itertools
-import json
 import logging
+import math
 import os
 import time
 from collections import defaultdict, Counter
+from functools import lru_cache
 
 from RChart import Chart, MusicDB
 from RDeck import Rarity
-from Simulator_core import DB_CARDDATA, DB_SKILL
+from data_registry import card_db, skill_db
 from SkillResolver import SkillEffectType
+from result_store import iter_compositions
+from card_store import StoreTable, split_tag_mask
 logger = logging.getLogger(__name__)
 
 CARD_CONFLICT_RULES = {
@@ -19,6 +22,29 @@ CARD_CONFLICT_RULES = {
 }
 
 
+# 卡组位置规则，格式: (位置, 卡牌id或技能tag, 是否必须位于该位置)
+# 位置从 0 开始，-1 表示最后一张；技能tag可使用 SkillEffectType 或 Rarity
+# True:  该位置必须放置符合条件的卡牌 (卡组中不含符合条件的卡牌时忽略此规则)
+# False: 该位置不能放置符合条件的卡牌
+POSITION_RULES = [
+    (0, SkillEffectType.ScoreGain, False),  # 分不位于左一
+    (-1, SkillEffectType.DeckReset, False),  # 洗牌不位于最后一张
+]
+
+# 卡牌相对顺序规则，格式: (卡牌id或技能tag A, 卡牌id或技能tag B)
+# 卡组同时包含 A 与 B 时，A 必须位于 B 之前
+ORDER_RULES = [
+    # (1041513, SkillEffectType.DeckReset),
+]
+
+# 角色优先级，规则与 DeckGen.py 相同
+# 列表中的角色按顺序排在卡组最前，双卡角色的两张卡之间不限顺序
+CHAR_ORDERED_PRIORITIES = [
+    # 1011,  # 沙知
+    # 1041,  # 吟子
+]
+
+
 def has_card_conflict(card_ids_in_deck: set[int]) -> bool:
     """
     检查卡组中是否存在冲突卡牌。
@@ -30,19 +56,38 @@ def has_card_conflict(card_ids_in_deck: set[int]) -> bool:
     return False
 
 
-DB_TAG = {}
-"""
-卡牌id -> 技能效果类型、稀有度
-多段同类效果只记录一个tag
-"""
-for data in DB_CARDDATA.values():
-    skill_series_id = data["RhythmGameSkillSeriesId"][-1]
-    skill_effect = DB_SKILL[str(skill_series_id * 100 + 14)]["RhythmGameSkillEffectId"]
-    tag = set()
-    for effect in skill_effect:
-        tag.add(SkillEffectType(effect // 100000000))
-    tag.add(Rarity(data["Rarity"]))
-    DB_TAG[data["CardSeriesId"]] = tag
+@lru_cache(maxsize=None)
+def get_db_tag() -> dict[int, set]:
+    """
+    卡牌id -> 技能效果类型、稀有度
+    多段同类效果只记录一个tag
+    第一次调用时才读取卡牌数据库
+    """
+    db_card = card_db()
+    db_tag = {}
+    if isinstance(db_card, StoreTable):
+        # 二进制数据库中已预先计算 tag 位掩码
+        for card_id, mask in zip(db_card.ids, db_card.column("TagMask")):
+            effects, rarities = split_tag_mask(mask)
+            db_tag[card_id] = {SkillEffectType(effect) for effect in effects} | {Rarity(rarity) for rarity in rarities}
+    else:
+        db_skill = skill_db()
+        for data in db_card.values():
+            skill_series_id = data["RhythmGameSkillSeriesId"][-1]
+            skill_effect = db_skill[str(skill_series_id * 100 + 14)]["RhythmGameSkillEffectId"]
+            tag = set()
+            for effect in skill_effect:
+                tag.add(SkillEffectType(effect // 100000000))
+            tag.add(Rarity(data["Rarity"]))
+            db_tag[data["CardSeriesId"]] = tag
+    return db_tag
+
+
+def __getattr__(name: str):
+    # 兼容旧的模块级 DB_TAG，访问时才生成
+    if name == "DB_TAG":
+        return get_db_tag()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def count_skill_tags(card_ids_input: list[int]):
@@ -56,11 +101,12 @@ def count_skill_tags(card_ids_input: list[int]):
         collections.Counter: 一个Counter对象，键是tag，值是其出现次数。
     """
     all_tags = []  # 用于收集所有卡牌的tag，包括重复的
+    db_tag = get_db_tag()
 
     for card_id in card_ids_input:
-        if card_id in DB_TAG:
+        if card_id in db_tag:
             # 将当前卡牌的所有tag（一个集合）添加到扁平列表中
-            all_tags.extend(DB_TAG[card_id])
+            all_tags.extend(db_tag[card_id])
         else:
             print(f"警告: 卡牌ID '{card_id}' 未在映射中找到。")
 
@@ -69,6 +115,101 @@ def count_skill_tags(card_ids_input: list[int]):
     return tag_counts
 
 
+def match_card(card_id: int, key) -> bool:
+    """
+    判断卡牌是否符合规则条件。
+    key 为 int 时视为卡牌id，否则视为技能tag (SkillEffectType / Rarity)。
+    """
+    if isinstance(key, int):
+        return card_id == key
+    return key in get_db_tag()[card_id]
+
+
+@lru_cache(maxsize=None)
+def permutation_table(allowed: tuple[int, ...], predecessors: tuple[int, ...]) -> tuple[tuple[int, ...], ...]:
+    """
+    预计算满足位置规则的全部排列 (以卡槽下标表示)。
+    按位置依次放置卡槽，只展开满足规则的分支，不生成后再过滤。
+
+    Args:
+        allowed (tuple[int, ...]): allowed[pos] 为该位置可放置的卡槽 bitmask。
+        predecessors (tuple[int, ...]): predecessors[slot] 为必须排在该卡槽之前的卡槽 bitmask。
+
+    Returns:
+        tuple[tuple[int, ...], ...]: 所有合法排列，每个排列为卡槽下标元组。
+    """
+    size = len(allowed)
+    results = []
+    order = []
+
+    def place(pos: int, used: int):
+        if pos == size:
+            results.append(tuple(order))
+            return
+        candidates = allowed[pos] & ~used
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            slot = bit.bit_length() - 1
+            if predecessors[slot] & ~used:
+                continue
+            order.append(slot)
+            place(pos + 1, used | bit)
+            order.pop()
+
+    place(0, 0)
+    return tuple(results)
+
+
+def get_permutation_table(deck: list[int]) -> tuple[tuple[int, ...], ...]:
+    """
+    根据 POSITION_RULES、ORDER_RULES、CHAR_ORDERED_PRIORITIES 计算卡组的合法排列表。
+    规则形状相同的卡组共享同一张排列表。
+    """
+    size = len(deck)
+    full = (1 << size) - 1
+    allowed = [full] * size
+    for pos, key, required in POSITION_RULES:
+        matched = 0
+        for slot, card_id in enumerate(deck):
+            if match_card(card_id, key):
+                matched |= 1 << slot
+        if required:
+            if matched:
+                allowed[pos] &= matched
+        else:
+            allowed[pos] &= ~matched
+
+    predecessors = [0] * size
+    for key_before, key_after in ORDER_RULES:
+        before = 0
+        for slot, card_id in enumerate(deck):
+            if match_card(card_id, key_before):
+                before |= 1 << slot
+        for slot, card_id in enumerate(deck):
+            if match_card(card_id, key_after):
+                predecessors[slot] |= before & ~(1 << slot)
+
+    if CHAR_ORDERED_PRIORITIES:
+        ranks = [get_char_priority_rank(card_id // 1000) for card_id in deck]
+        for slot, rank in enumerate(ranks):
+            for other, other_rank in enumerate(ranks):
+                if other_rank < rank:
+                    predecessors[slot] |= 1 << other
+
+    return permutation_table(tuple(allowed), tuple(predecessors))
+
+
+def get_char_priority_rank(characters_id: int) -> int:
+    """
+    获取角色在 CHAR_ORDERED_PRIORITIES 中的排名，不在列表中的角色排名最低。
+    """
+    try:
+        return CHAR_ORDERED_PRIORITIES.index(characters_id)
+    except ValueError:
+        return len(CHAR_ORDERED_PRIORITIES)
+
+
 def generate_role_distributions(all_characters):
     """
     生成6个卡位的角色分布，允许部分角色双卡。
@@ -91,42 +232,114 @@ def generate_role_distributions(all_characters):
 
 
 def load_simulated_decks(path: str):
+    """
+    读取既有log中已模拟的卡组组成及其中的最高分，逐条读取组成，不载入完整结果。
+    """
     simulated_decks = set()
-    if os.path.exists(path):
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        for result in data:
-            current_deck_card_ids = result['deck_card_ids']
-            sorted_card_ids_tuple = tuple(sorted(current_deck_card_ids))
-            simulated_decks.add(sorted_card_ids_tuple)
+    best_score = -1
+    if path and os.path.exists(path):
+        for composition, score in iter_compositions(path):
+            simulated_decks.add(composition)
+            if score > best_score:
+                best_score = score
         logger.info(f"{len(simulated_decks)} simulation results loaded.")
-    return simulated_decks
+    return simulated_decks, best_score
 
 
 class DeckGeneratorWithDoubleCards:
-    def __init__(self, cardpool: list[int], mustcards: list[list[int]], center_char=None, center_card: set[int] = None, friend_card: set[int] = None, log_path: str = None):
+    def __init__(self, cardpool: list[int], mustcards: list[list[int]], center_char=None, center_card: set[int] = None, friend_card: set[int] = None, log_path: str | list[str] = None, score_bound=None, compositions: set[tuple[int, ...]] = None, previous_pool: list[int] = None):
         self.cardpool = cardpool
         self.center_char = center_char
         self.char_id_to_cards = defaultdict(list)
         self.center_card = center_card
         self.mustcards = mustcards
         self.friend_card = friend_card
-        self.simulated_decks = load_simulated_decks(log_path)
+        if isinstance(log_path, (list, tuple)):
+            # 多曲模式: 只跳过所有歌曲的log中均已模拟的组成
+            simulated = [load_simulated_decks(path)[0] for path in log_path]
+            self.simulated_decks = set.intersection(*simulated) if simulated else set()
+            self.best_score = -1
+        else:
+            self.simulated_decks, self.best_score = load_simulated_decks(log_path)
+        # 得分上限剪枝: score_bound(卡组, 可用C位, 可用助战) 不超过 best_score 的组成会被整体跳过
+        # best_score 由调用方在模拟过程中更新
+        self.score_bound = score_bound
+        self.skipped_compositions = 0
+        self.skipped_decks = 0
         for card_id in self.cardpool:
             char_id = card_id // 1000
             self.char_id_to_cards[char_id].append(card_id)
         self.all_available_chars = list(self.char_id_to_cards.keys())
+        # 只生成指定的组成 (如重新模拟练度变化的卡组)，按角色分布分组，不在卡牌池中的组成被忽略
+        self.compositions = None
+        if compositions is not None:
+            pool = set(self.cardpool)
+            self.compositions = defaultdict(list)
+            for composition in compositions:
+                if pool.issuperset(composition):
+                    self.compositions[tuple(sorted(card_id // 1000 for card_id in composition))].append(list(composition))
+        # 增量生成: 只生成至少包含一张不在 previous_pool 中的卡牌的组成
+        self.new_cards = None
+        if previous_pool is not None:
+            self.new_cards = set(self.cardpool) - set(previous_pool)
+            logger.info(f"Delta generation with {len(self.new_cards)} new cards: {sorted(self.new_cards)}")
 
         # 预计算数量
         self.total_decks = self.compute_total_count()
 
     def __iter__(self):
+        for index, perm, center, friend in self.iter_decks():
+            yield perm, center, friend
+
+    def _iter_distributions(self):
         if len(self.all_available_chars) < 3:
             return
         for char_distribution in generate_role_distributions(self.all_available_chars):
             if self.center_char and self.center_char not in char_distribution:
                 continue
-            yield from self._generate_decks_for_distribution(char_distribution)
+            if self.new_cards is not None and self._count_candidates(char_distribution)[1] == 0:
+                # 分布中的角色都没有新卡牌
+                continue
+            yield char_distribution
+
+    def iter_decks(self, start: int = 0, done: set[int] = None):
+        """
+        按固定顺序生成卡组，返回 (序号, 卡组, C位卡牌, 助战卡牌)。
+        序号为卡组在全部 total_decks 个卡组中的位置 (被剪枝的卡组同样占用序号)，用于断点续算:
+        序号小于 start 或位于 done 中的卡组不再生成，整个角色分布或组成均已完成时直接跳过，不展开排列。
+        增量模式下分布的卡组数量未预先计算，续算时逐个组成跳过，生成完一个分布后将 total_decks 修正为实际数量。
+        """
+        done = done or set()
+        index = 0
+        for char_distribution, count in self.distribution_counts:
+            if count is not None and index + count <= start:
+                index += count
+                continue
+            distribution_start = index
+            for deck, available_center, available_friend in self._iter_compositions(char_distribution):
+                table = get_permutation_table(deck)
+                size = len(table) * len(available_center) * len(available_friend)
+                if index + size <= start:
+                    index += size
+                    continue
+                if self.score_bound and self.best_score > 0 and \
+                        self.score_bound(deck, available_center, available_friend) <= self.best_score:
+                    # 任意顺序都不可能超过当前最高分，跳过整个组成
+                    self.skipped_compositions += 1
+                    self.skipped_decks += size
+                    index += size
+                    continue
+                # 只展开满足位置规则的排列 (默认去除分位于左一、洗牌位于最后一张的卡组)
+                for order in table:
+                    perm = tuple(deck[i] for i in order)
+                    for center in available_center:
+                        for friend in available_friend:
+                            if index >= start and index not in done:
+                                yield index, perm, center, friend
+                            index += 1
+            if count is None and char_distribution not in self.counted_distributions:
+                self.counted_distributions.add(char_distribution)
+                self.total_decks += index - distribution_start - self._count_candidates(char_distribution)[1]
 
     def check_skill_tags(self, tag_counts: Counter):
         """
@@ -138,22 +351,12 @@ class DeckGeneratorWithDoubleCards:
             return True
         return False
 
-    def _generate_decks_for_distribution(self, char_distribution):
-        char_counts = {char_id: char_distribution.count(char_id) for char_id in set(char_distribution)}
-        card_choices_per_char = []
-        for char_id, count in char_counts.items():
-            card_pool = self.char_id_to_cards[char_id]
-            if count == 1:
-                card_choices_per_char.append([(card_id,) for card_id in card_pool])
-            elif count == 2:
-                card_choices_per_char.append(list(itertools.combinations(card_pool, 2)))
-            else:
-                raise ValueError("角色数量超过2，不符合规则")
-
-        for combo in itertools.product(*card_choices_per_char):
-            deck = []
-            for item in combo:
-                deck.extend(item)
+    def _iter_compositions(self, char_distribution):
+        """
+        遍历角色分布下所有满足限制条件的卡组组成 (不考虑顺序)。
+        返回 (卡组, 可用C位卡牌, 可用助战卡牌)。
+        """
+        for deck in self._iter_candidate_decks(char_distribution):
             if tuple(sorted(deck)) in self.simulated_decks:
                 continue
             if self.mustcards[0]:
@@ -177,17 +380,39 @@ class DeckGeneratorWithDoubleCards:
                     available_friend = self.friend_card.difference(deck)
                 else:
                     available_friend = {None}
+                yield deck, available_center, available_friend
 
-                for perm in itertools.permutations(deck):
-                # 去除分位于左一、洗牌位于最后一张的卡组
-                    if SkillEffectType.ScoreGain in DB_TAG[perm[0]] or \
-                            SkillEffectType.DeckReset in DB_TAG[perm[-1]]:
-                        continue
-                    for center in available_center:
-                        for friend in available_friend:
-                            yield perm, center, friend
+    def _iter_candidate_decks(self, char_distribution):
+        """
+        遍历角色分布下的全部卡牌组合 (未经限制条件筛选)。
+        """
+        if self.compositions is not None:
+            yield from sorted(self.compositions.get(tuple(sorted(char_distribution)), ()))
+            return
 
-    def _count_decks_for_distribution(self, char_distribution):
+        card_choices_per_char = self._card_choices(char_distribution)
+        if self.new_cards is None:
+            combos = itertools.product(*card_choices_per_char)
+        else:
+            # 按第一个选择了新卡牌的角色 j 划分: j 之前的角色只选旧卡牌，j 之后任选，每个组成恰好生成一次
+            new_cards = self.new_cards
+            old_choices = [[item for item in choices if new_cards.isdisjoint(item)] for choices in card_choices_per_char]
+            new_choices = [[item for item in choices if not new_cards.isdisjoint(item)] for choices in card_choices_per_char]
+            combos = itertools.chain.from_iterable(
+                itertools.product(*old_choices[:j], new_choices[j], *card_choices_per_char[j + 1:])
+                for j in range(len(card_choices_per_char))
+            )
+
+        for combo in combos:
+            deck = []
+            for item in combo:
+                deck.extend(item)
+            yield deck
+
+    def _card_choices(self, char_distribution) -> list[list[tuple[int, ...]]]:
+        """
+        每个角色可选的卡牌 (单卡角色为 1 张，双卡角色为 2 张的组合)。
+        """
         char_counts = {char_id: char_distribution.count(char_id) for char_id in set(char_distribution)}
         card_choices_per_char = []
         for char_id, count in char_counts.items():
@@ -198,55 +423,58 @@ class DeckGeneratorWithDoubleCards:
                 card_choices_per_char.append(list(itertools.combinations(card_pool, 2)))
             else:
                 raise ValueError("角色数量超过2，不符合规则")
+        return card_choices_per_char
 
-        total = 0
-        for combo in itertools.product(*card_choices_per_char):
-            deck = []
-            for item in combo:
-                deck.extend(item)
-            if tuple(sorted(deck)) in self.simulated_decks:
-                continue
-            if self.mustcards[0]:
-                if not all(card in deck for card in self.mustcards[0]):
-                    continue
-            if self.mustcards[1]:
-                if not any(card in deck for card in self.mustcards[1]):
-                    continue
-            if has_card_conflict(set(deck)):
-                continue
-            if self.check_skill_tags(count_skill_tags(deck)):
-                available_center = self.center_card.intersection(deck)
-                if self.friend_card:
-                    available_friend = self.friend_card.difference(deck)
-                else:
-                    available_friend = {None}
-                if available_center or not self.center_card:
-                    center_count = len(available_center) or 1
-                    friend_count = len(available_friend) or 1
-                    variety_count = center_count * friend_count
-                    for perm in itertools.permutations(deck):
-                        if SkillEffectType.ScoreGain in DB_TAG[perm[0]] or \
-                                SkillEffectType.DeckReset in DB_TAG[perm[-1]]:
-                            continue
-                        total += variety_count
-        return total
+    def _count_candidates(self, char_distribution) -> tuple[int, int]:
+        """
+        不展开组合，直接计算角色分布下的组成数量 (未经限制条件筛选)，返回 (全部, 含新卡牌)。
+        每个角色有 n 张卡牌 (其中 k 张为新卡牌) 时，单卡角色的选择为 n 种 (旧卡牌 n-k 种)，
+        双卡角色为 C(n,2) 种 (旧卡牌 C(n-k,2) 种)；含新卡牌的组成数 = 全部之积 - 只含旧卡牌之积。
+        """
+        total = 1
+        old = 1
+        for char_id in set(char_distribution):
+            card_pool = self.char_id_to_cards[char_id]
+            n = len(card_pool)
+            n_old = n if self.new_cards is None else sum(card_id not in self.new_cards for card_id in card_pool)
+            count = char_distribution.count(char_id)
+            total *= math.comb(n, count)
+            old *= math.comb(n_old, count)
+        return total, total - old
 
-    def compute_total_count(self):
+    def _count_decks_for_distribution(self, char_distribution):
         total = 0
-        if len(self.all_available_chars) < 3:
-            return 0
-        for char_distribution in generate_role_distributions(self.all_available_chars):
-            if self.center_char and self.center_char not in char_distribution:
-                continue
-            total += self._count_decks_for_distribution(char_distribution)
+        for deck, available_center, available_friend in self._iter_compositions(char_distribution):
+            total += len(get_permutation_table(deck)) * len(available_center) * len(available_friend)
         return total
 
-
-def generate_decks_with_double_cards(cardpool: list[int], mustcards: list[list[int]], center_char: int = None, center_card: set[int] = None, friend_card: set[int] = None, log_path: str = None):
+    def compute_total_count(self):
+        self.counted_distributions = set()
+        if self.new_cards is not None:
+            # 增量模式不预先展开卡组: total_decks 初始为含新卡牌的候选组成数 (闭式计算)，
+            # iter_decks 生成完每个分布后修正为实际卡组数量
+            self.distribution_counts = [(char_distribution, None) for char_distribution in self._iter_distributions()]
+            candidates = [self._count_candidates(char_distribution) for char_distribution, _ in self.distribution_counts]
+            logger.info(f"{sum(new for _, new in candidates)} of {sum(total for total, _ in candidates)} "
+                        f"candidate compositions contain new cards.")
+            return sum(new for _, new in candidates)
+        # 同时记录每个角色分布的卡组数量，续算时可整体跳过已完成的分布
+        self.distribution_counts = [
+            (char_distribution, self._count_decks_for_distribution(char_distribution))
+            for char_distribution in self._iter_distributions()
+        ]
+        return sum(count for _, count in self.distribution_counts)
+
+
+def generate_decks_with_double_cards(cardpool: list[int], mustcards: list[list[int]], center_char: int = None, center_card: set[int] = None, friend_card: set[int] = None, log_path: str | list[str] = None, score_bound=None, compositions: set[tuple[int, ...]] = None, previous_pool: list[int] = None):
     """
     外部接口函数，返回支持双卡规则的卡组生成器
+    log_path 为列表时，只跳过在所有log中均已模拟的组成
+    compositions 不为 None 时只生成其中的组成 (仍需满足其他限制条件)
+    previous_pool 不为 None 时只生成至少包含一张新卡牌 (不在 previous_pool 中) 的组成，
+    只含旧卡牌的组成需已在上次以相同的限制条件模拟过
     """
-    return DeckGeneratorWithDoubleCards(cardpool, mustcards, center_char, center_card, friend_card, log_path)
+    return DeckGeneratorWithDoubleCards(cardpool, mustcards, center_char, center_card, friend_card, log_path, score_bound, compositions, previous_pool)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,25 @@
+import argparse
+import heapq
+import json
 import logging
+import threading
 import time
 import os
 import multiprocessing
-import json
 
 from platform import python_implementation
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 from RChart import Chart
 from DeckGen import generate_decks_with_sequential_priority_pruning
-from DeckGen2 import generate_decks_with_double_cards
-from CardLevelConfig import convert_deck_to_simulator_format, fix_windows_console_encoding, CARD_CACHE
+from DeckGen2 import generate_decks_with_double_cards, load_simulated_decks
+from CardLevelConfig import fix_windows_console_encoding, card_levels, CARD_CACHE
 from SkillResolver import SkillEffectType
-from Simulator_core import run_game_simulation, MUSIC_DB
+from Simulator_core import init_batch_worker, run_simulation_chunk, composition_score_bound
+from data_registry import music_db, card_data_hash
+from result_store import save_results, log_path, snapshot_path, ResultAggregator, ResultReader, ResultWriter, \
+    open_writer, iter_results, composition_key, collect_cards, load_card_meta, stale_cards, card_row_index, read_rows, \
+    replace_log, remove_log
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -21,7 +28,6 @@ logging.basicConfig(
 )
 
 BONUS_SFL = 6.6
-CENTERCHAR = None
 LIMITBREAK_BONUS = {
     1: 1, 2: 1, 3: 1, 4: 1, 5: 1,
     6: 1, 7: 1, 8: 1, 9: 1, 10: 1,
@@ -30,84 +36,356 @@ LIMITBREAK_BONUS = {
     13: 1.35,
     14: 1.4
 }
+CHECKPOINT_VERSION = 5
+
+
+def score_to_pt(center_card, score: int) -> int:
+    bonus = BONUS_SFL
+    if center_card:
+        bonus *= LIMITBREAK_BONUS[max(card_levels(center_card)[1:])]
+    return int(score * bonus)  # 实际为向上取整而非截断
 
 
 def score2pt(results):
-    card_limitbreak = dict()
     for deck in results:
-        bonus = BONUS_SFL
-        centercard = deck["center_card"]
-        if centercard:
-            limitbreak = card_limitbreak.get(centercard, None)
-            if limitbreak == None:
-                levels = CARD_CACHE[centercard]
-                card_limitbreak[centercard] = limitbreak = max(levels[1:])
-            bonus *= LIMITBREAK_BONUS[limitbreak]
-        deck['pt'] = int(deck['score'] * bonus)  # 实际为向上取整而非截断
+        deck['pt'] = score_to_pt(deck["center_card"], deck["score"])
     return results
 
 
-def save_simulation_results(results_data: list, filename: str = os.path.join("log", "simulation_results.json"), calc_pt=False):
+def log_card_meta(cards, merge_log: str, refreshed: set[int] = frozenset()) -> tuple[dict, dict]:
     """
-    将模拟结果数据保存到 JSON 文件，只保留最高分的顺序。
-    results_data: 包含每个卡组及其得分的字典列表。
-                  例如: [{"deck_cards": [id1, id2, ...], "score": 123456}, ...]
-    filename: 保存 JSON 文件的名称。
+    计算写入log的每张卡牌的练度与数据指纹。
+    既有log中已记录的卡牌沿用原记录 (其中的旧结果是以原练度模拟的，与当前值不一致时可用 --refresh 重新模拟)，
+    refreshed 中的卡牌 (旧结果已全部移除) 与新出现的卡牌使用当前值。
     """
+    levels, data = load_card_meta(merge_log) if os.path.exists(merge_log) else ({}, {})
+    for card_id in cards:
+        if card_id in refreshed or card_id not in levels:
+            levels[card_id] = card_levels(card_id)
+        if card_id in refreshed or card_id not in data:
+            data[card_id] = card_data_hash(card_id)
+    return levels, data
 
-    unique_decks_best_scores = {}  # Key: tuple of sorted card IDs, Value: {'deck_card_ids': original_list, 'score': best_score}
-
-    for result in results_data:
-        current_deck_card_ids = result['deck_card_ids']
-        current_score = result['score']
-        center_card = result['center_card']
-        friend_card = result['friend_card']
-
-        # Create a standardized key for comparison (sorted tuple of card IDs)
-        # Ensure card IDs are integers for consistent sorting if they are not already
-        sorted_card_ids_tuple = tuple(sorted(map(int, current_deck_card_ids)))
-
-        if sorted_card_ids_tuple not in unique_decks_best_scores or \
-                current_score > unique_decks_best_scores[sorted_card_ids_tuple]['score']:
-            # If this is a new unique combination or we found a higher score for it
-            unique_decks_best_scores[sorted_card_ids_tuple] = {
-                'deck_card_ids': current_deck_card_ids,
-                'center_card': center_card,
-                'friend_card': friend_card,
-                'score': current_score,
-            }
-
-    # Convert the unique decks dictionary back to a list of results
-    processed_results = list(unique_decks_best_scores.values())
-    if calc_pt:
-        processed_results = score2pt(processed_results)
-        # 合并既有log
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                processed_results.extend(json.load(f))
-        processed_results.sort(key=lambda i: i["pt"], reverse=True)
-    else:
-        processed_results.sort(key=lambda i: i["score"], reverse=True)
+
+def find_stale_results(path: str) -> tuple[set[int], set[tuple[int, ...]]]:
+    """
+    找出log中练度或卡牌数据已改变的卡牌，以及包含这些卡牌的结果的组成 (composition_key)。
+    """
+    changed = stale_cards(path, card_levels, card_data_hash)
+    if not changed:
+        return changed, set()
+    index = card_row_index(path)
+    rows = {row for card_id in changed for row in index.get(card_id, ())}
+    return changed, {composition_key(result) for result in read_rows(path, rows)}
+
+
+def merge_simulation_results(temp_files: list[str], filename: str, merge_log: str = None, run_size: int = 1_000_000, exclude: set = None,
+                             drop: set = None, refreshed: set[int] = frozenset()):
+    """
+    流式合并按组成排序的临时文件，内存占用只与 run_size 有关，与结果总数无关。
+    1. 对临时文件按组成 k 路归并，去重 (保留最高分) 并计算 pt，每 run_size 条按 pt 排序后写入一个分段文件
+    2. 对各分段与既有log (已按 pt 排序) 按 pt k 路归并，写入最终log
+    temp_files: 由 ResultAggregator.dump 写入的二进制临时文件。
+    filename: 最终log的路径，按扩展名决定格式。
+    merge_log: 需要合并的既有log，默认为 filename。
+    exclude: 既有log中已模拟的组成 (composition_key)，合并时跳过，避免与既有log重复。
+    drop: 从既有log中移除的组成 (练度改变后需要重新模拟的结果)。
+    refreshed: 练度已改变的卡牌，包含这些卡牌的旧结果均在 drop 中，合并后记录为当前练度。
+    返回是否保存成功。
+    """
+    merge_log = merge_log or filename
+    readers = [ResultReader(temp_file) for temp_file in temp_files]
+    cards = set()
+    for reader in readers:
+        cards.update(reader.cards)
+
+    run_files = []
+
+    def write_run(run: list):
+        score2pt(run)
+        run.sort(key=lambda i: i["pt"], reverse=True)
+        run_filename = f"{temp_files[0]}.run{len(run_files):0>3}.bin"
+        with ResultWriter(run_filename, cards) as writer:
+            for result in run:
+                writer.write_result(result)
+        run_files.append(run_filename)
+
+    run = []
+    best = None
+    best_key = None
+    for result in heapq.merge(*readers, key=composition_key):
+        key = composition_key(result)
+        if exclude and key in exclude:
+            continue
+        if key == best_key:
+            if result["score"] > best["score"]:
+                best = result
+            continue
+        if best:
+            run.append(best)
+            if len(run) >= run_size:
+                write_run(run)
+                run = []
+        best, best_key = result, key
+    if best:
+        run.append(best)
+    if run:
+        write_run(run)
+    for reader in readers:
+        reader.close()
+
+    def existing_results():
+        for result in iter_results(merge_log):
+            if not drop or composition_key(result) not in drop:
+                yield result
+
+    streams = [iter_results(run_file) for run_file in run_files]
+    if os.path.exists(merge_log):
+        if filename.endswith(".bin"):
+            # 二进制log需要预先给出所有卡牌id
+            for result in existing_results():
+                cards.update(collect_cards([result]))
+        streams.append(existing_results())
+    levels, data = log_card_meta(cards, merge_log, refreshed)
+
+    output_filename = ".tmp".join(os.path.splitext(filename))
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(processed_results, f, ensure_ascii=False, indent=0)
+        with open_writer(output_filename, cards, levels=levels, data=data) as writer:
+            for result in heapq.merge(*streams, key=lambda i: i["pt"], reverse=True):
+                writer.write_result(result)
+        replace_log(output_filename, filename)
+        if merge_log != filename and os.path.exists(merge_log):
+            # 既有log已合并到另一格式的log中，只保留一份，避免 log_path 读取到旧的log
+            remove_log(merge_log)
+            logger.info(f"Removed {merge_log}, merged into {filename}")
         logger.info(f"Simulation results saved to {filename}")
+        return True
     except Exception as e:
-        logger.error(f"Error saving simulation results to JSON: {e}")
+        logger.error(f"Error saving simulation results: {e}")
+        return False
+    finally:
+        for run_file in run_files:
+            os.remove(run_file)
 
 
-def task_generator_func(decks_generator, chart, player_level):
+def get_available_center(card_ids: list[int], center_char_id: int, secondary_center: list[int]) -> set[int]:
     """
-    一个生成器函数，从 decks_generator 获取每个卡组，
-    并将其转换为 run_game_simulation 所需的任务格式。
+    筛选歌曲的可用C位卡牌: 优先使用C位角色的DR、LR及备用C位池中的卡牌，否则使用C位角色的其他卡牌。
     """
-    for i, (deck_card_ids_list, center_card, friend_card) in enumerate(decks_generator):  # Simulate all decks as example
-        sim_deck_format = convert_deck_to_simulator_format(deck_card_ids_list)
-        yield (sim_deck_format, chart, player_level, i, deck_card_ids_list, center_card, friend_card)
+    center_char = str(center_char_id)
+    primary_center = set()
+    other_center = set()
+    for card in card_ids:
+        card_str = str(card)
+        if card_str[0:4] == center_char:
+            if card_str[4] in ["7", "8"]:
+                primary_center.add(card)
+            else:
+                other_center.add(card)
+
+    # 添加备用C位池中的可用卡牌
+    for card in secondary_center:
+        if card // 1000 == center_char_id and card in card_ids:
+            primary_center.add(card)
+
+    return primary_center or other_center or set()
+
+
+class BatchSong:
+    """
+    批量模拟中单首歌曲的汇总结果、临时文件与最高分。
+    """
+
+    def __init__(self, music_id: str, difficulty: str, cards: list[int], top_n: int = 0):
+        self.music_id = music_id
+        self.difficulty = difficulty
+        # 在线汇总当前批次的结果，每个卡组组成只保留最高分；前 N 名按 pt 排名 (C位突破加成可能改变顺序)
+        self.aggregator = ResultAggregator(cards, top_n, rank=score_to_pt)
+        self.temp_files = []
+        self.best_score = -1
+        self.best_deck_info = None  # 存储最佳卡组的完整信息
+        self.best_log = []
+
+    def save_batch(self, temp_dir: str):
+        temp_filename = os.path.join(temp_dir, f"temp_batch_{self.music_id}_{self.difficulty}_{len(self.temp_files) + 1:0>3}.bin")
+        self.aggregator.dump(temp_filename)  # 写入后清空当前批次
+        self.temp_files.append(temp_filename)
+
+    def add_chunk(self, count: int, packed_results: list[tuple[int, int]], chunk_best: tuple) -> bool:
+        """
+        汇总工作进程返回的一组结果，返回最高分是否被刷新。
+        """
+        aggregator = self.aggregator
+        for key, value in packed_results:
+            aggregator.add_packed(key, value)
+        aggregator.count += count
+        if not chunk_best or chunk_best[0] <= self.best_score:
+            return False
+        score, original_index, deck_card_ids, center_card, friend_card, self.best_log = chunk_best
+        self.best_score = score
+        self.best_deck_info = {
+            "original_index": original_index,
+            "deck_card_ids": deck_card_ids,
+            "center_card": center_card,
+            "friend_card": friend_card,
+            "score": score
+        }
+        return True
+
+    def save_snapshot(self, temp_dir: str) -> str:
+        """
+        原子地写入当前前 N 名组成 (含 pt) 的快照，返回快照路径。
+        """
+        # 前 N 名已按 pt 排名
+        results = score2pt(self.aggregator.top_results())
+        path = snapshot_path(self.music_id, self.difficulty, temp_dir)
+        tmp_path = ".tmp".join(os.path.splitext(path))
+        save_results(results, tmp_path, self.music_id, self.difficulty, levels=CARD_CACHE)
+        os.replace(tmp_path, path)
+        return path
+
+    def state(self) -> dict:
+        return {
+            "segments": self.temp_files,
+            "simulated": self.aggregator.count,
+            "best_score": self.best_score,
+            "best_deck_info": self.best_deck_info,
+            "best_log": self.best_log,
+            "top_results": self.aggregator.top_results(),
+        }
+
+    def load_state(self, state: dict):
+        self.temp_files = state["segments"]
+        self.aggregator.count = state["simulated"]
+        self.best_score = state["best_score"]
+        self.best_deck_info = state["best_deck_info"]
+        self.best_log = state["best_log"]
+        self.aggregator.seed_top(state["top_results"])
+
+
+class SimulationProgress:
+    """
+    记录已分发与已完成的卡组序号范围，用于断点续算。
+    每个任务为一段连续序号 [start, end) 中的卡组 (其中被跳过的序号同样视为完成)，
+    并记录生成该任务时被得分上限剪枝的卡组数量，完成时计入进度条。
+    任务由进程池的任务线程从生成器中拉取，结果在主线程中处理，因此需要加锁。
+    """
+
+    def __init__(self, start: int = 0, done: list[list[int]] = None):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.skipped = {}
+        self.done = {s: e for s, e in done or ()}
+        self.next_index = start
+        self.prune_at = len(self.done) + 4096
+
+    def dispatch(self, start: int, end: int, skipped: int = 0):
+        with self.lock:
+            self.pending[start] = end
+            self.next_index = end
+            if skipped:
+                self.skipped[start] = skipped
+
+    def complete(self, start: int) -> int:
+        """
+        标记任务完成，返回该任务对应的被剪枝卡组数量。
+        """
+        with self.lock:
+            self.done[start] = self.pending.pop(start)
+            if len(self.done) >= self.prune_at:
+                self._prune()
+            return self.skipped.pop(start, 0)
+
+    def _prune(self) -> int:
+        position = min(self.pending) if self.pending else self.next_index
+        self.done = {s: e for s, e in self.done.items() if e > position}
+        self.prune_at = 2 * len(self.done) + 4096
+        return position
+
+    def snapshot(self) -> tuple[int, list[list[int]]]:
+        """
+        返回 (position, done): position 之前的卡组均已完成，done 为 position 之后已完成的序号范围。
+        """
+        with self.lock:
+            position = self._prune()
+            return position, sorted([s, e] for s, e in self.done.items())
+
+
+def checkpoint_path(temp_dir: str, songs: list[tuple[str, str]]) -> str:
+    name = "_".join(f"{music_id}_{difficulty}" for music_id, difficulty in songs)
+    return os.path.join(temp_dir, f"checkpoint_{name}.json")
+
+
+def save_checkpoint(path: str, state: dict):
+    """
+    原子地写入断点文件，写入中途被中断时不会破坏上一个断点。
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, config: dict):
+    """
+    读取断点文件，模拟配置与断点不一致时返回 None。
+    """
+    if not os.path.exists(path):
+        logger.error(f"Checkpoint not found: {path}")
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        logger.error(f"Unsupported checkpoint version: {state.get('version')}")
+        return None
+    if state["config"] != config:
+        changed = [key for key in config if state["config"].get(key) != config[key]]
+        logger.error(f"Simulation config changed since the checkpoint was saved: {changed}")
+        return None
+    missing = [segment for song in state["songs"] for segment in song["segments"] if not os.path.exists(segment)]
+    if missing:
+        logger.error(f"Missing temp files: {missing}")
+        return None
+    return state
+
+
+def task_generator_func(decks_generator, chunk_size: int, progress: SimulationProgress = None, start: int = 0, done: list[list[int]] = None):
+    """
+    一个生成器函数，从 decks_generator 获取卡组，每 chunk_size 个打包为一个 run_simulation_chunk 任务。
+    续算时从序号 start 开始，并跳过 done 中已完成的序号范围。
+    被得分上限剪枝的卡组计入之后的第一个任务 (末尾的计入最后一个任务)，以便进度条到达总数。
+    """
+    done_indices = {i for s, e in done or () for i in range(s, e)}
+    skipped_seen = decks_generator.skipped_decks
+
+    def dispatch(chunk: list):
+        nonlocal skipped_seen
+        skipped = decks_generator.skipped_decks - skipped_seen
+        skipped_seen += skipped
+        if progress:
+            progress.dispatch(chunk[0][0], chunk[-1][0] + 1, skipped)
+
+    chunk = []
+    for i, deck_card_ids_list, center_card, friend_card in decks_generator.iter_decks(start, done_indices):
+        # 已满的任务在取得下一个卡组后才分发，使末尾被剪枝的卡组也能计入最后一个任务
+        if len(chunk) >= chunk_size:
+            dispatch(chunk)
+            yield chunk
+            chunk = []
+        chunk.append((i, deck_card_ids_list, center_card, friend_card))
+    if chunk:
+        dispatch(chunk)
+        yield chunk
 
 
 #  --- Main Execution Block for Parallel Simulation ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量模拟卡组")
+    parser.add_argument("--resume", action="store_true", help="从上次中断时保存的断点继续模拟 (需保持配置不变)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="只重新模拟log中包含练度或数据已改变的卡牌的卡组，并合并回原log (不在当前卡牌池中的旧结果会被移除)")
+    args = parser.parse_args()
+
     pypy_impl = python_implementation() == "PyPy"
     if pypy_impl:
         fix_windows_console_encoding()
@@ -160,6 +438,9 @@ if __name__ == "__main__":
     # 卡组包含DR或LR时，仍可以作为C位的非DR/LR卡牌
     # 若备选池中无DR，并且未指定其他卡牌作为C位卡牌，则会模拟所有可能的C位
     secondary_center = [1031533, 1032530, 1033528, 1051511, 1052511]
+    # 增量模拟: 填写上次完整模拟时的卡牌池 (card_ids) 后，只生成至少包含一张新卡牌的卡组
+    # 需保持其他限制条件与助战卡牌不变，且上次的模拟已完整合并到log；None 为生成全部卡组
+    previous_card_ids = None
     # 好友位的助战卡牌
     # 仅在无可用助战卡时模拟无助战的情况
     friend_card = []
@@ -183,55 +464,68 @@ if __name__ == "__main__":
     fixed_difficulty = "02"
     fixed_player_master_level = 50
 
-    # 强制指定歌曲C位和颜色
+    # 多曲模式: 填写 [(歌曲id, 难度), ...] 后忽略以上歌曲设置，卡组只生成一次并在所有歌曲上模拟，每首歌曲分别保存log
+    # 每首歌曲的C位分别筛选，不含某首歌曲C位角色的卡组不会在该歌曲上模拟
+    music_list = [
+        # ("405134", "02"),
+        # ("405118", "02"),
+    ]
+
+    # 强制指定歌曲C位和颜色 (多曲模式下对所有歌曲生效)
     center_override = None  # 1032
     color_override = None  # 1 # 1=Smile 2=Pure 3=Cool
 
     # 新增：批次大小和临时文件目录
-    BATCH_SIZE = 1_000_000  # 每100万条结果保存一个文件
+    BATCH_SIZE = 1_000_000  # 内存中每累计100万个卡组组成保存一个文件
     TEMP_OUTPUT_DIR = "temp"
     FINAL_OUTPUT_DIR = "log"
-
-    try:
-        pre_initialized_chart = Chart(MUSIC_DB, fixed_music_id, fixed_difficulty)
-        pre_initialized_chart.ChartEvents = [(float(t), e) for t, e in pre_initialized_chart.ChartEvents]
-        # pre_initialized_chart.ChartEvents = [(int(float(t) * 1_000_000) , e) for t, e in pre_initialized_chart.ChartEvents]
-
-        if center_override:
-            pre_initialized_chart.music.CenterCharacterId = center_override
-        if color_override:
-            pre_initialized_chart.music.MusicType = color_override
-        logger.info(f"Chart for {pre_initialized_chart.music.Title} (ID: {fixed_music_id}) and Difficulty {fixed_difficulty} pre-initialized.")
-    except Exception as e:
-        logger.error(f"Failed to pre-initialize Chart object: {e}")
-        exit()
+    # 最终log的保存格式: "json" 或 "bin" (体积更小、读取更快，可用 result_store.py 与 JSON 互相转换)
+    # 合并时读取已有的log (两种格式都存在时为 .bin)，保存为此格式后删除另一格式的log
+    LOG_FORMAT = "json"
+    # 模拟结束时输出 pt 前 N 名的卡组组成
+    TOP_N = 10
+    # 保存断点的间隔 (秒)，每次写入临时文件时也会保存断点；中断后使用 --resume 继续
+    CHECKPOINT_INTERVAL = 600
+    # 在线多曲求解: 运行中每隔 SNAPSHOT_INTERVAL 秒将每首歌曲前 ONLINE_TOP_N 名的组成写入临时目录，
+    # 同时运行 online_optimizer.py 即可实时更新多曲组合；0 为不写入
+    ONLINE_TOP_N = 0
+    SNAPSHOT_INTERVAL = 60
+
+    # 得分上限剪枝：模拟前估算每个卡组组成的得分上限，低于当前最高分 (含既有log) 的组成不再模拟
+    # 被跳过的卡组不会写入log，为多歌曲求解 (multi_song_optimizer.py) 准备数据时请保持关闭；多曲模式下不可用
+    BOUND_PRUNING = False
+
+    songs = music_list or [(fixed_music_id, fixed_difficulty)]
+    multi_chart = len(songs) > 1
+    charts = []
+    for music_id, difficulty in songs:
+        try:
+            pre_initialized_chart = Chart(music_db(), music_id, difficulty)
+            pre_initialized_chart.ChartEvents = [(float(t), e) for t, e in pre_initialized_chart.ChartEvents]
+            # pre_initialized_chart.ChartEvents = [(int(float(t) * 1_000_000) , e) for t, e in pre_initialized_chart.ChartEvents]
+
+            if center_override:
+                pre_initialized_chart.music.CenterCharacterId = center_override
+            if color_override:
+                pre_initialized_chart.music.MusicType = color_override
+            logger.info(f"Chart for {pre_initialized_chart.music.Title} (ID: {music_id}) and Difficulty {difficulty} pre-initialized.")
+        except Exception as e:
+            logger.error(f"Failed to pre-initialize Chart object: {e}")
+            exit()
+        charts.append(pre_initialized_chart)
 
     # BONUS_SFL = (len(pre_initialized_chart.music.SingerCharacterId) + 1) * 0.7 + 1
-    CENTERCHAR = str(pre_initialized_chart.music.CenterCharacterId)
 
-    # 移除除外池，并筛选C位角色的DR、LR
+    # 移除除外池，并筛选每首歌曲C位角色的DR、LR
     card_ids = list(set(card_ids) - set(exclude))
-    primary_center = set()
-    other_center = set()
-    for card in card_ids:
-        card_str = str(card)
-        if card_str[0:4] == CENTERCHAR:
-            if card_str[4] in ["7", "8"]:
-                primary_center.add(card)
-            else:
-                other_center.add(card)
-
-    # 添加备用C位池中的可用卡牌
-    center_char_id = pre_initialized_chart.music.CenterCharacterId
-    for card in secondary_center:
-        if card // 1000 == center_char_id and card in card_ids:
-            primary_center.add(card)
-
-    available_center = primary_center or other_center or set()
-    if available_center:
-        logger.info(f"Available center ({len(available_center)}): {available_center}")
-    else:
-        logger.info(f"Missing available center card")
+    available_centers = []
+    for chart in charts:
+        available_center = get_available_center(card_ids, chart.music.CenterCharacterId, secondary_center)
+        if available_center:
+            logger.info(f"Available center for {chart.music.Title} ({len(available_center)}): {available_center}")
+        else:
+            logger.info(f"Missing available center card for {chart.music.Title}")
+        available_centers.append(available_center)
     if friend_card:
         logger.info(f"Available friend ({len(friend_card)}): {set(friend_card)}")
     else:
@@ -240,118 +534,247 @@ if __name__ == "__main__":
     logger.info(f"Pre-calculating deck amount from {len(card_ids)} cards...")
 
     # 3. 获取卡组生成器
-    decks_generator = generate_decks_with_double_cards(
-        cardpool=card_ids,
-        mustcards=[mustcards_all, mustcards_any, mustskills_all],
-        center_char=center_char_id,  # 未指定center_char时会生成不含C位角色的卡组
-        center_card=available_center,
-        friend_card=set(friend_card),
-        log_path=os.path.join("log", f"simulation_results_{fixed_music_id}_{fixed_difficulty}.json"),
-    )
+    existing_logs = [log_path(music_id, difficulty) for music_id, difficulty in songs]
+    # 练度变化: 记录每首歌曲log中需要重新模拟的卡牌与组成
+    refresh_cards = [set() for _ in songs]
+    refresh_decks = [set() for _ in songs]
+    refresh_compositions = None
+    for i, existing_log in enumerate(existing_logs):
+        if not os.path.exists(existing_log):
+            continue
+        if args.refresh:
+            refresh_cards[i], refresh_decks[i] = find_stale_results(existing_log)
+            logger.info(f"{len(refresh_decks[i])} results to refresh in {existing_log}, changed cards: {sorted(refresh_cards[i])}")
+        else:
+            changed = stale_cards(existing_log, card_levels, card_data_hash)
+            if changed:
+                logger.warning(f"Card levels or data changed since {existing_log} was simulated: {sorted(changed)}. "
+                               f"Run with --refresh to re-simulate the affected decks.")
+    if args.refresh:
+        refresh_compositions = set().union(*refresh_decks)
+        if not refresh_compositions:
+            logger.info("No results need to be refreshed.")
+            exit()
+        # 重新模拟的组成不能被剪枝跳过，否则旧结果被移除后不会写回log
+        BOUND_PRUNING = False
+
+    score_bound = None
+    if BOUND_PRUNING and multi_chart:
+        logger.warning("Score bound pruning is not available for multiple charts, disabled.")
+        BOUND_PRUNING = False
+    if BOUND_PRUNING:
+        def score_bound(deck, centers, friends):
+            return composition_score_bound(deck, centers, friends, charts[0], fixed_player_master_level)
+
+    if multi_chart:
+        # 生成不限C位的全部卡组，由工作进程按每首歌曲的C位筛选
+        decks_generator = generate_decks_with_double_cards(
+            cardpool=card_ids,
+            mustcards=[mustcards_all, mustcards_any, mustskills_all],
+            friend_card=set(friend_card),
+            log_path=None if args.refresh else existing_logs,
+            compositions=refresh_compositions,
+            previous_pool=None if args.refresh else previous_card_ids,
+        )
+        song_specs = [
+            (chart, chart.music.CenterCharacterId, frozenset(available_center))
+            for chart, available_center in zip(charts, available_centers)
+        ]
+    else:
+        decks_generator = generate_decks_with_double_cards(
+            cardpool=card_ids,
+            mustcards=[mustcards_all, mustcards_any, mustskills_all],
+            center_char=charts[0].music.CenterCharacterId,  # 未指定center_char时会生成不含C位角色的卡组
+            center_card=available_centers[0],
+            friend_card=set(friend_card),
+            log_path=None if args.refresh else existing_logs[0],
+            score_bound=score_bound,
+            compositions=refresh_compositions,
+            previous_pool=None if args.refresh else previous_card_ids,
+        )
+        song_specs = [(charts[0], None, None)]
     total_decks_to_simulate = decks_generator.total_decks
-    logger.info(f"{total_decks_to_simulate} decks to be simulated.")
+    if decks_generator.new_cards is not None:
+        # 增量模式的总数在生成过程中修正，进度条随之更新
+        logger.info(f"{total_decks_to_simulate} candidate compositions to be simulated.")
+    else:
+        logger.info(f"{total_decks_to_simulate} decks to be simulated.")
+
+    os.makedirs(TEMP_OUTPUT_DIR, exist_ok=True)
+    os.makedirs(FINAL_OUTPUT_DIR, exist_ok=True)
+
+    batch_songs = [BatchSong(music_id, difficulty, card_ids + friend_card, max(TOP_N, ONLINE_TOP_N)) for music_id, difficulty in songs]
+    results_processed_count = 0  # 已模拟的卡组总数
+    skipped_processed_count = 0  # 已完成的任务中被得分上限剪枝的卡组总数
+
+    # 断点: 记录生成器位置、已写入的临时文件与当前最高分
+    checkpoint_file = checkpoint_path(TEMP_OUTPUT_DIR, songs)
+    checkpoint_config = {
+        "songs": [[music_id, difficulty] for music_id, difficulty in songs],
+        "player_master_level": fixed_player_master_level,
+        "cards": sorted(card_ids),
+        "friend_card": sorted(friend_card),
+        "center_card": [sorted(available_center) for available_center in available_centers],
+        "mustcards": [sorted(mustcards_all), sorted(mustcards_any), sorted(skill.value for skill in mustskills_all)],
+        "center_override": center_override,
+        "color_override": color_override,
+        "log": existing_logs,
+        "total_decks": total_decks_to_simulate,
+        "refresh": args.refresh,
+        "previous_cards": sorted(previous_card_ids) if previous_card_ids is not None and not args.refresh else None,
+    }
+    start_position = 0
+    done_indices = []
+    if args.resume:
+        state = load_checkpoint(checkpoint_file, checkpoint_config)
+        if state is None:
+            exit()
+        start_position = state["position"]
+        done_indices = state["done"]
+        results_processed_count = state["results_processed"]
+        skipped_processed_count = state.get("skipped_processed", 0)
+        for song, song_state in zip(batch_songs, state["songs"]):
+            song.load_state(song_state)
+        decks_generator.best_score = max(decks_generator.best_score, batch_songs[0].best_score)
+        logger.info(f"Resuming from deck {start_position} ({results_processed_count} simulated)")
+    elif os.path.exists(checkpoint_file):
+        logger.warning(f"Unfinished run found ({checkpoint_file}), it will be overwritten. Use --resume to continue it.")
+
+    progress = SimulationProgress(start_position, done_indices)
+
+    def checkpoint():
+        # 先记录位置再写入当前批次，保证位置之前的结果均已落盘
+        position, done = progress.snapshot()
+        for song in batch_songs:
+            if len(song.aggregator):
+                song.save_batch(TEMP_OUTPUT_DIR)
+        save_checkpoint(checkpoint_file, {
+            "version": CHECKPOINT_VERSION,
+            "config": checkpoint_config,
+            "position": position,
+            "done": done,
+            "results_processed": results_processed_count,
+            "skipped_processed": skipped_processed_count,
+            "songs": [song.state() for song in batch_songs],
+        })
+        if ONLINE_TOP_N:
+            save_snapshots()
+
+    def save_snapshots():
+        for song in batch_songs:
+            if song.best_score != -1:
+                song.save_snapshot(TEMP_OUTPUT_DIR)
 
     # 4. 创建模拟任务生成器
     # task_generator_func 会按需从 generated_decks_generator 中拉取卡组
+    # 若 CPU 占用率偏低，可以在此增加每个任务包含的卡组数量
+    if pypy_impl:
+        chunksize = 10000
+    else:
+        chunksize = 500
     simulation_tasks_generator = task_generator_func(
-        decks_generator, pre_initialized_chart, fixed_player_master_level
+        decks_generator, chunksize, progress, start_position, done_indices
     )
 
-    os.makedirs(TEMP_OUTPUT_DIR, exist_ok=True)
-    os.makedirs(FINAL_OUTPUT_DIR, exist_ok=True)
-
     # Use multiprocessing.Pool with imap_unordered
     num_processes = os.cpu_count() or 1
     logger.info(f"Starting parallel simulations using {num_processes} processes...")
-    best_score = -1
-    best_deck_info = None  # 存储最佳卡组的完整信息
-    best_log = []
-
-    current_batch_results = []  # 存储当前批次的结果
-    temp_files = []            # 存储所有临时文件的路径
-    batch_counter = 0          # 批次计数器
-    results_processed_count = 0  # 已处理结果的总数
-
-    with multiprocessing.Pool(processes=num_processes) as pool:
-        # 若 CPU 占用率偏低，可以在此增加每次获取任务时给单个进程分配的卡组数量
-        if pypy_impl:
-            chunksize = 10000
-        else:
-            chunksize = 500
-        results_iterator = pool.imap_unordered(run_game_simulation, simulation_tasks_generator, chunksize)
-        with logging_redirect_tqdm():
-            for result in tqdm(results_iterator, total=total_decks_to_simulate):
-                current_score = result['final_score']
-                original_index = result['original_deck_index']
-                current_log = result["cards_played_log"]
-                deck_card_ids = result['deck_card_ids']
-                center_card = result['center_card']
-                friend_card = result['friend_card']
-
-                # 记录当前卡组的得分、卡牌、C位卡牌，添加到结果列表中
-                current_batch_results.append({
-                    "deck_card_ids": deck_card_ids,  # 使用卡牌ID列表
-                    "center_card": center_card,
-                    "friend_card": friend_card,
-                    "score": current_score,
-                })
-                results_processed_count += 1
-
-                if current_score > best_score:
-                    best_score = current_score
-                    best_deck_info = {
-                        "original_index": original_index,
-                        "deck_card_ids": deck_card_ids,
-                        "center_card": center_card,
-                        "friend_card": friend_card,
-                        "score": current_score
-                    }
-                    best_log = current_log
-                    logger.info(f"NEW HI-SCORE! Deck: {original_index}, Score: {current_score:,}")
-                    logger.info(f"  Cards: {deck_card_ids}")
-                    logger.info(f"  Center: {center_card}   Friend: {friend_card}")
-
-                if len(current_batch_results) >= BATCH_SIZE:
-                    batch_counter += 1
-                    temp_filename = os.path.join(TEMP_OUTPUT_DIR, f"temp_batch_{batch_counter:0>3}.json")
-                    save_simulation_results(current_batch_results, temp_filename)
-                    temp_files.append(temp_filename)
-                    current_batch_results = []  # 清空当前批次列表
+    last_checkpoint_time = last_snapshot_time = time.time()
+
+    # 谱面等共用参数只在进程启动时传递一次，工作进程按任务汇总后返回紧凑结果
+    with multiprocessing.Pool(
+            processes=num_processes, initializer=init_batch_worker,
+            initargs=(song_specs, fixed_player_master_level, batch_songs[0].aggregator.cards)
+    ) as pool:
+        results_iterator = pool.imap_unordered(run_simulation_chunk, simulation_tasks_generator)
+        try:
+            with logging_redirect_tqdm(), tqdm(total=total_decks_to_simulate,
+                                                initial=results_processed_count + skipped_processed_count) as pbar:
+                for chunk_start, chunk_count, song_results in results_iterator:
+                    # 记录每首歌曲上每个组成的最高分 (含得分、卡牌、C位卡牌)
+                    for song, (count, packed_results, chunk_best) in zip(batch_songs, song_results):
+                        if song.add_chunk(count, packed_results, chunk_best):
+                            info = song.best_deck_info
+                            if not multi_chart:
+                                decks_generator.best_score = max(decks_generator.best_score, song.best_score)
+                            song_name = f" [{song.music_id} ({song.difficulty})]" if multi_chart else ""
+                            logger.info(f"NEW HI-SCORE!{song_name} Deck: {info['original_index']}, Score: {song.best_score:,}")
+                            logger.info(f"  Cards: {info['deck_card_ids']}")
+                            logger.info(f"  Center: {info['center_card']}   Friend: {info['friend_card']}")
+
+                    results_processed_count += chunk_count
+                    # 被得分上限剪枝的卡组同样计入进度
+                    skipped = progress.complete(chunk_start)
+                    skipped_processed_count += skipped
+                    if pbar.total != decks_generator.total_decks:
+                        # 增量模式下生成器按实际卡组数量修正总数
+                        pbar.total = decks_generator.total_decks
+                    pbar.update(chunk_count + skipped)
+                    if any(len(song.aggregator) >= BATCH_SIZE for song in batch_songs) or \
+                            time.time() - last_checkpoint_time >= CHECKPOINT_INTERVAL:
+                        checkpoint()
+                        last_checkpoint_time = last_snapshot_time = time.time()
+                    elif ONLINE_TOP_N and time.time() - last_snapshot_time >= SNAPSHOT_INTERVAL:
+                        save_snapshots()
+                        last_snapshot_time = time.time()
+        except KeyboardInterrupt:
+            checkpoint()
+            logger.info(f"Interrupted. Checkpoint saved to {checkpoint_file}, run with --resume to continue.")
+            exit()
 
         # --- 处理最后一批可能不满BATCH_SIZE的结果 ---
-        if current_batch_results:
-            batch_counter += 1
-            temp_filename = os.path.join(TEMP_OUTPUT_DIR, f"temp_batch_{batch_counter:0>3}.json")
-            save_simulation_results(current_batch_results, temp_filename)
-            temp_files.append(temp_filename)
-            current_batch_results = []  # 清空
+        # 合并前保存断点，合并失败时可以使用 --resume 重新合并
+        checkpoint()
 
     end_time = time.time()
     logger.info("--- All simulations completed! ---")
     logger.info(f"Total simulation time: {end_time - start_time:.2f} seconds")
 
     # --- Step 4: Save all results to JSON ---
-    if best_score != -1:
-        all_simulation_results = []
-        for temp_file in tqdm(temp_files, desc="Merging Files"):
-            with open(temp_file, 'r') as f:
-                all_simulation_results.extend(json.load(f))
-            os.remove(temp_file)
-        json_output_filename = os.path.join("log", f"simulation_results_{fixed_music_id}_{fixed_difficulty}.json")
-        save_simulation_results(all_simulation_results, json_output_filename, calc_pt=True)
+    merged = True
+    for song, existing_log, drop, refreshed in zip(batch_songs, existing_logs, refresh_decks, refresh_cards):
+        if song.best_score == -1 and not drop:
+            continue
+        logger.info(f"Merging {len(song.temp_files)} temp files...")
+        output_filename = log_path(song.music_id, song.difficulty, LOG_FORMAT)
+        # 多曲模式下生成器只跳过所有歌曲均已模拟的组成，合并时需去除该歌曲log中已有的组成 (需要刷新的除外)
+        exclude = load_simulated_decks(existing_log)[0] - drop if multi_chart else None
+        merged &= merge_simulation_results(song.temp_files, output_filename, merge_log=existing_log,
+                                           run_size=BATCH_SIZE, exclude=exclude, drop=drop, refreshed=refreshed)
+    if merged:
+        for song in batch_songs:
+            for temp_file in song.temp_files:
+                os.remove(temp_file)
+            # 结果已合并到最终log，快照不再需要
+            snapshot_file = snapshot_path(song.music_id, song.difficulty, TEMP_OUTPUT_DIR)
+            if os.path.exists(snapshot_file):
+                os.remove(snapshot_file)
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+    else:
+        logger.error(f"Temp files are kept, run with --resume to merge them again.")
 
     # --- Step 5: Final Summary ---
     logger.info(f"\n--- Final Simulation Summary ---")
-    logger.info(f"Map: {MUSIC_DB.get_music_by_id(fixed_music_id).Title} ({fixed_difficulty})")
-    logger.info(f"Total simulations run: {results_processed_count}")
-    if best_score != -1:
-        logger.info(f"Best Score: {best_score:,}")
-        logger.info(f"Best Deck: {best_deck_info['original_index']}\t Center: {best_deck_info['center_card']}\t Friend: {best_deck_info['friend_card']}")
-        logger.info(f"Cards: {best_deck_info['deck_card_ids']}")
-        best_log_str = [" | ".join(best_log[i:i + 3])
-                        for i in range(0, len(best_log), 3)]
-        best_log_str = '\n'.join(best_log_str)
-        logger.info(f"Log ({len(best_log)}):")
-        logger.info(best_log_str)
-    else:
-        logger.info("No simulations yielded a score.")
+    logger.info(f"Total decks simulated: {results_processed_count}")
+    if BOUND_PRUNING:
+        logger.info(f"Compositions skipped by score bound: {decks_generator.skipped_compositions} ({decks_generator.skipped_decks} decks)")
+    for song in batch_songs:
+        logger.info(f"Map: {music_db().get_music_by_id(song.music_id).Title} ({song.difficulty})")
+        logger.info(f"Total simulations run: {song.aggregator.count}")
+        if song.best_score != -1:
+            best_deck_info = song.best_deck_info
+            best_log = song.best_log
+            logger.info(f"Best Score: {song.best_score:,}")
+            logger.info(f"Best Deck: {best_deck_info['original_index']}\t Center: {best_deck_info['center_card']}\t Friend: {best_deck_info['friend_card']}")
+            logger.info(f"Cards: {best_deck_info['deck_card_ids']}")
+            best_log_str = [" | ".join(best_log[i:i + 3])
+                            for i in range(0, len(best_log), 3)]
+            best_log_str = '\n'.join(best_log_str)
+            logger.info(f"Log ({len(best_log)}):")
+            logger.info(best_log_str)
+            logger.info(f"Top {TOP_N} compositions:")
+            for rank, result in enumerate(score2pt(song.aggregator.top_results()[:TOP_N]), 1):
+                logger.info(f"  {rank:>3}. Pt: {result['pt']:,}\t Score: {result['score']:,}\t Center: {result['center_card']}\t Friend: {result['friend_card']}\t Cards: {result['deck_card_ids']}")
+        else:
+            logger.info("No simulations yielded a score.")
@@ -107,3 +107,7 @@ if __name__ == "__main__":
         format='%(message)s'
     )
     convert_all_yaml_files()
+
+    # 同时编译二进制数据库
+    from card_store import build_store
+    build_store()
@@ -3,14 +3,48 @@ import json
 import yaml
 import csv
 import os
+import glob
+import hashlib
+import pickle
 import logging
+import argparse
+import multiprocessing
+from bisect import bisect_left
+from math import floor, log10
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import cached_property
 from enum import Enum
 from typing import Dict, List, Optional  # Import necessary types
 
 logger = logging.getLogger(__name__)
 
+# 优先使用 libyaml 的 C 解析器
+try:
+    from yaml import CFullLoader as YamlLoader
+except ImportError:
+    from yaml import FullLoader as YamlLoader
+
+# Musics.yaml 的解析缓存目录，按文件内容哈希区分版本
+MUSIC_CACHE_DIR = os.path.join("Data", "cache")
+MUSIC_CACHE_VERSION = 1
+# 编译后谱面的缓存目录，按 .bytes、musicscore CSV 与歌曲信息的哈希区分版本
+CHART_CACHE_DIR = os.path.join("Data", "cache", "charts")
+CHART_CACHE_VERSION = 2
+# 判定时间的比较误差，来自 RhythmGameConsts.NoteError = 0.0001
+NOTE_ERROR = 0.00010001  # 避免实际差值0.1但浮点精度下的差值>0.1极端情况
+# 判定为音符的事件，可以合并为带权事件
+NOTE_EVENTS = frozenset(("Single", "Hold", "HoldMid", "Flick", "Trace"))
+
+
+def round_sig(value: float, digits: int = 7) -> float:
+    """
+    按有效数字四舍五入，结果与 float(f"{value:.7g}") 相同，但不经过字符串。
+    """
+    if value == 0:
+        return 0.0
+    return round(value, digits - 1 - floor(log10(abs(value))))
+
 
 @dataclass
 class Music:
@@ -71,15 +105,31 @@ class Music:
 
 
 class MusicDB:
-    def __init__(self, yaml_filepath: str = os.path.join("Data", "Musics.yaml")) -> None:
+    # 建立二级索引的字段，列表字段 (SingerCharacterId) 按其中每个元素索引
+    INDEXED_ATTRS = ("CenterCharacterId", "MusicType", "UnitId", "SingerCharacterId")
+
+    def __init__(self, yaml_filepath: str = os.path.join("Data", "Musics.yaml"), use_cache: bool = True) -> None:
         self.db: List[Music] = []  # Stores all Music objects
         self._id_map: Dict[int, Music] = {}  # Optimized for ID lookups
+        self._indexes: Dict[str, Dict[object, List[Music]]] = {}
 
         if not os.path.exists(yaml_filepath):
             raise FileNotFoundError(f"Music database file not found at: {yaml_filepath}")
 
-        with open(yaml_filepath, encoding="UTF-8") as f:
-            data = yaml.load(f, Loader=yaml.FullLoader)
+        with open(yaml_filepath, 'rb') as f:
+            raw = f.read()
+        cache_path = self._cache_path(yaml_filepath, self._cache_key(raw)) if use_cache else None
+        if not (cache_path and self._load_cache(cache_path)):
+            self._parse(raw, yaml_filepath)
+            if cache_path:
+                self._save_cache(yaml_filepath, cache_path)
+
+        for music_obj in self.db:
+            self._id_map[music_obj.Id] = music_obj  # Populate ID map for O(1) lookup
+        self._build_indexes()
+
+    def _parse(self, raw: bytes, yaml_filepath: str):
+        data = yaml.load(raw, Loader=YamlLoader)
 
         if not isinstance(data, list):
             raise ValueError(f"Expected a list of music entries in {yaml_filepath}, but got {type(data)}")
@@ -88,11 +138,58 @@ class MusicDB:
             try:
                 music_obj = Music(**info_dict)
                 self.db.append(music_obj)
-                self._id_map[music_obj.Id] = music_obj  # Populate ID map for O(1) lookup
             except TypeError as e:
                 logger.debug(f"Warning: Could not create Music object from data {info_dict}. Error: {e}")
                 # Log or handle missing/invalid required fields
 
+    @staticmethod
+    def _cache_key(raw: bytes) -> str:
+        digest = hashlib.sha1(f"{MUSIC_CACHE_VERSION}|".encode())
+        digest.update(raw)
+        return digest.hexdigest()[:16]
+
+    @staticmethod
+    def _cache_path(yaml_filepath: str, cache_key: str = "*") -> str:
+        name = os.path.splitext(os.path.basename(yaml_filepath))[0]
+        return os.path.join(MUSIC_CACHE_DIR, f"{name}_{cache_key}.pickle")
+
+    def _load_cache(self, cache_path: str) -> bool:
+        try:
+            with open(cache_path, 'rb') as f:
+                self.db = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.debug(f"Failed to load music cache: {e}")
+            self.db = []
+            return False
+        return True
+
+    def _save_cache(self, yaml_filepath: str, cache_path: str):
+        try:
+            os.makedirs(MUSIC_CACHE_DIR, exist_ok=True)
+            # 删除同一文件的旧缓存
+            for old_path in glob.glob(self._cache_path(yaml_filepath)):
+                os.remove(old_path)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.db, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logger.debug(f"Failed to save music cache: {e}")
+
+    def _build_indexes(self):
+        for attr in self.INDEXED_ATTRS:
+            index: Dict[object, List[Music]] = {}
+            for music in self.db:
+                value = getattr(music, attr)
+                for key in (value if isinstance(value, list) else (value,)):
+                    bucket = index.setdefault(key, [])
+                    # 列表字段中重复的元素只索引一次
+                    if not bucket or bucket[-1] is not music:
+                        bucket.append(music)
+            self._indexes[attr] = index
+
     def get_music_by_id(self, music_id: int | str) -> Optional[Music]:
         """
         Retrieves a Music object by its ID.
@@ -109,6 +206,53 @@ class MusicDB:
 
         return self._id_map.get(music_id)  # O(1) lookup
 
+    @staticmethod
+    def _matches(music: Music, filters: dict) -> bool:
+        for attr, value in filters.items():
+            if not hasattr(music, attr):
+                return False  # Attribute does not exist on this music object
+
+            music_attr_value = getattr(music, attr)
+
+            if isinstance(music_attr_value, list):
+                # Special handling for list attributes (e.g., SingerCharacterId)
+                # If the filter value is an int, check if it's in the list
+                if isinstance(value, int):
+                    if value not in music_attr_value:
+                        return False
+                # If the filter value is a list, check if all filter values are in the music's list
+                elif isinstance(value, list):
+                    if not all(item in music_attr_value for item in value):
+                        return False
+                else:  # If filter value is other type for a list attribute, no match
+                    return False
+            elif music_attr_value != value:  # Direct comparison for non-list attributes
+                return False
+        return True
+
+    def _candidates(self, filters: dict) -> List[Music]:
+        """
+        利用索引取得候选歌曲: 各索引字段分别查出的歌曲中数量最少的一组，没有可用索引时为全部歌曲。
+        候选保持 db 中的顺序，仍需用 _matches 检查其余条件。
+        """
+        candidates = self.db
+        for attr, value in filters.items():
+            index = self._indexes.get(attr)
+            if index is None:
+                continue
+            if isinstance(value, list):
+                # 列表条件要求包含全部元素，取其中任一元素的索引即可
+                if attr != "SingerCharacterId" or not value:
+                    continue
+                value = value[0]
+            try:
+                bucket = index.get(value, [])
+            except TypeError:  # 不可哈希的条件值
+                continue
+            if len(bucket) < len(candidates):
+                candidates = bucket
+        return candidates
+
     def find_music_ids(self, **filters) -> List[int]:
         """
         Finds music IDs that match all provided filter criteria.
@@ -122,42 +266,12 @@ class MusicDB:
         Returns:
             List[int]: A list of IDs of matching songs.
         """
-        matching_ids: List[int] = []
-        for music in self.db:
-            match = True
-            for attr, value in filters.items():
-                if not hasattr(music, attr):
-                    match = False
-                    break  # Attribute does not exist on this music object
-
-                music_attr_value = getattr(music, attr)
-
-                if isinstance(music_attr_value, list):
-                    # Special handling for list attributes (e.g., SingerCharacterId)
-                    # If the filter value is an int, check if it's in the list
-                    if isinstance(value, int):
-                        if value not in music_attr_value:
-                            match = False
-                            break
-                    # If the filter value is a list, check if all filter values are in the music's list
-                    elif isinstance(value, list):
-                        if not all(item in music_attr_value for item in value):
-                            match = False
-                            break
-                    else:  # If filter value is other type for a list attribute, no match
-                        match = False
-                        break
-                elif music_attr_value != value:  # Direct comparison for non-list attributes
-                    match = False
-                    break
-
-            if match:
-                matching_ids.append(music.Id)
-        return matching_ids
+        return [music.Id for music in self.find_music(**filters)]
 
     def find_music(self, **filters) -> List[Music]:
         """
         Finds Music objects that match all provided filter criteria.
+        Filters on INDEXED_ATTRS are answered from the secondary indexes.
 
         Args:
             **filters: Keyword arguments where key is the attribute name
@@ -166,36 +280,8 @@ class MusicDB:
         Returns:
             List[Music]: A list of matching Music objects.
         """
-        matching_music: List[Music] = []
-        for music in self.db:
-            match = True
-            for attr, value in filters.items():
-                if not hasattr(music, attr):
-                    match = False
-                    break  # Attribute does not exist on this music object
-
-                music_attr_value = getattr(music, attr)
-
-                if isinstance(music_attr_value, list):
-                    # Special handling for list attributes (e.g., SingerCharacterId)
-                    if isinstance(value, int):
-                        if value not in music_attr_value:
-                            match = False
-                            break
-                    elif isinstance(value, list):
-                        if not all(item in music_attr_value for item in value):
-                            match = False
-                            break
-                    else:
-                        match = False
-                        break
-                elif music_attr_value != value:
-                    match = False
-                    break
-
-            if match:
-                matching_music.append(music)
-        return matching_music
+        candidates = self._candidates(filters)
+        return [music for music in candidates if self._matches(music, filters)]
 
 
 class NoteTypes(Enum):
@@ -210,8 +296,8 @@ class NoteTypes(Enum):
 
 class Note:
     def __init__(self, **kwargs) -> None:
-        self.just: str
-        self.holds: list[str] = []
+        self.just: float
+        self.holds: list[float] = []
         self.Uid: int
         self.Flags: int
         self.Type: int
@@ -280,22 +366,85 @@ class Note:
 
 
 class Chart:
-    def __init__(self, db: MusicDB, MusicId, Tier) -> None:
+    # 写入缓存的谱面数据 (歌曲信息 music 不缓存，每次从 MusicDB 获取)
+    CACHED_ATTRS = ("AllNoteSize", "ChartNoteUnit", "ChartNoteTime", "ChartEvents", "FeverStartTime", "FeverEndTime", "bpm")
+
+    def __init__(self, db: MusicDB, MusicId, Tier, use_cache: bool = True) -> None:
         self.AllNoteSize: int = 0
         self.ChartNoteUnit: list[Note] = []
-        self.ChartNoteTime: list[str] = []
-        self.ChartEvents: list[(str, str)] = []
+        self.ChartNoteTime: list[float] = []
+        self.ChartEvents: list[tuple[float, str]] = []
         self.FeverStartTime: float = 0
         self.FeverEndTime: float = 0
         self.music = db.get_music_by_id(MusicId)
         self.tier = Tier
         self.bpm = []
+        cache_key = self._cache_key() if use_cache else None
+        if cache_key and self._load_cache(cache_key):
+            return
         self._loadbytes(Tier)
         self._loadcsv()
         self._initevents()
+        if cache_key:
+            self._save_cache(cache_key)
+
+    def _bytes_path(self) -> str:
+        return os.path.join("Data", "bytes", f"rhythmgame_chart_{self.music.Id}_{self.tier}.bytes")
+
+    def _csv_path(self) -> str:
+        return os.path.join("Data", "csv", f"musicscore_{self.music.Id}.csv")
+
+    def _cache_path(self, cache_key: str = "*") -> str:
+        return os.path.join(CHART_CACHE_DIR, f"chart_{self.music.Id}_{self.tier}_{cache_key}.pickle")
+
+    def _cache_key(self) -> Optional[str]:
+        """
+        由 .bytes、musicscore CSV 的内容与谱面用到的歌曲信息计算缓存键，谱面文件不存在时返回 None。
+        歌曲信息只取 PlayTime 与 FeverSectionNo，Musics.yaml 中其他歌曲的变动不会使缓存失效。
+        """
+        digest = hashlib.sha1(f"{CHART_CACHE_VERSION}|{self.music.PlayTime}|{self.music.FeverSectionNo}".encode())
+        try:
+            with open(self._bytes_path(), 'rb') as f:
+                digest.update(f.read())
+            with open(self._csv_path(), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            return None
+        return digest.hexdigest()[:16]
+
+    def _load_cache(self, cache_key: str) -> bool:
+        try:
+            with open(self._cache_path(cache_key), 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.debug(f"Failed to load chart cache: {e}")
+            return False
+        if data.get("version") != CHART_CACHE_VERSION:
+            return False
+        self.__dict__.update(data["attrs"])
+        return True
+
+    def _save_cache(self, cache_key: str):
+        path = self._cache_path(cache_key)
+        try:
+            os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+            # 删除同一谱面的旧缓存
+            for old_path in glob.glob(self._cache_path()):
+                os.remove(old_path)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({
+                    "version": CHART_CACHE_VERSION,
+                    "attrs": {name: getattr(self, name) for name in self.CACHED_ATTRS},
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"Failed to save chart cache: {e}")
 
     def _loadbytes(self, Tier):
-        bytes_path = os.path.join("Data", "bytes", f"rhythmgame_chart_{self.music.Id}_{Tier}.bytes")
+        bytes_path = self._bytes_path()
         try:
             with open(bytes_path, 'rb') as f:
                 compressed_data = f.read()
@@ -333,35 +482,54 @@ class Chart:
             self.bpm.append(bpm_data)
 
         for note_data in chart_data["Notes"]:
-            self.ChartNoteUnit.append(Note(**note_data))
-
-        hold_notes: list[Note] = []
-        for note in self.ChartNoteUnit:
-            if note.Type == 1:
-                hold_notes.append(note)
-
-        NOTE_ERROR = 0.00010001  # 避免实际差值0.1但浮点精度下的差值>0.1极端情况
-        for index, note in enumerate(hold_notes):
-            end_time = float(note.holds[-1])
-            for note_next in hold_notes[index + 1:]:
-                next_start_time = float(note_next.just)
-                if end_time < next_start_time - NOTE_ERROR:
-                    break
-                elif abs(end_time - next_start_time) < NOTE_ERROR and note.EndPos == note_next.StartPos:
-                    note.next_note = note_next
-                    note_next.prev_note = note
-                    break
+            note = Note(**note_data)
+            # 判定时间统一转换为数值，之后不再经过字符串
+            note.just = float(note.just)
+            note.holds = [float(timestamp) for timestamp in note.holds]
+            self.ChartNoteUnit.append(note)
 
+        self._link_holds()
         self._merge_holds()
 
         for note in self.ChartNoteUnit:
             self.ChartNoteTime.append(note.just)
             self.ChartNoteTime += note.holds
         self.AllNoteSize = len(self.ChartNoteTime)
-        self.ChartNoteTime.sort(key=float)
+        self.ChartNoteTime.sort()
+
+    def _link_holds(self):
+        """
+        将首尾相接的Hold音符链接为链条: 前一段的结束时间与后一段的开始时间相差小于 NOTE_ERROR，且结束位置与开始位置相同。
+        按开始位置建立开始时间有序的索引，每个Hold只需二分查找候选，总体 O(n log n)。
+        与逐个向后扫描相同，链接到开始时间最早的 (同时间时取谱面中靠前的) 符合条件的Hold。
+        """
+        hold_notes = [note for note in self.ChartNoteUnit if note.Type == 1]
+        hold_notes.sort(key=lambda note: note.just)
+
+        # 开始位置 -> (开始时间列表, hold_notes 下标列表)，均按开始时间升序
+        index_by_pos: dict[tuple[int, int], tuple[list[float], list[int]]] = {}
+        for index, note in enumerate(hold_notes):
+            starts, indices = index_by_pos.setdefault(note.StartPos, ([], []))
+            starts.append(note.just)
+            indices.append(index)
+
+        for index, note in enumerate(hold_notes):
+            candidates = index_by_pos.get(note.EndPos)
+            if candidates is None:
+                continue
+            starts, indices = candidates
+            end_time = note.holds[-1]
+            k = bisect_left(starts, end_time - 2 * NOTE_ERROR)
+            while k < len(starts) and starts[k] < end_time + 2 * NOTE_ERROR:
+                if indices[k] > index and abs(end_time - starts[k]) < NOTE_ERROR:
+                    note_next = hold_notes[indices[k]]
+                    note.next_note = note_next
+                    note_next.prev_note = note
+                    break
+                k += 1
 
     def _loadcsv(self):
-        csv_path = os.path.join("Data", "csv", f"musicscore_{self.music.Id}.csv")
+        csv_path = self._csv_path()
         try:
             with open(csv_path, 'r', encoding="UTF-8") as f:
                 csv_data = csv.DictReader(f)
@@ -386,8 +554,8 @@ class Chart:
             self.FeverEndTime = section[fever - 1] / 1000
 
     def _initevents(self):
-        self.ChartEvents.append(("0", "LiveStart"))
-        self.ChartEvents.append((str(self.FeverStartTime), "FeverStart"))
+        self.ChartEvents.append((0.0, "LiveStart"))
+        self.ChartEvents.append((self.FeverStartTime, "FeverStart"))
         for note in self.ChartNoteUnit:
             self.ChartEvents.append((note.just, NoteTypes(note.Type).name))
             for index, timestamp in enumerate(note.holds, 1):
@@ -396,10 +564,27 @@ class Chart:
                 else:
                     self.ChartEvents.append((timestamp, "Hold"))
 
-        self.ChartEvents.append((str(self.FeverEndTime), "FeverEnd"))
-        self.ChartEvents.append((str(self.music.PlayTime / 1000), "LiveEnd"))
+        self.ChartEvents.append((self.FeverEndTime, "FeverEnd"))
+        self.ChartEvents.append((self.music.PlayTime / 1000, "LiveEnd"))
 
-        self.ChartEvents.sort(key=lambda event: float(event[0]))
+        self.ChartEvents.sort(key=lambda event: event[0])
+
+    @cached_property
+    def CompressedEvents(self) -> list[tuple[float, str, int]]:
+        """
+        将 ChartEvents 中同一时刻连续的同类音符 (多押、多条长按的判定点) 合并为一个带权事件 (时刻, 事件, 数量)，
+        其他事件的数量为 1。按数量展开后与 ChartEvents 完全相同，供批量模拟按组处理。
+        第一次访问时由当前的 ChartEvents 生成。
+        """
+        events = []
+        for timestamp, event in self.ChartEvents:
+            if events and event in NOTE_EVENTS:
+                last_timestamp, last_event, count = events[-1]
+                if last_event == event and last_timestamp == timestamp:
+                    events[-1] = (timestamp, event, count + 1)
+                    continue
+            events.append((timestamp, event, 1))
+        return events
 
     def _GetHolds_multi_bpm(self, start_time: float, end_time: float) -> list[float]:
         """
@@ -419,12 +604,10 @@ class Chart:
             list[float]: A list of float timestamps representing the intermediate
                         points of the hold note, including the final end_time.
                         Returns an empty list if start_time >= end_time.
+                        Timestamps are rounded to 7 significant digits (same as the chart data).
         """
         holds: list[float] = []
 
-        start_time = float(start_time)
-        end_time = float(end_time)
-
         # Handle invalid input or zero-duration holds
         if start_time >= end_time:
             return holds
@@ -444,15 +627,11 @@ class Chart:
 
         current_time = start_time
 
-        # Use the game's exact NoteError for floating-point comparisons
-        # This comes from RhythmGameConsts.NoteError = 0.0001
-        NOTE_ERROR = 0.00010001  # <--- 避免实际差值0.1但浮点精度下差值>0.1的极端情况
-
         current_time += half_beat_duration
         while current_time < end_time - NOTE_ERROR:
 
             # Add the current time to our list
-            holds.append(f"{current_time:.7g}")
+            holds.append(round_sig(current_time))
 
             # Move to the next half-beat
             current_time += half_beat_duration
@@ -472,8 +651,8 @@ class Chart:
         # This matches the behavior observed in the decompiled code.
         # We also check for approximate equality to avoid adding duplicate end_time if it was the last point
         # added by the loop because it landed exactly on `end_time`.
-        if not holds or abs(float(holds[-1]) - end_time) > NOTE_ERROR:
-            holds.append(f"{end_time:.7g}")
+        if not holds or abs(holds[-1] - end_time) > NOTE_ERROR:
+            holds.append(round_sig(end_time))
 
         return holds
 
@@ -618,12 +797,71 @@ class Chart:
                 processed_note_ids.add(note.Uid)  # 标记为已处理 (以防后续处理到)
 
         # 排序最终的音符列表，通常按时间排序
-        merged_notes.sort(key=lambda note: float(note.just))
+        merged_notes.sort(key=lambda note: note.just)
         self.ChartNoteUnit = merged_notes
 
 
+_compile_musicdb: Optional[MusicDB] = None
+
+
+def _init_compile_worker(musicdb: MusicDB):
+    global _compile_musicdb
+    _compile_musicdb = musicdb
+
+
+def _compile_chart(chart_id: tuple[str, str]) -> tuple[str, str, int]:
+    music_id, tier = chart_id
+    try:
+        chart = Chart(_compile_musicdb, music_id, tier)
+    except Exception as e:
+        logger.warning(f"Failed to compile chart {music_id}_{tier}: {e}")
+        return music_id, tier, 0
+    return music_id, tier, chart.AllNoteSize
+
+
+def compile_all_charts(musicdb: Optional[MusicDB] = None, processes: Optional[int] = None) -> int:
+    """
+    并行编译 Data/bytes 下的全部谱面并写入缓存，之后各脚本构建 Chart 时直接命中缓存。
+    已有有效缓存的谱面只会被读取一次。
+
+    Args:
+        musicdb: 歌曲数据库，默认新建。
+        processes: 进程数，默认 CPU 核数。
+
+    Returns:
+        int: 成功编译的谱面数量。
+    """
+    if musicdb is None:
+        musicdb = MusicDB()
+    known_ids = {str(music.Id) for music in musicdb.db}
+    chart_ids = []
+    for path in sorted(glob.glob(os.path.join("Data", "bytes", "rhythmgame_chart_*_*.bytes"))):
+        music_id, tier = os.path.basename(path)[:-len(".bytes")].split("_")[-2:]
+        if music_id in known_ids:
+            chart_ids.append((music_id, tier))
+
+    compiled = 0
+    with multiprocessing.Pool(processes, initializer=_init_compile_worker, initargs=(musicdb,)) as pool:
+        for music_id, tier, note_size in pool.imap_unordered(_compile_chart, chart_ids):
+            if note_size:
+                compiled += 1
+            else:
+                logger.warning(f"Chart {music_id}_{tier} has no notes.")
+    logger.info(f"Compiled {compiled} / {len(chart_ids)} charts into {CHART_CACHE_DIR}.")
+    return compiled
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="谱面解析工具")
+    parser.add_argument("--compile-all", action="store_true", help="并行编译 Data/bytes 下的全部谱面并写入缓存")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="编译使用的进程数，默认 CPU 核数")
+    args = parser.parse_args()
+
     musicdb = MusicDB()
+    if args.compile_all:
+        logging.basicConfig(level=logging.INFO)
+        compile_all_charts(musicdb, args.jobs)
+        raise SystemExit(0)
 
     c = Chart(musicdb, "105101", "03")
     logger.debug(c.AllNoteSize)
@@ -296,6 +296,29 @@ class PlayerAttributes:
                 pass
         self.score_note(judgement)
 
+    def combo_add_bulk(self, count: int):
+        """
+        连续 count 个 PERFECT+ 判定，结果与调用 count 次 combo_add("PERFECT+") 完全相同。
+        期间不发动技能，Voltage 等级不变，只有连击数未满 50 时 AP 倍率会变化。
+        """
+        while count and self.combo < 50:
+            self.combo_add("PERFECT+")
+            count -= 1
+        if not count:
+            return
+        self.combo += count
+        if self.prev_ap_rate != self.ap_rate:
+            self.prev_ap_rate = self.ap_rate
+            self.prev_ap = ceil(self.full_ap_plus * self.ap_rate) / 10000
+        # 逐次累加以保持与逐个判定相同的浮点误差
+        ap = self.ap
+        prev_ap = self.prev_ap
+        for _ in range(count):
+            ap += prev_ap
+        self.ap = ap
+        self.score_note("PERFECT+")
+        self.score += self.prev_note_score * (count - 1)
+
 
 if __name__ == "__main__":
     print(Voltage._points_needed_for_level(7))
@@ -1,34 +1,32 @@
 import logging
-import os
 import heapq
-# 导入所有 R 模块和 db_load 函数
-from RCardData import db_load
-from RChart import Chart, MusicDB
+from math import ceil, floor
+# 导入所有 R 模块和数据库读取函数
+from data_registry import music_db, card_db, skill_db
+from RChart import Chart
 from RDeck import Deck, Card
-from RLiveStatus import PlayerAttributes, MentalDown
-from SkillResolver import UseCardSkill, ApplyCenterSkillEffect, ApplyCenterAttribute, CheckCenterSkillCondition
-from CardLevelConfig import DEATH_NOTE
+from RLiveStatus import PlayerAttributes, MentalDown, Voltage
+from SkillResolver import UseCardSkill, ApplyCenterSkillEffect, ApplyCenterAttribute, CheckCenterSkillCondition, \
+    SkillEffectType, CenterSkillEffectType, parse_effect_id
+from CardLevelConfig import DEATH_NOTE, convert_deck_to_simulator_format
+from result_store import ResultAggregator
 
 # --- Configure logging (for the module itself if needed, or rely on main script's config) ---
 # 注意：子进程会继承父进程的logger配置，但为了独立运行和测试，可以保留或简化这里的logger
 logger = logging.getLogger(__name__)
 
 # --- Global DBs for the simulator module ---
-# 这些DBs也应该在模块的顶层被加载，确保它们在子进程中是可访问的
-try:
-    MUSIC_DB = MusicDB()
-    DB_CARDDATA = db_load(os.path.join("Data", "CardDatas.json"))
-    DB_SKILL = db_load(os.path.join("Data", "RhythmGameSkills.json"))
-    DB_SKILL.update(db_load(os.path.join("Data", "CenterSkills.json")))
-    DB_SKILL.update(db_load(os.path.join("Data", "CenterAttributes.json")))
-    logger.info("Simulator core databases loaded.")
-except ImportError as e:
-    logger.error(f"Failed to import required R modules in simulator_core. Error: {e}")
-    # Consider raising an exception or having a fallback
-except FileNotFoundError as e:
-    logger.error(f"Required database file not found: {e}. Please check your 'Data' directory.")
-    # Exit or handle gracefully if critical modules are missing/DBs not found
-    exit(1)  # Exit with an error code
+# 数据库由 data_registry 在第一次使用时加载，导入本模块不会读取任何数据文件
+# MUSIC_DB、DB_CARDDATA、DB_SKILL 仍可作为模块属性访问 (访问时加载)
+def __getattr__(name: str):
+    match name:
+        case "MUSIC_DB":
+            return music_db()
+        case "DB_CARDDATA":
+            return card_db()
+        case "DB_SKILL":
+            return skill_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 MISS_TIMING = {
@@ -58,18 +56,18 @@ def run_game_simulation(
         dict: A dictionary containing key simulation results (e.g., final score, card log).
               You can expand this to return more detailed metrics.
     """
-    # NOTE: DBs (MUSIC_DB, DB_CARDDATA, DB_SKILL) are now global to this module
-    # and inherited by child processes (copy-on-write).
+    # NOTE: DBs are loaded lazily by data_registry on first use and cached per process.
     deck_card_data, chart_obj, player_master_level, original_deck_index, deck_card_ids, centercard_id, friendcard_id = task_args
+    db_carddata, db_skill = card_db(), skill_db()
 
-    d = Deck(DB_CARDDATA, DB_SKILL, deck_card_data)
+    d = Deck(db_carddata, db_skill, deck_card_data)
     c: Chart = chart_obj
     player = PlayerAttributes(masterlv=player_master_level)
     player.set_deck(d)
 
     centerfriend = False
     if friendcard_id:
-        d.friend = Card.get_friend(DB_CARDDATA, DB_SKILL, friendcard_id)
+        d.friend = Card.get_friend(db_carddata, db_skill, friendcard_id)
         centerfriend = d.friend.characters_id == c.music.CenterCharacterId
 
     centercard = None
@@ -94,7 +92,8 @@ def run_game_simulation(
     player.basescore_calc(c.AllNoteSize)
     # player.cooldown = int(player.cooldown * 1_000_000)
 
-    chart_events = c.ChartEvents
+    # 同一时刻的同类音符已合并为带权事件
+    chart_events = c.CompressedEvents
     extra_events = list()
     heapq.heappush(extra_events, (player.cooldown, "CDavailable"))
 
@@ -105,34 +104,42 @@ def run_game_simulation(
 
     while i_event < chart_length or extra_events:
         if i_event < chart_length and (not extra_events or chart_events[i_event][0] <= extra_events[0][0]):
-            timestamp, event = chart_events[i_event]
+            timestamp, event, count = chart_events[i_event]
             i_event += 1
         else:
             timestamp, event = heapq.heappop(extra_events)
+            count = 1
 
         match event:
             case "Single" | "Hold" | "HoldMid" | "Flick" | "Trace":
-                combo_count += 1
-                if afk_mental and player.mental.rate > afk_mental:
-                    # 需要仰卧起坐时，将 MISS 时机按判定窗口延后以提高精度
-                    if flag_hanabi_ginko:
-                        heapq.heappush(extra_events, (timestamp + MISS_TIMING[event], "_" + event))
-                    else:
-                        try:
-                            player.combo_add("MISS", event)
-                        except MentalDown:
-                            break
-                else:
-                    player.combo_add("PERFECT+")
+                combo_count += count
+                if not afk_mental and not (player.CDavailable and cardnow):
+                    # 全部 PERFECT+ 且技能不可能发动 (冷却结束事件不会插入同一时刻的音符之间)，整组一次结算
+                    player.combo_add_bulk(count)
+                    continue
 
-                if player.CDavailable and cardnow and player.ap >= cardnow.cost:
-                    player.ap -= cardnow.cost
-                    conditions, effects = d.topskill()
-                    UseCardSkill(player, effects, conditions, cardnow)
-                    player.CDavailable = False
-                    cdtime_float = timestamp + player.cooldown
-                    heapq.heappush(extra_events, (cdtime_float, "CDavailable"))
-                    cardnow = d.topcard
+                # 挂机时每个音符的判定取决于当前血量，技能可能在组内任意一个音符后发动，逐个处理
+                try:
+                    for _ in range(count):
+                        if afk_mental and player.mental.rate > afk_mental:
+                            # 需要仰卧起坐时，将 MISS 时机按判定窗口延后以提高精度
+                            if flag_hanabi_ginko:
+                                heapq.heappush(extra_events, (timestamp + MISS_TIMING[event], "_" + event))
+                            else:
+                                player.combo_add("MISS", event)
+                        else:
+                            player.combo_add("PERFECT+")
+
+                        if player.CDavailable and cardnow and player.ap >= cardnow.cost:
+                            player.ap -= cardnow.cost
+                            conditions, effects = d.topskill()
+                            UseCardSkill(player, effects, conditions, cardnow)
+                            player.CDavailable = False
+                            cdtime_float = timestamp + player.cooldown
+                            heapq.heappush(extra_events, (cdtime_float, "CDavailable"))
+                            cardnow = d.topcard
+                except MentalDown:
+                    break
 
             case "CDavailable":
                 player.CDavailable = True
@@ -181,3 +188,214 @@ def run_game_simulation(
         "center_card": centercard_id,
         "friend_card": friendcard_id
     }
+
+
+# --- 批量模拟的工作进程 ---
+# 谱面、等级等所有任务共用的参数由 init_batch_worker 在进程启动时设置一次，不随每个任务传递
+_worker_state = {}
+
+
+def init_batch_worker(songs: list[tuple[Chart, int, frozenset]], player_master_level: int, cards: list[int]):
+    """
+    进程池的 initializer。
+
+    Args:
+        songs: [(谱面, C位角色id, 可用C位卡牌), ...]，每个卡组在所有谱面上依次模拟。
+            可用C位卡牌为 None 时使用任务中的C位 (单曲模式，C位已由卡组生成器展开)；
+            否则按歌曲筛选: 卡组不含C位角色时跳过该歌曲，可用C位卡牌为空时不使用C位。
+        cards: 卡池中的全部卡牌 (含助战)，需与主进程 ResultAggregator 使用的卡牌相同，以保证打包结果一致。
+    """
+    _worker_state["songs"] = songs
+    _worker_state["player_master_level"] = player_master_level
+    _worker_state["aggregators"] = [ResultAggregator(cards) for _ in songs]
+    _worker_state["best_scores"] = [-1] * len(songs)
+
+
+def run_simulation_chunk(chunk: list[tuple]) -> tuple:
+    """
+    在工作进程中模拟一组卡组并就地汇总，只向主进程返回紧凑的结果。
+
+    Args:
+        chunk: [(卡组序号, 卡组卡牌id, C位卡牌id, 助战卡牌id), ...]
+
+    Returns:
+        tuple: (首个卡组序号, 卡组数量, [(模拟次数, [(组成键, 打包值), ...], 最高分信息), ...])
+            列表中每首歌曲一项。组成键与打包值的格式见 ResultAggregator，每个组成只保留最高分。
+            最高分信息仅在刷新本进程在该歌曲上的最高分时返回，格式为
+            (得分, 卡组序号, 卡组卡牌id, C位卡牌id, 助战卡牌id, 出牌记录)，否则为 None。
+    """
+    songs = _worker_state["songs"]
+    player_master_level = _worker_state["player_master_level"]
+    aggregators = _worker_state["aggregators"]
+    best_scores = _worker_state["best_scores"]
+    counts = [0] * len(songs)
+    bests = [None] * len(songs)
+    for index, deck_card_ids, center_card, friend_card in chunk:
+        # 卡组数据只转换一次，在所有谱面上共用
+        deck_card_data = convert_deck_to_simulator_format(deck_card_ids)
+        for i, (chart_obj, center_char, center_cards) in enumerate(songs):
+            if center_cards is None:
+                centers = (center_card,)
+            else:
+                if center_char and all(card // 1000 != center_char for card in deck_card_ids):
+                    continue
+                if center_cards:
+                    centers = center_cards.intersection(deck_card_ids)
+                    if not centers:
+                        continue
+                else:
+                    centers = (None,)
+            for center in centers:
+                result = run_game_simulation((
+                    deck_card_data, chart_obj, player_master_level, index, deck_card_ids, center, friend_card
+                ))
+                score = result["final_score"]
+                aggregators[i].add(deck_card_ids, center, friend_card, score)
+                counts[i] += 1
+                if score > best_scores[i]:
+                    best_scores[i] = score
+                    bests[i] = (score, index, deck_card_ids, center, friend_card, result["cards_played_log"])
+    results = []
+    for i, aggregator in enumerate(aggregators):
+        results.append((counts[i], list(aggregator.table.items()), bests[i]))
+        aggregator.table.clear()
+    return chunk[0][0], len(chunk), results
+
+
+def _skill_gain_values(effects: list[int]) -> tuple[int, int, int, int, int]:
+    """
+    统计技能中所有正向得分/加电效果的数值。
+
+    Returns:
+        tuple: (得分合计, 单个得分效果最大值, 分加成合计(%), 加电合计, 电加成合计(%))
+    """
+    score_sum = score_max = score_boost = voltage_sum = voltage_boost = 0
+    for effect_id in effects:
+        effect_type, usage_count, value_data, change_direction = parse_effect_id(effect_id)
+        if change_direction:
+            continue
+        match effect_type:
+            case SkillEffectType.ScoreGain:
+                score_sum += value_data
+                score_max = max(score_max, value_data)
+            case SkillEffectType.VoltagePointChange:
+                voltage_sum += value_data
+            case SkillEffectType.NextAPGainRateChange:
+                score_boost += value_data * usage_count / 100
+            case SkillEffectType.NextVoltageGainRateChange:
+                voltage_boost += value_data * usage_count / 100
+    return score_sum, score_max, score_boost, voltage_sum, voltage_boost
+
+
+def _center_gain_values(effects: list[int]) -> tuple[int, int, int]:
+    """
+    统计C位技能中所有正向得分/加电效果的数值。
+
+    Returns:
+        tuple: (得分合计, 单个得分效果最大值, 加电合计)
+    """
+    score_sum = score_max = voltage_sum = 0
+    for effect_id in effects:
+        id_str = str(effect_id)
+        if len(id_str) != 9 or id_str[1] != "0":
+            continue
+        value_data = int(id_str[2:])
+        match CenterSkillEffectType(int(id_str[0])):
+            case CenterSkillEffectType.ScoreGain:
+                score_sum += value_data
+                score_max = max(score_max, value_data)
+            case CenterSkillEffectType.VoltagePointChange:
+                voltage_sum += value_data
+    return score_sum, score_max, voltage_sum
+
+
+def composition_score_bound(
+    deck_card_ids: list[int],
+    center_cards: set,
+    friend_cards: set,
+    chart_obj: Chart,
+    player_master_level: int,
+) -> int:
+    """
+    计算卡组组成 (不考虑顺序) 在所有顺序、C位、助战下可能达到的得分上限。
+    上限满足 "不低于任意顺序的实际模拟得分"，可用于在模拟前跳过整个组成。
+
+    估算方式:
+      - 技能次数: 开局CD后每个CD最多打出一次技能，直到Live结束
+      - Voltage: 每次技能都按卡组中加电最多的卡牌计算，且所有电加成全部被最大加电效果 (含C位技能) 消耗
+      - 得分: 每次技能都按 "自身得分 + 被消耗的分加成" 最多的卡牌计算，
+              所有Note按上述Voltage上限且在Fever中计算
+      - C位技能每个触发时机 (开始、Fever、结束) 各计算一次
+
+    Args:
+        deck_card_ids (list[int]): 6张卡牌id。
+        center_cards (set): 可用C位卡牌，无C位时为 {None}。
+        friend_cards (set): 可用助战卡牌，无助战时为 {None}。
+        chart_obj (Chart): 模拟使用的谱面。
+        player_master_level (int): 玩家 Master Lv。
+
+    Returns:
+        int: 得分上限。
+    """
+    deck_card_data = convert_deck_to_simulator_format(deck_card_ids)
+    live_end = chart_obj.music.PlayTime / 1000
+    note_size = chart_obj.AllNoteSize
+
+    db_carddata, db_skill = card_db(), skill_db()
+    best_bound = 0
+    for center_id in center_cards:
+        for friend_id in friend_cards:
+            d = Deck(db_carddata, db_skill, deck_card_data)
+            player = PlayerAttributes(masterlv=player_master_level)
+            player.set_deck(d)
+
+            center_skills = []
+            if friend_id:
+                d.friend = Card.get_friend(db_carddata, db_skill, friend_id)
+                if d.friend.characters_id == chart_obj.music.CenterCharacterId:
+                    center_skills.append(d.friend.center_skill.effect)
+            for card in d.cards:
+                if int(card.card_id) == center_id:
+                    for target, effect in card.get_center_attribute():
+                        ApplyCenterAttribute(player, effect, target)
+                    center_skills.append(card.center_skill.effect)
+
+            d.appeal_calc(chart_obj.music.MusicType)
+            player.basescore_calc(note_size)
+
+            cooldown = player.cooldown
+            if cooldown <= 0:
+                # 无CD时无法估算技能次数，不剪枝
+                return 1 << 62
+            activations = max(0, floor((live_end - cooldown) / cooldown + 1e-9) + 1)
+
+            card_values = [_skill_gain_values(card.skill_unit.effect) for card in d.cards]
+            center_values = [_center_gain_values(effects) for effects in center_skills]
+            score_max = max([v[1] for v in card_values] + [v[1] for v in center_values])
+            # 电加成可能被C位技能的加电效果消耗，取卡牌与C位技能中的最大值
+            voltage_max = max([v[3] for v in card_values] + [v[2] for v in center_values])
+
+            # 每次技能最多获得的 VoltagePt (每个效果向上取整最多多1点)
+            voltage_rate = player.voltage_gain_rate
+            voltage_per_skill = max(
+                v[3] * voltage_rate / 100 + voltage_max * v[4] / 100 + len(card.skill_unit.effect)
+                for v, card in zip(card_values, d.cards)
+            )
+            voltage_points = activations * voltage_per_skill
+            voltage_points += 3 * sum(ceil(v[2] * voltage_rate / 100) + 1 for v in center_values)
+
+            voltage_level = 0
+            while Voltage._points_needed_for_level(voltage_level + 1) <= voltage_points:
+                voltage_level += 1
+            voltage_bonus = (voltage_level * 2 + 10) / 10
+
+            # 得分 = 基础分 * Voltage加成 * 数值 * (100% + 分加成) / 1000000
+            score_per_skill = max(v[0] * 100 + score_max * v[2] for v in card_values)
+            skill_score = activations * score_per_skill + 3 * 100 * sum(v[0] for v in center_values)
+            skill_score = player.base_score * voltage_bonus * skill_score / 1000000
+            note_score = player.note_score["PERFECT+"] * voltage_bonus * note_size
+
+            # 每次加分向上取整最多多1分
+            rounding = note_size + activations * 8 + 16
+            best_bound = max(best_bound, ceil(note_score + skill_score) + rounding)
+    return best_bound
@@ -0,0 +1,452 @@
+"""
+预编译的卡牌/技能数据库。
+
+将 Data 目录下的 CardDatas.json、RhythmGameSkills.json、CenterSkills.json、CenterAttributes.json
+编译为一个按整数id排序、按列存储的二进制文件 (Data/CardStore.bin)。
+读取时直接 mmap 该文件，无需解析 JSON，多个工作进程共享同一份页缓存。
+
+文件格式 (小端序):
+    MAGIC (8 bytes) | 头部长度 (uint32) | 头部 JSON (按 8 字节对齐) | 数据段
+头部记录每个表的记录数、id 列与各字段列在数据段中的位置，以及编译时源文件的大小与修改时间。
+字段按内容分为以下几种列:
+    int       每条记录一个 int64
+    str       每条记录一个字符串编号 (uint32)
+    int_list  每条记录的起始位置 (uint32, 共 n+1 个) + 全部数值 (int64)
+    str_list  每条记录的起始位置 (uint32, 共 n+1 个) + 全部字符串编号 (uint32)
+    json      不属于以上类型的字段，按 JSON 文本存为字符串编号，缺失的字段记为 NONE_STRING
+字符串统一存放在字符串表中: 起始位置 (uint32, 共 k+1 个) + UTF-8 数据。
+
+CardDatas 表额外包含 TagMask 列: 卡牌技能 (Lv.14) 的效果类型与稀有度的位掩码，
+低 16 位为 SkillEffectType 的值，RARITY_SHIFT 位起为稀有度的值，供 DeckGen2 直接生成 DB_TAG。
+
+编译: python card_store.py (RCardData.py 转换 YAML 后也会自动编译)
+"""
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+
+from RCardData import db_load
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SSDMCDB1"
+FORMAT_VERSION = 1
+STORE_PATH = os.path.join("Data", "CardStore.bin")
+CARD_TABLE = "CardDatas"
+SKILL_TABLES = ["RhythmGameSkills", "CenterSkills", "CenterAttributes"]
+NONE_STRING = 0xFFFFFFFF
+RARITY_SHIFT = 16
+_HEADER_LEN = struct.Struct("<I")
+_MISSING = object()
+
+
+def source_path(table: str, data_dir: str = "Data") -> str:
+    return os.path.join(data_dir, f"{table}.json")
+
+
+def _source_stamp(path: str) -> list[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def tag_mask(card: dict, db_skill: dict) -> int:
+    """
+    计算卡牌的技能tag位掩码 (多段同类效果只记录一次)。
+    """
+    skill_series_id = card["RhythmGameSkillSeriesId"][-1]
+    mask = 0
+    for effect in db_skill[str(skill_series_id * 100 + 14)]["RhythmGameSkillEffectId"]:
+        mask |= 1 << (effect // 100000000)
+    return mask | 1 << (RARITY_SHIFT + card["Rarity"])
+
+
+def split_tag_mask(mask: int) -> tuple[list[int], list[int]]:
+    """
+    将 tag 位掩码拆分为 (SkillEffectType 的值, Rarity 的值)。
+    """
+    effects = [i for i in range(RARITY_SHIFT) if mask >> i & 1]
+    rarities = [i for i in range(mask.bit_length() - RARITY_SHIFT) if mask >> (RARITY_SHIFT + i) & 1]
+    return effects, rarities
+
+
+def _column_kind(values: list) -> str:
+    if any(value is _MISSING for value in values):
+        return "json"
+    if all(type(value) is int for value in values):
+        return "int"
+    if all(type(value) is str for value in values):
+        return "str"
+    if all(type(value) is list for value in values):
+        items = [item for value in values for item in value]
+        if all(type(item) is int for item in items):
+            return "int_list"
+        if all(type(item) is str for item in items):
+            return "str_list"
+    return "json"
+
+
+class _StoreBuilder:
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.strings: list[str] = []
+        self.string_ids: dict[str, int] = {}
+
+    def string_id(self, value: str) -> int:
+        sid = self.string_ids.get(value)
+        if sid is None:
+            sid = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+    def add_array(self, fmt: str, values: list[int]) -> int:
+        # 每个数组按 8 字节对齐，读取时可直接 cast 为对应类型
+        self.data.extend(b"\0" * (-len(self.data) % 8))
+        offset = len(self.data)
+        self.data.extend(struct.pack(f"<{len(values)}{fmt}", *values))
+        return offset
+
+    def add_table(self, db: dict, extra_columns: dict[str, list[int]] = None) -> dict:
+        keys = sorted(db, key=int)
+        records = [db[key] for key in keys]
+        fields = {}
+        for record in records:
+            for field in record:
+                fields.setdefault(field, None)
+
+        columns = {}
+        for field in fields:
+            values = [record.get(field, _MISSING) for record in records]
+            kind = _column_kind(values)
+            column = {"kind": kind}
+            if kind == "int":
+                column["values"] = self.add_array("q", values)
+            elif kind == "str":
+                column["values"] = self.add_array("I", [self.string_id(value) for value in values])
+            elif kind in ("int_list", "str_list"):
+                offsets = [0]
+                flat = []
+                for value in values:
+                    flat.extend(value if kind == "int_list" else [self.string_id(item) for item in value])
+                    offsets.append(len(flat))
+                column["offsets"] = self.add_array("I", offsets)
+                column["values"] = self.add_array("q" if kind == "int_list" else "I", flat)
+            else:
+                column["values"] = self.add_array("I", [
+                    NONE_STRING if value is _MISSING else self.string_id(json.dumps(value, ensure_ascii=False))
+                    for value in values
+                ])
+            columns[field] = column
+        for field, values in (extra_columns or {}).items():
+            columns[field] = {"kind": "int", "values": self.add_array("q", [values[key] for key in keys])}
+
+        return {
+            "count": len(keys),
+            "keys": self.add_array("q", [int(key) for key in keys]),
+            "columns": columns,
+        }
+
+    def add_strings(self) -> dict:
+        offsets = [0]
+        blob = bytearray()
+        for value in self.strings:
+            blob.extend(value.encode("utf-8"))
+            offsets.append(len(blob))
+        offsets_pos = self.add_array("I", offsets)
+        self.data.extend(b"\0" * (-len(self.data) % 8))
+        blob_pos = len(self.data)
+        self.data.extend(blob)
+        return {"count": len(self.strings), "offsets": offsets_pos, "data": blob_pos}
+
+
+def build_store(path: str = STORE_PATH, data_dir: str = "Data"):
+    """
+    从 JSON 数据库编译二进制数据库。
+    """
+    builder = _StoreBuilder()
+    sources = {}
+    tables = {}
+    db_skill = {}
+    for table in SKILL_TABLES:
+        source = source_path(table, data_dir)
+        db = db_load(source)
+        db_skill.update(db)
+        tables[table] = builder.add_table(db)
+        sources[table] = _source_stamp(source)
+    source = source_path(CARD_TABLE, data_dir)
+    db_card = db_load(source)
+    masks = {key: tag_mask(card, db_skill) for key, card in db_card.items()}
+    tables[CARD_TABLE] = builder.add_table(db_card, {"TagMask": masks})
+    sources[CARD_TABLE] = _source_stamp(source)
+
+    header = {
+        "version": FORMAT_VERSION,
+        "sources": sources,
+        "tables": tables,
+        "strings": builder.add_strings(),
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(len(MAGIC) + _HEADER_LEN.size + len(header_bytes)) % 8)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        f.write(builder.data)
+    os.replace(tmp_path, path)
+    logger.info(f"Card store saved to {path} ({len(db_card)} cards, {len(db_skill)} skills)")
+
+
+class StoreTable:
+    """
+    二进制数据库中的一个表，接口与 json 读取的 dict 相同 (键为字符串形式的id，值为记录的 dict)。
+    也可以用整数id查询，或通过 column() 按下标直接读取整数列。
+    每条记录只在第一次访问时解码，之后返回同一个 dict (与 json 读取的 dict 相同，不应修改)。
+    """
+
+    def __init__(self, store: "CardStore", name: str, info: dict) -> None:
+        self.store = store
+        self.name = name
+        self.count = info["count"]
+        self.ids = store.array(info["keys"], "q", self.count)
+        self.columns = {}
+        for field, column in info["columns"].items():
+            kind = column["kind"]
+            if kind in ("int_list", "str_list"):
+                offsets = store.array(column["offsets"], "I", self.count + 1)
+                values = store.array(column["values"], "q" if kind == "int_list" else "I", offsets[-1])
+                self.columns[field] = (kind, values, offsets)
+            else:
+                self.columns[field] = (kind, store.array(column["values"], "q" if kind == "int" else "I", self.count), None)
+        # 已解码的记录: 按下标，以及按查询时使用的键 (字符串或整数id)
+        self._records: list = [None] * self.count
+        self._by_key: dict = {}
+
+    def index(self, key) -> int:
+        """
+        返回id对应的记录下标，不存在时抛出 KeyError。
+        """
+        try:
+            card_id = int(key)
+        except (TypeError, ValueError):
+            raise KeyError(key)
+        i = bisect.bisect_left(self.ids, card_id)
+        if i == self.count or self.ids[i] != card_id:
+            raise KeyError(key)
+        return i
+
+    def column(self, field: str) -> memoryview:
+        """
+        返回整数列 (按记录下标)。
+        """
+        kind, values, _ = self.columns[field]
+        if kind != "int":
+            raise TypeError(f"{self.name}.{field} is not an integer column")
+        return values
+
+    def record(self, i: int) -> dict:
+        record = self._records[i]
+        if record is None:
+            record = self._records[i] = self._decode(i)
+        return record
+
+    def _decode(self, i: int) -> dict:
+        string = self.store.string
+        record = {}
+        for field, (kind, values, offsets) in self.columns.items():
+            if kind == "int":
+                record[field] = values[i]
+            elif kind == "str":
+                record[field] = string(values[i])
+            elif kind == "int_list":
+                record[field] = values[offsets[i]:offsets[i + 1]].tolist()
+            elif kind == "str_list":
+                record[field] = [string(sid) for sid in values[offsets[i]:offsets[i + 1]]]
+            elif values[i] != NONE_STRING:
+                record[field] = json.loads(string(values[i]))
+        return record
+
+    def __getitem__(self, key) -> dict:
+        record = self._by_key.get(key)
+        if record is None:
+            record = self._by_key[key] = self.record(self.index(key))
+        return record
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        try:
+            self.index(key)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        return (str(card_id) for card_id in self.ids)
+
+    def values(self):
+        return (self.record(i) for i in range(self.count))
+
+    def items(self):
+        return ((str(self.ids[i]), self.record(i)) for i in range(self.count))
+
+
+class MergedTable:
+    """
+    按 dict.update 的顺序合并多个表 (后面的表优先)，用于替代合并后的 DB_SKILL。
+    创建时建立 id -> (表, 下标) 的合并索引，查询结果按键缓存。
+    """
+
+    def __init__(self, tables: list[StoreTable]) -> None:
+        self.tables = tables
+        self._index: dict[int, tuple[StoreTable, int]] = {}
+        for table in tables:
+            for i, record_id in enumerate(table.ids):
+                self._index[record_id] = (table, i)
+        self._by_key: dict = {}
+
+    def __getitem__(self, key) -> dict:
+        record = self._by_key.get(key)
+        if record is None:
+            try:
+                table, i = self._index[int(key)]
+            except (TypeError, ValueError):
+                raise KeyError(key)
+            record = self._by_key[key] = table.record(i)
+        return record
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        try:
+            return int(key) in self._index
+        except (TypeError, ValueError):
+            return False
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __iter__(self):
+        return iter(dict.fromkeys(self.keys()))
+
+    def keys(self):
+        for table in self.tables:
+            yield from table.keys()
+
+    def values(self):
+        return (self[key] for key in self)
+
+    def items(self):
+        return ((key, self[key]) for key in self)
+
+
+class CardStore:
+    """
+    以 mmap 方式读取的二进制数据库。
+    """
+
+    def __init__(self, path: str = STORE_PATH) -> None:
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a card store file: {path}")
+        (header_len,) = _HEADER_LEN.unpack_from(self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_LEN.size
+        self.header = json.loads(bytes(self._mmap[header_start:header_start + header_len]))
+        if self.header.get("version") != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Unsupported card store version: {self.header.get('version')}")
+        self._view = memoryview(self._mmap)[header_start + header_len:]
+
+        strings = self.header["strings"]
+        self._string_offsets = self.array(strings["offsets"], "I", strings["count"] + 1)
+        self._string_data = strings["data"]
+        self._string_cache: dict[int, str] = {}
+        self.tables = {name: StoreTable(self, name, info) for name, info in self.header["tables"].items()}
+        self.cards = self.tables[CARD_TABLE]
+        self.skills = MergedTable([self.tables[name] for name in SKILL_TABLES])
+
+    def array(self, offset: int, fmt: str, count: int) -> memoryview:
+        return self._view[offset:offset + count * struct.calcsize(fmt)].cast(fmt)
+
+    def string(self, sid: int) -> str:
+        value = self._string_cache.get(sid)
+        if value is None:
+            start = self._string_data + self._string_offsets[sid]
+            end = self._string_data + self._string_offsets[sid + 1]
+            value = self._string_cache[sid] = str(self._view[start:end], "utf-8")
+        return value
+
+    def is_fresh(self, data_dir: str = "Data") -> bool:
+        """
+        检查编译时的源文件是否被修改过 (源文件不存在时视为有效)。
+        """
+        for table, stamp in self.header["sources"].items():
+            source = source_path(table, data_dir)
+            if os.path.exists(source) and _source_stamp(source) != stamp:
+                return False
+        return True
+
+    def close(self):
+        self._view = None
+        self._string_offsets = None
+        for table in getattr(self, "tables", {}).values():
+            table.ids = None
+            table.columns = {}
+            table._records = []
+            table._by_key = {}
+        if hasattr(self, "skills"):
+            self.skills._index = {}
+            self.skills._by_key = {}
+        self._mmap.close()
+        self._file.close()
+
+
+def load_databases(data_dir: str = "Data", store_path: str = STORE_PATH):
+    """
+    读取卡牌与技能数据库，返回 (DB_CARDDATA, DB_SKILL)。
+    优先使用与 JSON 源文件一致的二进制数据库，否则读取 JSON。
+    """
+    if os.path.exists(store_path):
+        try:
+            store = CardStore(store_path)
+            if store.is_fresh(data_dir):
+                logger.debug(f"Card store loaded from {store_path}")
+                return store.cards, store.skills
+            store.close()
+            logger.info(f"{store_path} is outdated, run card_store.py to rebuild it.")
+        except ValueError as e:
+            logger.warning(f"Failed to load card store: {e}")
+    db_card = db_load(source_path(CARD_TABLE, data_dir))
+    db_skill = db_load(source_path(SKILL_TABLES[0], data_dir))
+    for table in SKILL_TABLES[1:]:
+        db_skill.update(db_load(source_path(table, data_dir)))
+    return db_card, db_skill
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    parser = argparse.ArgumentParser(description="编译卡牌/技能数据库")
+    parser.add_argument("--data-dir", default="Data", help="JSON 数据库所在目录")
+    parser.add_argument("-o", "--output", default=STORE_PATH, help="输出文件")
+    args = parser.parse_args()
+    build_store(args.output, args.data_dir)
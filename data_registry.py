@@ -0,0 +1,74 @@
+"""
+按需加载的数据注册表。
+
+导入本模块不会读取任何文件，各数据库在第一次使用时加载并缓存在当前进程中，
+只用到部分数据的工具脚本与工作进程不再需要在导入时加载全部数据。
+数据文件不存在时抛出 FileNotFoundError，由调用方决定如何处理。
+"""
+import hashlib
+import json
+import logging
+from functools import cache
+from typing import Optional
+
+from card_store import load_databases
+from CardLevelConfig import card_levels
+from RChart import MusicDB
+
+logger = logging.getLogger(__name__)
+
+
+@cache
+def music_db() -> MusicDB:
+    """
+    歌曲数据库 (Data/Musics.yaml)。
+    """
+    db = MusicDB()
+    logger.debug("Music database loaded.")
+    return db
+
+
+@cache
+def _databases():
+    databases = load_databases()
+    logger.debug("Card and skill databases loaded.")
+    return databases
+
+
+def card_db():
+    """
+    卡牌数据库 (CardDatas)，键为字符串形式的卡牌id。
+    """
+    return _databases()[0]
+
+
+def skill_db():
+    """
+    技能数据库 (RhythmGameSkills、CenterSkills、CenterAttributes 合并)，键为字符串形式的技能id。
+    """
+    return _databases()[1]
+
+
+@cache
+def card_data_hash(card_id: int) -> Optional[str]:
+    """
+    卡牌数据及其在当前技能等级下的技能数据的指纹，数据更新后指纹随之改变，卡牌不存在时为 None。
+    用于判断log中的结果是否需要重新模拟。
+    """
+    db_card, db_skill = card_db(), skill_db()
+    card = db_card.get(str(card_id))
+    if card is None:
+        return None
+    _, center_skill_level, skill_level = card_levels(card_id)
+    skill_ids = [series_id * 100 + skill_level for series_id in card["RhythmGameSkillSeriesId"]]
+    skill_ids.append(card["CenterSkillSeriesId"] * 100 + center_skill_level)
+    skill_ids.append(card["CenterAttributeSeriesId"] + 1)
+
+    def normalize(record):
+        # 二进制数据库额外保存 TagMask，且不保存空值
+        if record is None:
+            return None
+        return {key: value for key, value in record.items() if key != "TagMask" and value is not None}
+
+    data = [normalize(card)] + [normalize(db_skill.get(str(skill_id))) for skill_id in skill_ids]
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
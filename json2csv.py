@@ -3,6 +3,7 @@ import csv
 import os
 import argparse
 import logging
+from result_store import load_results
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -11,12 +12,11 @@ logger = logging.getLogger(__name__)
 
 def convert_single_song_results_to_csv(json_filepath: str, csv_filepath: str):
     """
-    Converts a JSON file containing single-song simulation results to a CSV file.
+    Converts a JSON (or binary .bin) file containing single-song simulation results to a CSV file.
     Expected JSON format: [{"deck_card_ids": [...], "score": ...}, ...]
     """
     try:
-        with open(json_filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_results(json_filepath)
 
         if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
             logger.error(f"Error: JSON data in '{json_filepath}' is not in the expected list of dictionaries format for single song results.")
@@ -122,7 +122,10 @@ def main():
         base_name = os.path.splitext(os.path.basename(json_filepath))[0]
         csv_filepath = f"{base_name}.csv"
 
-    if args.type == 'auto':
+    if args.type == 'auto' and json_filepath.endswith(".bin"):
+        # Binary logs only store single song results
+        detected_type = 'single'
+    elif args.type == 'auto':
         # Try to automatically detect file type by attempting to load and check structure
         try:
             with open(json_filepath, 'r', encoding='utf-8') as f:
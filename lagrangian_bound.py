@@ -0,0 +1,120 @@
+"""
+多曲组合求解的拉格朗日松弛上限
+
+多曲求解即每首歌各选一个卡组、卡组之间不重复卡牌、总 Pt 最大。
+将"每张卡牌最多使用一次"的约束以每张卡牌的惩罚 λ ≥ 0 松弛后，
+  L(λ) = Σ_歌曲 max(卡组Pt - 卡组内卡牌的 λ 之和) + Σ_卡牌 λ
+对任意 λ ≥ 0 都是原问题的上限，λ = 0 时即各歌曲独立取最高 Pt。
+λ 以次梯度法更新: 被多个卡组同时使用的卡牌惩罚增加，未被使用的卡牌惩罚减少。
+
+惩罚在各次查询之间保留，作为下一次查询的初始值。
+"""
+from typing import Optional, Sequence
+
+# 浮点误差容限，总 Pt 为整数，L < target + 1 - EPS 即可证明无法超过 target
+EPS = 1e-6
+
+
+def mask_bits(mask: int) -> tuple[int, ...]:
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return tuple(bits)
+
+
+class LagrangianBound:
+    def __init__(self, pts: list[list[int]], masks: list[list[int]]):
+        """
+        Args:
+            pts: 每首歌候选卡组的 Pt，按降序排列。
+            masks: 与 pts 对应的卡牌位掩码。
+        """
+        self.pts = pts
+        self.masks = masks
+        self.bits = [[mask_bits(mask) for mask in song_masks] for song_masks in masks]
+        # 卡牌bit位 -> 惩罚 λ，只保存大于 0 的项
+        self.penalty: dict[int, float] = {}
+
+    def _evaluate(self, songs: Sequence[int], used: int) -> tuple[float, Optional[list[tuple[int, ...]]]]:
+        """
+        计算当前惩罚下的 L(λ)，返回 (L, 各歌曲取到最大值的卡组的卡牌)。
+        某首歌没有不使用 used 的卡组时返回 (-inf, None)。
+        """
+        penalty = self.penalty
+        total = 0.0
+        chosen = []
+        for s in songs:
+            pts = self.pts[s]
+            masks = self.masks[s]
+            bits = self.bits[s]
+            best_value = float("-inf")
+            best_index = -1
+            for index, pt in enumerate(pts):
+                # 惩罚非负，Pt 不超过当前最大值后不可能更优
+                if pt <= best_value:
+                    break
+                if masks[index] & used:
+                    continue
+                value = pt
+                for bit in bits[index]:
+                    value -= penalty.get(bit, 0.0)
+                if value > best_value:
+                    best_value = value
+                    best_index = index
+            if best_index < 0:
+                return float("-inf"), None
+            total += best_value
+            chosen.append(bits[best_index])
+
+        for bit, value in penalty.items():
+            if not used >> bit & 1:
+                total += value
+        return total, chosen
+
+    def can_exceed(self, songs: Sequence[int], used: int, target: int, iterations: int) -> bool:
+        """
+        判断在 songs 中每首歌各选一个卡组 (不使用 used 中的卡牌，且互不重复) 时，总 Pt 是否可能超过 target。
+        返回 False 时可以确定不可能超过，返回 True 时只是未能证明。
+
+        Args:
+            songs: 歌曲下标。
+            used: 已使用卡牌的位掩码。
+            target: 需要超过的总 Pt。
+            iterations: 次梯度更新次数上限。
+        """
+        penalty = self.penalty
+        for iteration in range(iterations + 1):
+            bound, chosen = self._evaluate(songs, used)
+            if chosen is None or bound < target + 1 - EPS:
+                return False
+            if iteration == iterations:
+                break
+
+            usage: dict[int, int] = {}
+            for bits in chosen:
+                for bit in bits:
+                    usage[bit] = usage.get(bit, 0) + 1
+            # 投影后的次梯度: 1 - 使用次数，λ 已为 0 且未被重复使用的卡牌不变
+            gradient = {}
+            for bit, count in usage.items():
+                if count > 1:
+                    gradient[bit] = 1 - count
+            for bit in penalty:
+                if bit not in usage and not used >> bit & 1:
+                    gradient[bit] = 1
+            norm = sum(g * g for g in gradient.values())
+            if norm == 0:
+                # 各卡组互不冲突且有惩罚的卡牌都恰好使用一次，L(λ) 即可行解的总 Pt，确实可以超过 target
+                return True
+
+            # Polyak 步长，以 target 作为目标值
+            step = (bound - target) / norm
+            for bit, g in gradient.items():
+                value = penalty.get(bit, 0.0) - step * g
+                if value > 0:
+                    penalty[bit] = value
+                else:
+                    penalty.pop(bit, None)
+        return True
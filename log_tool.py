@@ -1,9 +1,9 @@
-import json
 import logging
 import os
 from tqdm import tqdm
 
 from CardLevelConfig import CARD_CACHE
+from result_store import load_results, save_results, log_path
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -45,10 +45,10 @@ def score2pt(results):
 
 def save_simulation_results(results_data: list, filename: str = os.path.join("log", "simulation_results.json"), calc_pt=False):
     """
-    将模拟结果数据保存到 JSON 文件，只保留最高分的顺序。
+    将模拟结果数据保存到 JSON 或二进制文件 (按扩展名区分)，只保留最高分的顺序。
     results_data: 包含每个卡组及其得分的字典列表。
                   例如: [{"deck_cards": [id1, id2, ...], "center_card": id1, "score": 123456}, ...]
-    filename: 保存 JSON 文件的名称。
+    filename: 保存文件的名称。
     """
 
     unique_decks_best_scores = {}  # Key: tuple of sorted card IDs, Value: {'deck_card_ids': original_list, 'score': best_score}
@@ -77,23 +77,21 @@ def save_simulation_results(results_data: list, filename: str = os.path.join("lo
     else:
         processed_results.sort(key=lambda i: i["score"], reverse=True)
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(processed_results, f, ensure_ascii=False, indent=0)
+        save_results(processed_results, filename, levels=CARD_CACHE)
         logger.info(f"Simulation results saved to {filename}")
     except Exception as e:
-        logger.error(f"Error saving simulation results to JSON: {e}")
+        logger.error(f"Error saving simulation results: {e}")
 
 
 if __name__ == "__main__":
     # 在列表中填写需要重新计算 pt 的 log 文件路径
     # 也可以用于合并未完成所有模拟就被中断时遗留的 log 缓存
-    temp_files = [os.path.join("log", f"simulation_results_{MUSIC_ID}_{DIFFICULTY}.json")]
+    temp_files = [log_path(MUSIC_ID, DIFFICULTY)]
 
     all_simulation_results = []
     for temp_file in tqdm(temp_files, desc="Merging Files", ascii=True):
-        with open(temp_file, 'r') as f:
-            all_simulation_results.extend(json.load(f))
+        all_simulation_results.extend(load_results(temp_file))
 
-    # 重新计算 pt 的 log 会有 "_re" 后缀
-    json_output_filename = os.path.join("log", f"simulation_results_{MUSIC_ID}_{DIFFICULTY}_re.json")
-    save_simulation_results(all_simulation_results, json_output_filename, calc_pt=True)
+    # 重新计算 pt 的 log 会有 "_re" 后缀，格式与第一个文件相同
+    output_filename = "_re".join(os.path.splitext(temp_files[0]))
+    save_simulation_results(all_simulation_results, output_filename, calc_pt=True)
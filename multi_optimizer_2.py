@@ -1,10 +1,18 @@
-import json
 import logging
 import os
 import time
 import csv
+import multiprocessing
+from typing import Optional
 from tqdm import tqdm
+try:
+    import numpy as np
+except ImportError:
+    np = None
 from CardLevelConfig import fix_windows_console_encoding
+from result_store import load_top_results, log_path
+from top_combos import TopCombos
+from lagrangian_bound import LagrangianBound
 
 logger = logging.getLogger(__name__)
 
@@ -17,19 +25,46 @@ logging.basicConfig(
 # 配置求解歌曲，格式: ("歌曲ID", "难度"),
 # 求解前需运行 MainBatch.py 生成对应的卡组得分记录
 CHALLENGE_SONGS = [
-    # 若只输入两首歌则会寻找仅针对两面的最优解，不考虑第三面
+    # 歌曲数量不限，输入两首歌则只求两面的最优解
     ("405128", "02"),  # 令嬢モブ！
     ("405126", "02"),  # チャーミングな花束を！
     ("405120", "02"),  # ガランドFlash
 ]
 
 # 每首歌只保留得分排名前 N 名的卡组用于求解
-TOP_N = 20000
+# 开启 ADAPTIVE_TOP_N 时为初始数量
+TOP_N = 2000
+# 自适应扩大 TOP_N: 每轮搜索后检查被截断的卡组能否超过已找到的结果，
+# 只对可能超过的歌曲将 N 加倍并重新搜索，直到证明结果在完整log中最优
+ADAPTIVE_TOP_N = True
+# 自适应时每首歌 N 的上限，None 为不限制
+TOP_N_LIMIT = None
+
+# 输出总 Pt 最高的前 K 个组合
+TOP_K = 1
+# 前 K 个组合之间至少不同的卡牌数量，0 为不限制
+MIN_DIFF_CARDS = 0
+
+# 并行搜索使用的进程数，设为 1 时单进程搜索
+PROCESSES = os.cpu_count() or 1
+# 并行搜索时每个任务包含的第一首歌候选卡组数量
+FIRST_LEVEL_CHUNK = 16
+
+# 拉格朗日松弛上限的次梯度迭代次数，在剩余至少两首歌的分支入口剪枝，0 为不使用
+# 各面最高分卡组互相冲突、分数接近时效果明显
+LAGRANGE_ITERATIONS = 10
+
+# 安装 numpy 时以向量化运算检查最后一首歌的候选
+USE_NUMPY = True
+# 最后一首歌的前 VECTOR_BLOCK 个候选仍逐个检查 (多数分支在此结束)，
+# 之后分块向量化检查，每块数量翻倍，直到 VECTOR_BLOCK_MAX
+VECTOR_BLOCK = 64
+VECTOR_BLOCK_MAX = 4096
 
 # 在控制台与文件输出中显示卡牌名称
 SHOWNAME = True
 
-# 寻找最优解时忽略包含特定卡牌的卡组 (三面均生效)
+# 寻找最优解时忽略包含特定卡牌的卡组 (所有歌曲均生效)
 # 填写格式为: [卡牌id1, 卡牌id2, ...]
 FORBIDDEN_CARD = []
 
@@ -61,6 +96,314 @@ def get_card_name() -> dict:
         return None
 
 
+def order_songs(best_pts: list[int]) -> list[int]:
+    """
+    决定搜索顺序: 最高 Pt 最大的歌曲放在第一层，其余按最高 Pt 升序。
+    三首歌时即原先的"大、小、中"顺序。
+
+    Args:
+        best_pts: 每首歌的最高 Pt。
+
+    Returns:
+        list[int]: 按搜索顺序排列的歌曲下标。
+    """
+    i_max = max(range(len(best_pts)), key=lambda i: best_pts[i])
+    rest = sorted((i for i in range(len(best_pts)) if i != i_max), key=lambda i: best_pts[i])
+    return [i_max] + rest
+
+
+def log_combo(total_pt: int, combo: list[dict], songs: list[tuple[str, str]]):
+    logger.info(f"New best total pt found: {total_pt:,}")
+    for i, d in enumerate(combo):
+        logger.info(f"  Song {i+1} {songs[i]}: ")
+        logger.info(f"    Pt: {d['pt']:,}\tScore: {d['score']:,}\tRank: {d['rank']}")
+        logger.info(f"    Deck (ID): {d['deck']}")
+
+
+def format_ranked(ranked: list[tuple[int, list[dict]]], songs: list[tuple[str, str]], title: dict,
+                  cardname: Optional[dict] = None) -> str:
+    """
+    将 TopCombos.ranked() 的结果格式化为输出文本，提供 cardname 时显示卡牌名称。
+    """
+    output = []
+    for rank, (total_pt, combo) in enumerate(ranked, start=1):
+        if rank == 1:
+            output.append("=== Best Combination ===")
+        else:
+            output.append(f"\n=== Combination #{rank} ===")
+        output.append(f"Total Pt: {total_pt:16,}")
+        for i, d in enumerate(combo):
+            song_id, difficulty = songs[i]
+            output.append(f"  Song {i+1} | {song_id} ({difficulty}) | {title.get(song_id, '？？？')}")
+            output.append(f"    Score: {d['score']:15,}")
+            output.append(f"    Pt: {d['pt']:18,}\tRank: {d['rank']}")
+            output.append(f"    Deck (ID): {d['deck']}")
+            if cardname is not None:
+                output.append(f"    {[cardname.get(cid, '？？？') for cid in d['deck'][:3]]}")
+                output.append(f"    {[cardname.get(cid, '？？？') for cid in d['deck'][3:]]}")
+    return "\n".join(output)
+
+
+def combo_cards(combo: list[dict]) -> list[int]:
+    return [cid for d in combo for cid in d["deck"]]
+
+
+def combo_key(combo: list[dict]) -> tuple[int, ...]:
+    return tuple(d["rank"] for d in combo)
+
+
+def new_top_combos(top_k: int = 1, min_diff: int = 0) -> TopCombos:
+    return TopCombos(top_k, min_diff, combo_cards, combo_key)
+
+
+def songs_to_extend(best_pts: list[int], next_pts: list[Optional[int]], threshold: int) -> list[int]:
+    """
+    最优性证明: 使用第 s 首歌被截断卡组的组合，总 Pt 不超过
+    该歌曲第一个被截断卡组的 Pt + 其他歌曲的最高 Pt。
+    该上限不超过 threshold (进入前 K 名需要超过的总 Pt) 时，截断不影响结果。
+    限制最少不同卡牌数 (MIN_DIFF_CARDS) 时只对第一名成立。
+
+    Args:
+        best_pts: 每首歌的最高 Pt。
+        next_pts: 每首歌第一个被截断卡组的 Pt，没有截断时为 None。
+        threshold: 搜索结束时的前 K 名下限。
+
+    Returns:
+        list[int]: 需要扩大 N 的歌曲下标，为空时结果在完整log中最优。
+    """
+    total_best = sum(best_pts)
+    return [s for s, next_pt in enumerate(next_pts)
+            if next_pt is not None and next_pt + total_best - best_pts[s] > threshold]
+
+
+class PackedLevel:
+    """
+    一首歌候选卡组的 numpy 数组形式: 位掩码按 64 位拆分为 uint64 列，Pt 取负后升序排列便于二分。
+    """
+
+    def __init__(self, decks: list[dict], n_words: int):
+        self.n_words = n_words
+        self.words = np.zeros((len(decks), n_words), dtype=np.uint64)
+        for row, deck in enumerate(decks):
+            self.words[row] = self.split(deck["mask"])
+        self.neg_pts = np.array([-deck["pt"] for deck in decks], dtype=np.int64)
+
+    def split(self, mask: int) -> "np.ndarray":
+        return np.array([(mask >> (64 * i)) & 0xFFFFFFFFFFFFFFFF for i in range(self.n_words)], dtype=np.uint64)
+
+
+def pack_last_level(levels: list[list[dict]]) -> Optional[PackedLevel]:
+    """
+    将最后一首歌的候选转换为 PackedLevel，未安装 numpy 或 USE_NUMPY 为 False 时返回 None。
+    """
+    if np is None or not USE_NUMPY or not all(levels):
+        return None
+    max_bits = max(deck["mask"].bit_length() for decks in levels for deck in decks)
+    return PackedLevel(levels[-1], max(1, (max_bits + 63) // 64))
+
+
+def make_lagrangian(levels: list[list[dict]]) -> Optional[LagrangianBound]:
+    """
+    为搜索建立拉格朗日松弛上限，少于三首歌 (没有剩余两首歌的分支) 或 LAGRANGE_ITERATIONS 为 0 时返回 None。
+    """
+    if LAGRANGE_ITERATIONS <= 0 or len(levels) < 3:
+        return None
+    return LagrangianBound([[deck["pt"] for deck in decks] for decks in levels],
+                           [[deck["mask"] for deck in decks] for decks in levels])
+
+
+def search_best_combo(
+    levels: list[list[dict]],
+    songs: list[tuple[str, str]],
+    top_k: int = 1,
+    min_diff: int = 0,
+    first_range: Optional[tuple[int, int]] = None,
+    shared_best=None,
+    packed_last: Optional[PackedLevel] = None,
+    top: Optional[TopCombos] = None,
+    lagrangian: Optional[LagrangianBound] = None,
+) -> TopCombos:
+    """
+    分支定界搜索各歌曲卡组互不重复卡牌、总 Pt 最高的组合，歌曲数量任意。
+    每层按 Pt 降序遍历候选，已选 Pt 加上之后各层最高 Pt 仍不超过第 K 名时剪枝；
+    最后一层的候选 Pt 不足以进入前 K 名时结束该分支。
+    卡组以 Python int 作为位掩码，卡牌种类超过 64 张也无需特殊处理。
+
+    Args:
+        levels: 按搜索顺序排列的各歌曲候选卡组，每首歌按 Pt 降序。
+        songs: 与 levels 对应的 (歌曲ID, 难度)，用于输出日志。
+        top_k: 保留的组合数量。
+        min_diff: 前 K 个组合之间至少不同的卡牌数量。
+        first_range: 只搜索第一首歌下标在 [start, end) 内的候选，默认全部。
+        shared_best: 进程间共享的剪枝下限 (multiprocessing.Value)，即各进程第 K 名总 Pt 的最大值，
+                     在前两层读取以收紧剪枝，本进程的第 K 名提高时写回。指定时不输出日志与进度条。
+        packed_last: pack_last_level(levels) 的结果，指定时最后一首歌以向量化运算检查冲突。
+        top: 已有的前 K 名 (如上一轮搜索的结果)，从其下限开始剪枝并在其中加入新组合。
+        lagrangian: make_lagrangian(levels) 的结果，指定时在剩余至少两首歌的分支入口用松弛上限剪枝。
+
+    Returns:
+        TopCombos: 前 K 名组合，无解时为空。
+    """
+    if top is None:
+        top = new_top_combos(top_k, min_diff)
+    n = len(levels)
+    if any(not decks for decks in levels):
+        return top
+
+    # suffix_best[k]: 第 k 首及之后各歌曲最高 Pt 之和，不考虑卡牌冲突
+    suffix_best = [0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        suffix_best[k] = suffix_best[k + 1] + levels[k][0]["pt"]
+
+    # 剪枝下限: 新组合需要超过的总 Pt
+    bound = top.threshold
+    chosen: list[dict] = [None] * n
+
+    def record(deck: dict, total_pt: int):
+        nonlocal bound
+        chosen[n - 1] = deck
+        combo = list(chosen)
+        if not top.offer(total_pt, combo):
+            return
+        bound = max(bound, top.threshold)
+        if shared_best is None:
+            if top.best[1] is combo:
+                log_combo(total_pt, combo, songs)
+        elif top.threshold > shared_best.value:
+            with shared_best.get_lock():
+                if top.threshold > shared_best.value:
+                    shared_best.value = top.threshold
+
+    def descend_last_packed(used: int, total_pt: int):
+        decks = levels[n - 1]
+        for deck in decks[:VECTOR_BLOCK]:
+            if total_pt + deck["pt"] <= bound:
+                return
+            if deck["mask"] & used:
+                continue
+            record(deck, total_pt + deck["pt"])
+        used_words = packed_last.split(used)
+        # 只需检查 Pt 足以超过下限的前缀: pt > bound - total_pt
+        end = int(np.searchsorted(packed_last.neg_pts, total_pt - bound, side='left'))
+        start = VECTOR_BLOCK
+        block = VECTOR_BLOCK
+        while start < end:
+            stop = min(start + block, end)
+            conflict = (packed_last.words[start:stop] & used_words).any(axis=1)
+            for row in np.flatnonzero(~conflict):
+                deck = decks[start + int(row)]
+                if total_pt + deck["pt"] <= bound:
+                    return
+                record(deck, total_pt + deck["pt"])
+            start = stop
+            block = min(block * 2, VECTOR_BLOCK_MAX)
+
+    def descend(k: int, used: int, total_pt: int):
+        nonlocal bound
+        decks = levels[k]
+
+        if shared_best is not None and k <= 1:
+            # 读取其他进程的剪枝下限，只用于剪枝；本进程返回的组合与总 Pt 只来自 top，不与共享下限混用
+            bound = max(bound, shared_best.value)
+
+        # 拉格朗日松弛上限剪枝: 剩余歌曲在不重复卡牌的条件下也不可能进入前 K 名
+        if lagrangian is not None and 0 < k < n - 1 and bound >= 0:
+            if not lagrangian.can_exceed(range(k, n), used, bound - total_pt, LAGRANGE_ITERATIONS):
+                return
+
+        if k == n - 1:
+            if packed_last is not None:
+                descend_last_packed(used, total_pt)
+                return
+            for deck in decks:
+                if total_pt + deck["pt"] <= bound:
+                    break
+                if deck["mask"] & used:
+                    continue
+                record(deck, total_pt + deck["pt"])
+            return
+
+        rest_best = suffix_best[k + 1]
+        iterable = decks
+        if k == 0:
+            if first_range is not None:
+                iterable = decks[first_range[0]:first_range[1]]
+            elif shared_best is None:
+                iterable = tqdm(decks, desc="Song 1", leave=True, position=0)
+        for deck in iterable:
+            pt = deck["pt"]
+            # 上限剪枝：即便之后各层都选取最高pt，也不可能进入前 K 名
+            if total_pt + pt + rest_best <= bound:
+                break
+            # 检查冲突
+            if deck["mask"] & used:
+                continue
+            chosen[k] = deck
+            descend(k + 1, used | deck["mask"], total_pt + pt)
+
+    descend(0, 0, 0)
+    return top
+
+
+_worker_levels: list[list[dict]] = None
+_worker_best = None
+_worker_top_k = 1
+_worker_min_diff = 0
+_worker_packed_last: Optional[PackedLevel] = None
+_worker_lagrangian: Optional[LagrangianBound] = None
+
+
+def _init_search_worker(levels: list[list[dict]], shared_best, top_k: int, min_diff: int):
+    global _worker_levels, _worker_best, _worker_top_k, _worker_min_diff, _worker_packed_last, _worker_lagrangian
+    _worker_levels = levels
+    _worker_best = shared_best
+    _worker_top_k = top_k
+    _worker_min_diff = min_diff
+    _worker_packed_last = pack_last_level(levels)
+    _worker_lagrangian = make_lagrangian(levels)
+
+
+def _search_chunk(first_range: tuple[int, int]) -> list[tuple[int, list[dict]]]:
+    top = search_best_combo(_worker_levels, None, _worker_top_k, _worker_min_diff, first_range, _worker_best,
+                            _worker_packed_last, lagrangian=_worker_lagrangian)
+    return top.ranked()
+
+
+def parallel_search_best_combo(
+    levels: list[list[dict]],
+    songs: list[tuple[str, str]],
+    top_k: int = 1,
+    min_diff: int = 0,
+    processes: int = PROCESSES,
+    top: Optional[TopCombos] = None,
+) -> TopCombos:
+    """
+    将第一首歌的候选分块交给进程池并行搜索。
+    min_diff = 0 时前 K 名的总 Pt 与 search_best_combo 相同 (同分组合的先后可能不同)；
+    min_diff > 0 时各进程先按各自的搜索顺序做贪心筛选再合并，只保证第一名相同，其余名次可能与串行搜索不同。
+    各进程通过共享内存中的剪枝下限互相收紧剪枝 (任一进程的第 K 名总 Pt 不会高于全局第 K 名)。
+    第一首歌按 Pt 降序分块，排在后面的块在下限足够高时会立即结束。
+    """
+    if top is None:
+        top = new_top_combos(top_k, min_diff)
+    if any(not decks for decks in levels):
+        return top
+
+    shared_best = multiprocessing.Value('q', top.threshold)
+    chunks = [(start, min(start + FIRST_LEVEL_CHUNK, len(levels[0])))
+              for start in range(0, len(levels[0]), FIRST_LEVEL_CHUNK)]
+
+    initargs = (levels, shared_best, top_k, min_diff)
+    with multiprocessing.Pool(processes, initializer=_init_search_worker, initargs=initargs) as pool:
+        results = pool.imap_unordered(_search_chunk, chunks)
+        for ranked in tqdm(results, total=len(chunks), desc="Song 1", leave=True, position=0):
+            best_pt = top.best[0]
+            top.merge(ranked)
+            if top.best[0] > best_pt:
+                log_combo(*top.best, songs)
+    return top
+
+
 if __name__ == "__main__":
     fix_windows_console_encoding()
 
@@ -68,68 +411,39 @@ if __name__ == "__main__":
 
     level_files = []
     for music_id, difficulty in CHALLENGE_SONGS:
-        level_files.append(os.path.join("log", f"simulation_results_{music_id}_{difficulty}.json"))
+        level_files.append(log_path(music_id, difficulty))
 
     # === 读取与准备数据 ===
     logger.info("Preparing data...")
-    levels_raw = []
-    all_cards = set()
-
     title = get_song_title()
     if SHOWNAME:
         cardname = get_card_name()
-    for i, f in enumerate(level_files):
-        with open(f, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
-            total = len(data)
-            data.sort(key=lambda x: x["pt"], reverse=True)
-            data = data[:TOP_N]
-            levels_raw.append(data)
-            for deck in data:
-                all_cards.update(deck["deck_card_ids"])
-        song_id, difficulty = CHALLENGE_SONGS[i]
-        logger.info(f"Loaded top {TOP_N} of {total} results for {song_id}_{difficulty} ({title.get(song_id, '？？？')})")
 
-    # 仅针对两首歌曲求解时，第三首歌填充假数据
-    if len(CHALLENGE_SONGS) == 2:
-        levels_raw.append([{
-            "deck_card_ids": [],
-            "score": 0,
-            "pt": 0
-        }])
-
-    # === 根据每关最高 Pt 重新排序（默认按大、小、中顺序）===
-    if len(CHALLENGE_SONGS) == 3:
-        best = [deck[0]["pt"] for deck in levels_raw]
-        i_max = max(range(3), key=lambda i: best[i])
-        i_min = min(range(3), key=lambda i: best[i])
-        i_mid = 3 - i_max - i_min
-        sorted_indices = [i_max, i_min, i_mid]
-        # 重排 CHALLENGE_SONGS 和 levels_raw
-        CHALLENGE_SONGS = [CHALLENGE_SONGS[i] for i in sorted_indices]
-        levels_raw = [levels_raw[i] for i in sorted_indices]
-        logger.info(f"Challenge songs reordered for optimization: {CHALLENGE_SONGS}")
-
-    # === 建立卡牌ID到bit位的映射 ===
-    card_to_bit = {cid: i for i, cid in enumerate(sorted(all_cards))}
-    logger.info(f"Loaded {len(card_to_bit)} unique cards")
-    #assert len(card_to_bit) <= 64, "卡牌种类超过64张时需使用更复杂的bitarray方案"
-    assert len(card_to_bit) >= 6 * len(CHALLENGE_SONGS), "可用卡牌过少，必定出现重复卡牌"
+    # === 建立卡牌ID到bit位的映射 (读取时按需分配) ===
+    card_to_bit = {}
 
     # === 转换deck为bitmask ===
     def deck_to_mask(deck):
         mask = 0
         for cid in deck["deck_card_ids"]:
-            mask |= 1 << card_to_bit[cid]
+            bit = card_to_bit.get(cid)
+            if bit is None:
+                bit = card_to_bit[cid] = len(card_to_bit)
+            mask |= 1 << bit
         return mask
 
-    levels = []
-    for data in levels_raw:
+    def load_level(path: str, size: int) -> tuple[list[dict], Optional[int], int]:
+        """
+        流式读取 Pt 最高的 size 个卡组，多读一条用于判断截断。
+        返回 (候选卡组, 第一个被截断卡组的 Pt (没有截断时为 None), log总条数)。
+        """
+        data, total = load_top_results(path, size + 1)
+        next_pt = data[size]["pt"] if len(data) > size else None
         decks = []
-        for i, deck in enumerate(data, start=1):
+        for i, deck in enumerate(data[:size], start=1):
             # 忽略包含特定卡牌的卡组
             if any(cid in deck["deck_card_ids"] for cid in FORBIDDEN_CARD):
-                    continue
+                continue
             decks.append({
                 "mask": deck_to_mask(deck),
                 "rank": i,
@@ -137,82 +451,89 @@ if __name__ == "__main__":
                 "pt": deck["pt"],
                 "deck": deck["deck_card_ids"]
             })
-        levels.append(decks)
-
-    logger.info("Starting deck optimization...")
-    # === 主搜索逻辑 ===
-    best_pt = -1
-    best_combo = None
-
-    # 三重循环 + 多级剪枝
-    for i1, deck1 in tqdm(enumerate(levels[0]), total=len(levels[0]), desc="Song 1", leave=True, position=0):
-        mask1, pt1 = deck1["mask"], deck1["pt"]
-
-        # 上限剪枝：即便选取剩下两关最高pt，也不可能超过best_pt
-        max_possible = pt1 + levels[1][0]["pt"] + levels[2][0]["pt"]
-        if max_possible <= best_pt:
-            break
+        return decks, next_pt, total
 
-        for i2, deck2 in enumerate(levels[1]):
-            mask2, pt2 = deck2["mask"], deck2["pt"]
-
-            # 检查冲突
-            if mask1 & mask2:
-                continue
+    sizes = [TOP_N] * len(CHALLENGE_SONGS)
+    levels = []
+    next_pts = []
+    for i, f in enumerate(level_files):
+        decks, next_pt, total = load_level(f, TOP_N)
+        levels.append(decks)
+        next_pts.append(next_pt)
+        song_id, difficulty = CHALLENGE_SONGS[i]
+        logger.info(f"Loaded top {TOP_N} of {total} results for {song_id}_{difficulty} ({title.get(song_id, '？？？')})")
 
-            pt12 = pt1 + pt2
+    # === 根据每关最高 Pt 重新排序（最大的在前，其余升序）===
+    if all(levels):
+        sorted_indices = order_songs([decks[0]["pt"] for decks in levels])
+        # 重排 CHALLENGE_SONGS 和 levels
+        CHALLENGE_SONGS = [CHALLENGE_SONGS[i] for i in sorted_indices]
+        level_files = [level_files[i] for i in sorted_indices]
+        levels = [levels[i] for i in sorted_indices]
+        next_pts = [next_pts[i] for i in sorted_indices]
+        logger.info(f"Challenge songs reordered for optimization: {CHALLENGE_SONGS}")
 
-            # 第二层剪枝：deck3最高pt都不够超越当前最优
-            if pt12 + levels[2][0]["pt"] <= best_pt:
-                break
+    logger.info(f"Loaded {len(card_to_bit)} unique cards")
+    assert len(card_to_bit) >= 6 * len(CHALLENGE_SONGS), "可用卡牌过少，必定出现重复卡牌"
 
-            for i3, deck3 in enumerate(levels[2]):
-                mask3, pt3 = deck3["mask"], deck3["pt"]
+    best_pts = [decks[0]["pt"] if decks else 0 for decks in levels]
+    top = new_top_combos(TOP_K, MIN_DIFF_CARDS)
+    certified = not ADAPTIVE_TOP_N
 
-                # 冲突检测
-                if (mask1 | mask2) & mask3:
-                    continue
+    # === 主搜索逻辑 ===
+    while True:
+        logger.info(f"Starting deck optimization with top {sizes} decks...")
+        if PROCESSES > 1:
+            logger.info(f"Searching with {PROCESSES} processes...")
+            top = parallel_search_best_combo(levels, CHALLENGE_SONGS, TOP_K, MIN_DIFF_CARDS, PROCESSES, top=top)
+        else:
+            top = search_best_combo(levels, CHALLENGE_SONGS, TOP_K, MIN_DIFF_CARDS,
+                                    packed_last=pack_last_level(levels), top=top,
+                                    lagrangian=make_lagrangian(levels))
+        if not ADAPTIVE_TOP_N:
+            break
 
-                total_pt = pt12 + pt3
-
-                if total_pt > best_pt:
-                    best_pt = total_pt
-                    best_combo = (deck1, deck2, deck3)
-                    logger.info(f"New best total pt found: {best_pt:,}")
-                    for i, d in enumerate(best_combo):
-                        if i >= len(CHALLENGE_SONGS):
-                            break
-                        logger.info(f"  Song {i+1} {CHALLENGE_SONGS[i]}: ")
-                        logger.info(f"    Pt: {d['pt']:,}\tScore: {d['score']:,}\tRank: {d['rank']}")
-                        logger.info(f"    Deck (ID): {d['deck']}")
-                else:
-                    break
+        extend = songs_to_extend(best_pts, next_pts, top.threshold)
+        if not extend:
+            certified = True
+            break
+        new_sizes = list(sizes)
+        for s in extend:
+            new_size = sizes[s] * 2
+            if TOP_N_LIMIT is not None:
+                new_size = min(new_size, TOP_N_LIMIT)
+            new_sizes[s] = new_size
+        if new_sizes == sizes:
+            break
+        logger.info(f"Truncated decks of songs {[s + 1 for s in extend]} may still improve the result, extending top N...")
+        for s in extend:
+            if new_sizes[s] != sizes[s]:
+                levels[s], next_pts[s], _ = load_level(level_files[s], new_sizes[s])
+        sizes = new_sizes
+
+    if certified and ADAPTIVE_TOP_N and MIN_DIFF_CARDS > 0 and TOP_K > 1:
+        # 限制最少不同卡牌数时，证明只对第一名成立
+        logger.info(f"Best combination is optimal over the full logs (top {sizes} decks searched), "
+                    f"lower ranks are only within the searched decks.")
+    elif certified and ADAPTIVE_TOP_N:
+        logger.info(f"Result is optimal over the full logs (top {sizes} decks searched).")
+    elif ADAPTIVE_TOP_N:
+        logger.warning(f"TOP_N_LIMIT reached, result is only optimal within the top {sizes} decks.")
 
     end_time = time.time()
     logger.info("--- Optimization completed! ---")
     logger.info(f"Total time: {end_time - start_time:.2f} seconds \n")
 
     # === 输出结果 ===
-    output = []
-    output.append("=== Best Combination ===")
-
-    if best_pt > 0:
-        output.append(f"Total Pt: {best_pt:16,}")
-        for i, d in enumerate(best_combo):
-            if i < len(CHALLENGE_SONGS):
-                song_id, difficulty = CHALLENGE_SONGS[i]
-                output.append(f"  Song {i+1} | {song_id} ({difficulty}) | {title.get(song_id, '？？？')}")
-                output.append(f"    Score: {d['score']:15,}")
-                output.append(f"    Pt: {d['pt']:18,}\tRank: {d['rank']}")
-                output.append(f"    Deck (ID): {d['deck']}")
-                if SHOWNAME:
-                    output.append(f"    {[cardname.get(cid, '？？？') for cid in d['deck'][:3]]}")
-                    output.append(f"    {[cardname.get(cid, '？？？') for cid in d['deck'][3:]]}")
-        output = "\n".join(output)
+    ranked = top.ranked()
+
+    if ranked and ranked[0][0] > 0:
+        output = format_ranked(ranked, CHALLENGE_SONGS, title, cardname if SHOWNAME else None)
         logger.info(f"{output}")
-        with open("best_3_song_combo.txt", "w", encoding="utf-8") as f:
+        output_filename = f"best_{len(CHALLENGE_SONGS)}_song_combo.txt"
+        with open(output_filename, "w", encoding="utf-8") as f:
             f.write(output)
             f.write("\n")
-        logger.info(f"Best 3-song combination saved to best_3_song_combo.txt")
+        logger.info(f"Best {len(CHALLENGE_SONGS)}-song combination saved to {output_filename}")
     else:
-        logger.info("No valid 3-deck combination found.")
+        logger.info(f"No valid {len(CHALLENGE_SONGS)}-deck combination found.")
@@ -4,6 +4,9 @@ import os
 import time
 from tqdm import tqdm
 from CardLevelConfig import fix_windows_console_encoding
+from result_store import load_top_results, log_path
+from top_combos import TopCombos
+from lagrangian_bound import LagrangianBound
 
 
 # Set up logging for this script
@@ -28,6 +31,15 @@ CHALLENGE_SONGS = [
 # 每首歌只保留得分排名前 N 名的卡组用于求解
 TOP_N_CANDIDATES = 5000
 
+# 输出总 Pt 最高的前 K 个组合
+TOP_K = 1
+# 前 K 个组合之间至少不同的卡牌数量，0 为不限制
+MIN_DIFF_CARDS = 0
+
+# 拉格朗日松弛上限的次梯度迭代次数，在剩余至少两首歌的分支入口剪枝，0 为不使用
+# 各面最高分卡组互相冲突、分数接近时效果明显 (simple_pruning_mode 下不使用)
+LAGRANGE_ITERATIONS = 10
+
 # 仅根据每面最高分剪枝，不考虑重复卡
 # 三面分差较大时适用，小分差时很慢
 simple_pruning_mode = False
@@ -35,9 +47,9 @@ simple_pruning_mode = False
 
 def load_song_simulation_results(music_id: str, difficulty: str) -> list[dict]:
     """
-    Loads simulation results for a specific song and difficulty from a JSON file.
+    Streams simulation results for a specific song and difficulty from a JSON or binary log.
     Deduplicates decks based on card composition (ignoring order) and keeps the highest score
-    for each unique composition. Then filters and returns the top N candidates.
+    for each unique composition, holding only the top N candidates in memory.
 
     Args:
         music_id (str): The ID of the music track.
@@ -48,47 +60,24 @@ def load_song_simulation_results(music_id: str, difficulty: str) -> list[dict]:
                     with its 'deck_card_ids', 'pt' and 'score'.
                     Returns an empty list if the file is not found or an error occurs.
     """
-    filename = f"log\simulation_results_{music_id}_{difficulty}.json"
+    filename = log_path(music_id, difficulty)
     if not os.path.exists(filename):
         logger.error(f"Error: Simulation results file not found for {music_id}-{difficulty}: {filename}")
         return []
 
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            raw_results = json.load(f)
-
-        # --- New Logic: Deduplicate and keep highest score for each unique card combination ---
-        unique_decks_best_pts = {}  # Key: tuple of sorted card IDs, Value: {'deck_card_ids': original_list, 'score': best_score}
-
-        for result in raw_results:
-            current_deck_card_ids = result['deck_card_ids']
-            current_score = result['score']
-            current_pt = result['pt']
-
-            # Create a standardized key for comparison (sorted tuple of card IDs)
-            # Ensure card IDs are integers for consistent sorting if they are not already
-            sorted_card_ids_tuple = tuple(sorted(map(int, current_deck_card_ids)))
-
-            if sorted_card_ids_tuple not in unique_decks_best_pts or \
-               current_pt > unique_decks_best_pts[sorted_card_ids_tuple]['pt']:
-                # If this is a new unique combination or we found a higher score for it
-                unique_decks_best_pts[sorted_card_ids_tuple] = {
-                    'deck_card_ids': current_deck_card_ids,
-                    'score': current_score,
-                    'pt': current_pt
-                }
-
-        # Convert the unique decks dictionary back to a list of results
-        processed_results = list(unique_decks_best_pts.values())
-        logger.info(f"Loaded {len(raw_results)} raw results for {music_id}-{difficulty}.")
-        logger.info(f"After deduplication, {len(processed_results)} unique deck compositions remain.")
-
-        # Sort results by score in descending order
-        processed_results.sort(key=lambda x: x['pt'], reverse=True)
+        # 流式读取，每个卡组组成只保留最高分，且只在堆中保留前 N 名
+        raw_results, total = load_top_results(filename, TOP_N_CANDIDATES, dedup=True)
+        processed_results = [{
+            'deck_card_ids': result['deck_card_ids'],
+            'score': result['score'],
+            'pt': result['pt']
+        } for result in raw_results]
+        logger.info(f"Loaded {total} raw results for {music_id}-{difficulty}.")
 
         # Return only the top N candidates
-        logger.info(f"Returning top {TOP_N_CANDIDATES} candidates for {music_id}-{difficulty}.")
-        return processed_results[:TOP_N_CANDIDATES]
+        logger.info(f"Returning top {len(processed_results)} unique deck compositions for {music_id}-{difficulty}.")
+        return processed_results
 
     except json.JSONDecodeError as e:
         logger.error(f"Error decoding JSON from {filename}: {e}")
@@ -104,6 +93,92 @@ best_global_pt = -1
 best_global_decks = []  # Stores a list of {"song_id": ..., "deck_card_ids": [...], "score": ...} for the best combination
 
 
+def combo_card_ids(decks_info: list[dict]) -> list[int]:
+    return [card_id for deck_info in decks_info for card_id in deck_info['deck_card_ids']]
+
+
+# 前 K 名组合，剪枝以第 K 名的总 Pt 为下限 (TOP_K = 1 时即 best_global_pt)
+top_combos = TopCombos(TOP_K, MIN_DIFF_CARDS, combo_card_ids)
+
+# 卡牌id -> 位掩码中的bit位，所有歌曲共用
+card_bits: dict[int, int] = {}
+
+
+def cards_to_mask(card_ids) -> int:
+    mask = 0
+    for card_id in card_ids:
+        bit = card_bits.get(card_id)
+        if bit is None:
+            bit = card_bits[card_id] = len(card_bits)
+        mask |= 1 << bit
+    return mask
+
+
+class CandidateIndex:
+    """
+    单首歌候选卡组 (按 Pt 降序) 的倒排索引，用于查询"不使用指定卡牌的最高分卡组"。
+    每张卡牌对应一个位集: 第 i 位表示第 i 个候选使用了该卡牌。
+    查询时将已用卡牌的位集取并集，未被覆盖的最低位即为第一个可用的候选，
+    开销只与已用卡牌数有关，不再逐个检查候选。
+    """
+
+    def __init__(self, candidates: list[dict]):
+        self.candidates = candidates
+        self.masks = [cards_to_mask(candidate['deck_card_ids']) for candidate in candidates]
+        self.pts = [candidate['pt'] for candidate in candidates]
+        self.relevant = 0
+        for mask in self.masks:
+            self.relevant |= mask
+        # 卡牌bit位 -> 使用该卡牌的候选位置的位集
+        self.postings: dict[int, int] = {}
+        for position, candidate in enumerate(candidates):
+            for card_id in candidate['deck_card_ids']:
+                bit = card_bits[card_id]
+                self.postings[bit] = self.postings.get(bit, 0) | 1 << position
+        self.all_positions = (1 << len(candidates)) - 1
+
+    def best_avoiding(self, used_mask: int) -> int:
+        """
+        返回不使用 used_mask 中卡牌的最高 Pt，没有时为 0。
+        """
+        postings = self.postings
+        blocked = 0
+        key = used_mask & self.relevant
+        while key:
+            low = key & -key
+            blocked |= postings[low.bit_length() - 1]
+            key ^= low
+        free = self.all_positions & ~blocked
+        if not free:
+            return 0
+        return self.pts[(free & -free).bit_length() - 1]
+
+
+candidate_indexes: dict[str, CandidateIndex] = {}
+
+
+def get_candidate_index(song_id: str, candidates: list[dict]) -> CandidateIndex:
+    index = candidate_indexes.get(song_id)
+    if index is None or index.candidates is not candidates:
+        index = candidate_indexes[song_id] = CandidateIndex(candidates)
+    return index
+
+
+# 拉格朗日松弛上限，歌曲顺序与 challenge_song_ids 一致
+lagrangian_bound: LagrangianBound = None
+lagrangian_indexes: list[CandidateIndex] = []
+
+
+def get_lagrangian_bound(all_song_candidates: dict[str, list[dict]], challenge_song_ids: list[str]) -> LagrangianBound:
+    global lagrangian_bound, lagrangian_indexes
+    indexes = [get_candidate_index(song_id, all_song_candidates.get(song_id, [])) for song_id in challenge_song_ids]
+    if lagrangian_bound is None or len(indexes) != len(lagrangian_indexes) or \
+            any(index is not old for index, old in zip(indexes, lagrangian_indexes)):
+        lagrangian_bound = LagrangianBound([index.pts for index in indexes], [index.masks for index in indexes])
+        lagrangian_indexes = indexes
+    return lagrangian_bound
+
+
 def find_best_three_decks(
     song_idx: int,
     all_song_candidates: dict[str, list[dict]],
@@ -131,10 +206,11 @@ def find_best_three_decks(
 
     # Base Case: All three songs have been assigned a deck
     if song_idx == len(challenge_song_ids):  # Check if we've processed all songs
-        if current_total_pt > best_global_pt:
+        # Copy to store the current combination
+        combo = list(current_selected_decks_info)
+        if top_combos.offer(current_total_pt, combo) and current_total_pt > best_global_pt:
             best_global_pt = current_total_pt
-            # Deep copy to store the current best combination
-            best_global_decks = list(current_selected_decks_info)
+            best_global_decks = combo
             logger.info(f"New best total pt found: {best_global_pt}")
             for i, deck_info in enumerate(best_global_decks):
                 logger.info(f"  Song {i+1} ({deck_info['music_id']}): ")
@@ -147,49 +223,44 @@ def find_best_three_decks(
 
     current_song_id = challenge_song_ids[song_idx]
     candidates_for_current_song = all_song_candidates.get(current_song_id, [])
+    current_index = get_candidate_index(current_song_id, candidates_for_current_song)
+    used_mask = cards_to_mask(used_card_ids_set)
 
     if simple_pruning_mode:
         # 切换到更简单的剪枝策略：
         # 1. 只考虑剩余最高分，不排除卡牌冲突
-        # 2. 如果当前total_pt加上剩余最高分小于等于best_global_pt，立即剪枝
+        # 2. 如果当前total_pt加上剩余最高分小于等于第 K 名的总 Pt (TOP_K = 1 时即 best_global_pt)，立即剪枝
         # 在三面分数相差较大时很快，分数接近时基本无效
-        remaining_max_pt_estimate = 0
+        song_estimates = []
         for i in range(song_idx, len(challenge_song_ids)):
             next_song_id = challenge_song_ids[i]
-            remaining_max_pt_estimate += all_song_candidates[next_song_id][0]['pt']
-
-        if current_total_pt + remaining_max_pt_estimate <= best_global_pt and best_global_pt != -1:
-            return
+            song_estimates.append(all_song_candidates[next_song_id][0]['pt'])
 
     else:
         # Pruning: 基于可用卡牌池的动态剪枝
-        remaining_max_pt_estimate = 0
-        # 模拟剩下的歌曲
+        # 模拟剩下的歌曲，取与当前已用卡牌无冲突的最高分卡组
+        # 通过 CandidateIndex 的倒排位集查询
+        song_estimates = []
         for i in range(song_idx, len(challenge_song_ids)):
             next_song_id = challenge_song_ids[i]
+            next_index = get_candidate_index(next_song_id, all_song_candidates.get(next_song_id, []))
+            song_estimates.append(next_index.best_avoiding(used_mask))
 
-            # 在all_song_candidates中寻找与当前used_card_ids_set无冲突的最高分卡组
-            # 这是一个关键的内层循环，可能会带来一些开销，但比无意义的递归要少
-            found_candidate_pt = 0
-            for candidate in all_song_candidates.get(next_song_id, []):
-                deck_card_ids = candidate['deck_card_ids']
-                has_conflict = False
-                for card_id in deck_card_ids:
-                    if card_id in used_card_ids_set:
-                        has_conflict = True
-                        break
-
-                if not has_conflict:
-                    # 找到第一个无冲突的最高分卡组
-                    found_candidate_pt = candidate['pt']
-                    break
-
-            remaining_max_pt_estimate += found_candidate_pt
-
-        # 如果当前路径即使加上所有无冲突的最高分也无法超越全局最佳，则剪枝
-        if best_global_pt != -1 and current_total_pt + remaining_max_pt_estimate <= best_global_pt:
+    remaining_max_pt_estimate = sum(song_estimates)
+    # 如果当前路径即使加上所有无冲突的最高分也无法进入前 K 名，则剪枝
+    if top_combos.threshold != -1 and current_total_pt + remaining_max_pt_estimate <= top_combos.threshold:
+        return
+    # 剩余至少两首歌时，用拉格朗日松弛上限 (考虑剩余歌曲之间的卡牌冲突) 进一步剪枝
+    if (not simple_pruning_mode and LAGRANGE_ITERATIONS > 0 and top_combos.threshold != -1
+            and len(challenge_song_ids) - song_idx >= 2):
+        bound = get_lagrangian_bound(all_song_candidates, challenge_song_ids)
+        target = top_combos.threshold - current_total_pt
+        if not bound.can_exceed(range(song_idx, len(challenge_song_ids)), used_mask, target, LAGRANGE_ITERATIONS):
             return
 
+    # 之后各首歌的估计值，用于在遍历当前歌曲的候选时提前结束
+    rest_max_pt_estimate = remaining_max_pt_estimate - song_estimates[0]
+
     iterable = candidates_for_current_song
     if song_idx == 0:
         iterable = tqdm(candidates_for_current_song, desc=f"Searching decks for {current_song_id}", unit="deck")
@@ -199,12 +270,12 @@ def find_best_three_decks(
         deck_score = candidate_deck_info['score']
         deck_pt = candidate_deck_info['pt']
 
+        # 候选按 Pt 降序，之后的卡组也无法进入前 K 名
+        if top_combos.threshold != -1 and current_total_pt + deck_pt + rest_max_pt_estimate <= top_combos.threshold:
+            break
+
         # Check for card conflicts
-        has_conflict = False
-        for card_id in deck_card_ids:
-            if card_id in used_card_ids_set:
-                has_conflict = True
-                break
+        has_conflict = bool(current_index.masks[index] & used_mask)
 
         if not has_conflict:
             # If no conflict, make the choice
@@ -262,6 +333,7 @@ if __name__ == "__main__":
     # Initialize global bests
     best_global_pt = -1
     best_global_decks = []
+    top_combos = TopCombos(TOP_K, MIN_DIFF_CARDS, combo_card_ids)
 
     find_best_three_decks(
         song_idx=0,
@@ -286,13 +358,23 @@ if __name__ == "__main__":
             logger.info(f"    Pt: {deck_info['pt']:,}\tRank: {deck_info['rank']}")
             logger.info(f"    Deck (ID): {deck_info['deck_card_ids']}")
 
+        ranked = top_combos.ranked()
+        for rank, (total_pt, decks_info) in enumerate(ranked[1:], start=2):
+            logger.info(f"\n--- Combination #{rank} ---")
+            logger.info(f"Total Combined Pt: {total_pt}")
+            for i, deck_info in enumerate(decks_info):
+                logger.info(f"  Song {i+1} ({deck_info['music_id']}):")
+                logger.info(f"    Pt: {deck_info['pt']:,}\tRank: {deck_info['rank']}")
+                logger.info(f"    Deck (ID): {deck_info['deck_card_ids']}")
+
         # Optional: Save the best combination to a separate JSON file
         output_filename = "best_3_song_combo.json"
         try:
             with open(output_filename, 'w', encoding='utf-8') as f:
                 json.dump({
                     "total_pt": best_global_pt,
-                    "decks": best_global_decks
+                    "decks": best_global_decks,
+                    "top_combos": [{"total_pt": total_pt, "decks": decks_info} for total_pt, decks_info in ranked],
                 }, f, ensure_ascii=False, indent=4)
             logger.info(f"Best 3-song combination saved to {output_filename}")
         except Exception as e:
@@ -0,0 +1,247 @@
+"""
+在线多曲组合求解
+
+与 MainBatch.py 同时运行，定期读取各歌曲的模拟结果 (最终log与运行中写入的前 N 名快照)，
+增量维护卡牌互不重复、总 Pt 最高的组合，结果刷新时立即输出。
+
+每次读取后只搜索包含新增卡组的组合: 将新卡组固定在其歌曲上，对其余歌曲做分支定界搜索，
+剪枝下限为当前已找到的前 K 名，因此新卡组无法进入前 K 名时搜索会立即结束。
+使用前需在 MainBatch.py 中将 ONLINE_TOP_N 设为大于 0 的值。
+"""
+import argparse
+import logging
+import os
+import time
+
+from CardLevelConfig import fix_windows_console_encoding
+from multi_optimizer_2 import get_song_title, get_card_name, order_songs, format_ranked, combo_cards, \
+    search_best_combo, pack_last_level, make_lagrangian
+from result_store import load_top_results, log_path, snapshot_path, composition_key
+from top_combos import TopCombos
+
+logger = logging.getLogger(__name__)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(message)s'
+)
+
+# === 配置 ===
+# 配置求解歌曲，格式: ("歌曲ID", "难度"),
+CHALLENGE_SONGS = [
+    ("405128", "02"),  # 令嬢モブ！
+    ("405126", "02"),  # チャーミングな花束を！
+    ("405120", "02"),  # ガランドFlash
+]
+
+# 每首歌只保留 Pt 排名前 N 名的卡组用于求解
+TOP_N = 2000
+# 输出总 Pt 最高的前 K 个组合
+TOP_K = 1
+# 前 K 个组合之间至少不同的卡牌数量，0 为不限制
+MIN_DIFF_CARDS = 0
+
+# MainBatch.py 的临时文件目录 (TEMP_OUTPUT_DIR)，快照写入此处
+TEMP_DIR = "temp"
+# 检查结果文件更新的间隔 (秒)
+POLL_INTERVAL = 10
+
+# 在控制台与文件输出中显示卡牌名称
+SHOWNAME = True
+
+# 寻找最优解时忽略包含特定卡牌的卡组 (所有歌曲均生效)
+# 填写格式为: [卡牌id1, 卡牌id2, ...]
+FORBIDDEN_CARD = []
+
+
+def online_combo_key(combo: list[dict]) -> tuple:
+    # 只按各歌曲卡组的组成区分，同一组成的 Pt 在之后的结果中提高时由 TopCombos 替换旧记录
+    return tuple(d["key"] for d in combo)
+
+
+class OnlineSong:
+    """
+    一首歌曲的结果来源与当前候选卡组。
+    """
+
+    def __init__(self, music_id: str, difficulty: str, top_n: int, temp_dir: str = TEMP_DIR):
+        self.music_id = music_id
+        self.difficulty = difficulty
+        self.top_n = top_n
+        self.paths = [log_path(music_id, difficulty), snapshot_path(music_id, difficulty, temp_dir)]
+        self.mtimes: dict[str, float] = {}
+        # 组成 -> 卡组，只保存在 decks 中的卡组
+        self.by_key: dict[tuple[int, ...], dict] = {}
+        # 按 Pt 降序的候选卡组
+        self.decks: list[dict] = []
+
+    def changed_files(self) -> list[tuple[str, float]]:
+        changed = []
+        # 运行结束后二进制log可能替代 JSON log
+        self.paths[0] = log_path(self.music_id, self.difficulty)
+        for path in self.paths:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self.mtimes.get(path) != mtime:
+                changed.append((path, mtime))
+        return changed
+
+    def poll(self, deck_to_mask) -> list[dict]:
+        """
+        读取有更新的结果文件，返回进入候选的新卡组 (新的组成或 Pt 更高的同一组成)。
+        """
+        added = {}
+        for path, mtime in self.changed_files():
+            try:
+                results, total = load_top_results(path, self.top_n, dedup=True)
+            except (OSError, ValueError) as e:
+                # 文件可能正在被替换，下次检查时重新读取
+                logger.warning(f"Failed to read {path}: {e}")
+                continue
+            self.mtimes[path] = mtime
+            for rank, result in enumerate(results, start=1):
+                if any(cid in result["deck_card_ids"] for cid in FORBIDDEN_CARD):
+                    continue
+                key = composition_key(result)
+                old = self.by_key.get(key)
+                if old is not None and result["pt"] <= old["pt"]:
+                    continue
+                deck = {
+                    "key": key,
+                    "mask": deck_to_mask(result["deck_card_ids"]),
+                    "rank": rank,
+                    "score": result["score"],
+                    "pt": result["pt"],
+                    "deck": result["deck_card_ids"],
+                }
+                self.by_key[key] = deck
+                added[key] = deck
+        if not added:
+            return []
+
+        decks = list(self.by_key.values())
+        decks.sort(key=lambda d: d["pt"], reverse=True)
+        self.decks = decks[:self.top_n]
+        for deck in decks[self.top_n:]:
+            del self.by_key[deck["key"]]
+        return [deck for deck in self.decks if added.get(deck["key"]) is deck]
+
+
+class OnlineOptimizer:
+    """
+    增量维护各歌曲候选卡组的前 K 名组合。
+    组合中的卡组按 songs 的顺序排列，搜索时按 order_songs 的顺序重排以加快剪枝。
+    """
+
+    def __init__(self, songs: list[OnlineSong], top_k: int = 1, min_diff: int = 0):
+        self.songs = songs
+        self.top_k = top_k
+        self.min_diff = min_diff
+        self.top = self.new_top()
+        self.card_to_bit: dict[int, int] = {}
+        # 所有歌曲都有候选后进行一次完整搜索，之后只搜索新卡组
+        self.searched = False
+
+    def new_top(self) -> TopCombos:
+        return TopCombos(self.top_k, self.min_diff, combo_cards, online_combo_key)
+
+    def deck_to_mask(self, deck_card_ids: list[int]) -> int:
+        mask = 0
+        for cid in deck_card_ids:
+            bit = self.card_to_bit.get(cid)
+            if bit is None:
+                bit = self.card_to_bit[cid] = len(self.card_to_bit)
+            mask |= 1 << bit
+        return mask
+
+    def search(self, levels: list[list[dict]], order: list[int], full: bool = False):
+        """
+        按 order 重排 levels 后搜索，以当前前 K 名为剪枝下限，并将新组合合并回前 K 名。
+        """
+        songs = [(self.songs[i].music_id, self.songs[i].difficulty) for i in order]
+        top = self.new_top()
+        top.merge((total_pt, [combo[i] for i in order]) for total_pt, combo in self.top.ranked())
+        ordered = [levels[i] for i in order]
+        if full:
+            top = search_best_combo(ordered, songs, packed_last=pack_last_level(ordered), top=top,
+                                    lagrangian=make_lagrangian(ordered))
+        else:
+            # 指定 first_range 以关闭进度条
+            top = search_best_combo(ordered, songs, first_range=(0, len(ordered[0])), top=top)
+
+        position = {s: k for k, s in enumerate(order)}
+        self.top.merge((total_pt, [combo[position[s]] for s in range(len(order))]) for total_pt, combo in top.ranked())
+
+    def poll(self) -> bool:
+        """
+        读取各歌曲的更新并搜索新组合，返回前 K 名是否被刷新。
+        """
+        added = []
+        for song in self.songs:
+            decks = song.poll(self.deck_to_mask)
+            if decks:
+                logger.info(f"{len(decks)} new decks for {song.music_id}_{song.difficulty} "
+                            f"(best Pt: {song.decks[0]['pt']:,})")
+            added.append(decks)
+        if not any(added):
+            return False
+
+        levels = [song.decks for song in self.songs]
+        if not all(levels):
+            return False
+        # 组合的标识不含 Pt，比较时同时比较总 Pt
+        before = [(total_pt, online_combo_key(combo)) for total_pt, combo in self.top.ranked()]
+        order = order_songs([decks[0]["pt"] for decks in levels])
+        if not self.searched:
+            logger.info(f"Starting full search with top {[len(decks) for decks in levels]} decks...")
+            self.search(levels, order, full=True)
+            self.searched = True
+        else:
+            # 新卡组之间的组合会在各自的搜索中重复找到，由 TopCombos 的唯一标识去重
+            for s, decks in enumerate(added):
+                if not decks:
+                    continue
+                fixed_order = [s] + [i for i in order if i != s]
+                for deck in decks:
+                    fixed_levels = list(levels)
+                    fixed_levels[s] = [deck]
+                    self.search(fixed_levels, fixed_order)
+        return [(total_pt, online_combo_key(combo)) for total_pt, combo in self.top.ranked()] != before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="与批量模拟同时运行，实时更新多曲组合")
+    parser.add_argument("--once", action="store_true", help="只读取一次当前结果并求解，不等待更新")
+    args = parser.parse_args()
+
+    fix_windows_console_encoding()
+
+    title = get_song_title() or {}
+    cardname = get_card_name() if SHOWNAME else None
+
+    songs = [OnlineSong(music_id, difficulty, TOP_N) for music_id, difficulty in CHALLENGE_SONGS]
+    optimizer = OnlineOptimizer(songs, TOP_K, MIN_DIFF_CARDS)
+    output_filename = f"online_best_{len(CHALLENGE_SONGS)}_song_combo.txt"
+
+    logger.info(f"Watching results of {CHALLENGE_SONGS}, press Ctrl+C to stop.")
+    try:
+        while True:
+            if optimizer.poll():
+                output = format_ranked(optimizer.top.ranked(), CHALLENGE_SONGS, title, cardname)
+                logger.info(output)
+                with open(output_filename, "w", encoding="utf-8") as f:
+                    f.write(output)
+                    f.write("\n")
+                logger.info(f"Best {len(CHALLENGE_SONGS)}-song combination saved to {output_filename}")
+            if args.once:
+                break
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+
+    if optimizer.top.best[1] is None:
+        logger.info(f"No valid {len(CHALLENGE_SONGS)}-deck combination found.")
+    else:
+        logger.info(f"Stopped. Best total Pt: {optimizer.top.best[0]:,}")
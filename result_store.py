@@ -0,0 +1,735 @@
+"""
+模拟结果的二进制存储格式
+
+文件结构:
+  MAGIC (8 bytes) | 头部长度 (uint32) | 头部 JSON (utf-8，补齐到 8 字节对齐) | 定长记录...
+
+头部记录歌曲、难度、卡牌练度、卡牌数据指纹与卡牌id到下标的映射，
+每条记录为 32 字节: 6 × uint16 卡牌下标 (保留卡组顺序)、uint16 C位下标、uint16 助战下标、
+int64 得分、int64 pt (未计算时为 -1)，无C位/助战时下标为 0xFFFF。
+
+读取时直接映射文件，通过 memoryview 逐条解析，安装 numpy 时可用 numpy.memmap 按列访问。
+JSON log 的卡牌练度与数据指纹保存在同名的 .meta.json 文件中。
+"""
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Callable, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SSDMRES1"
+RECORD = struct.Struct("<6HHHqq")
+NONE_INDEX = 0xFFFF
+LOG_DIR = "log"
+
+if np is not None:
+    RECORD_DTYPE = np.dtype([
+        ("cards", "<u2", (6,)),
+        ("center", "<u2"),
+        ("friend", "<u2"),
+        ("score", "<i8"),
+        ("pt", "<i8"),
+    ])
+
+
+def log_path(music_id: str, difficulty: str, ext: str = None) -> str:
+    """
+    返回歌曲模拟结果log的路径。
+    未指定扩展名时优先返回已存在的二进制log，否则返回 JSON log。
+    """
+    base = os.path.join(LOG_DIR, f"simulation_results_{music_id}_{difficulty}")
+    if ext:
+        return f"{base}.{ext}"
+    if os.path.exists(f"{base}.bin"):
+        return f"{base}.bin"
+    return f"{base}.json"
+
+
+def snapshot_path(music_id: str, difficulty: str, temp_dir: str = "temp") -> str:
+    """
+    返回批量模拟运行中定期写入的前 N 名快照的路径，供 online_optimizer.py 读取。
+    """
+    return os.path.join(temp_dir, f"top_{music_id}_{difficulty}.bin")
+
+
+def meta_path(path: str) -> str:
+    """
+    返回 JSON log 对应的卡牌练度记录文件的路径。
+    """
+    return os.path.splitext(path)[0] + ".meta.json"
+
+
+def card_meta(cards, levels: dict[int, list[int]] = None, data: dict[int, str] = None) -> dict:
+    return {
+        "levels": {str(card_id): levels[card_id] for card_id in cards if card_id in levels} if levels else {},
+        "data": {str(card_id): data[card_id] for card_id in cards if card_id in data} if data else {},
+    }
+
+
+def load_card_meta(path: str) -> tuple[dict[int, list[int]], dict[int, str]]:
+    """
+    读取log中记录的每张卡牌模拟时的练度与数据指纹，没有记录时为空。
+    """
+    if path.endswith(".bin"):
+        with ResultReader(path) as reader:
+            return reader.levels, reader.data
+    if not os.path.exists(meta_path(path)):
+        return {}, {}
+    with open(meta_path(path), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return ({int(k): v for k, v in meta.get("levels", {}).items()},
+            {int(k): v for k, v in meta.get("data", {}).items()})
+
+
+def save_card_meta(path: str, cards, levels: dict[int, list[int]] = None, data: dict[int, str] = None):
+    """
+    为 JSON log 写入卡牌练度记录，二进制log的记录在写入时保存在头部。
+    """
+    if path.endswith(".bin") or not (levels or data):
+        return
+    with open(meta_path(path), 'w', encoding='utf-8') as f:
+        json.dump(card_meta(cards, levels, data), f, ensure_ascii=False)
+
+
+def replace_log(src: str, dst: str):
+    """
+    以 src 替换 dst (含 JSON log 的练度记录)。
+    """
+    os.replace(src, dst)
+    if not src.endswith(".bin") and os.path.exists(meta_path(src)):
+        os.replace(meta_path(src), meta_path(dst))
+
+
+def remove_log(path: str):
+    """
+    删除log (含 JSON log 的练度记录)。
+    """
+    os.remove(path)
+    if not path.endswith(".bin") and os.path.exists(meta_path(path)):
+        os.remove(meta_path(path))
+
+
+def stale_cards(path: str, levels_of, data_of) -> set[int]:
+    """
+    返回log中记录的练度或数据指纹与当前值不一致的卡牌，包含这些卡牌的结果需要重新模拟。
+    没有记录的卡牌视为未改变。
+
+    Args:
+        path: log路径。
+        levels_of: 卡牌id -> 当前练度。
+        data_of: 卡牌id -> 当前数据指纹。
+    """
+    levels, data = load_card_meta(path)
+    stale = {card_id for card_id, recorded in levels.items() if recorded != levels_of(card_id)}
+    stale.update(card_id for card_id, recorded in data.items() if recorded != data_of(card_id))
+    return stale
+
+
+class ResultWriter:
+    """
+    流式写入二进制模拟结果，记录在缓冲区满后批量写入文件。
+    """
+
+    def __init__(self, path: str, cards: list[int], music_id: str = None, difficulty: str = None,
+                 levels: dict[int, list[int]] = None, buffer_size: int = 65536, data: dict[int, str] = None) -> None:
+        self.path = path
+        self.cards = sorted(set(cards))
+        self.card_index = {card_id: i for i, card_id in enumerate(self.cards)}
+        if len(self.cards) >= NONE_INDEX:
+            raise ValueError(f"Too many cards for result format: {len(self.cards)}")
+        self.count = 0
+        self._buffer = bytearray()
+        self._buffer_size = buffer_size * RECORD.size
+
+        header = {
+            "music_id": music_id,
+            "difficulty": difficulty,
+            "cards": self.cards,
+            **card_meta(self.cards, levels, data),
+        }
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        header_bytes += b" " * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._file.write(struct.pack("<I", len(header_bytes)))
+        self._file.write(header_bytes)
+
+    def write(self, deck_card_ids, center_card, friend_card, score: int, pt: int = -1):
+        card_index = self.card_index
+        self._buffer += RECORD.pack(
+            *[card_index[card_id] for card_id in deck_card_ids],
+            card_index[center_card] if center_card else NONE_INDEX,
+            card_index[friend_card] if friend_card else NONE_INDEX,
+            score, pt
+        )
+        self.count += 1
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def write_result(self, result: dict):
+        self.write(result["deck_card_ids"], result.get("center_card"), result.get("friend_card"),
+                   result["score"], result.get("pt", -1))
+
+    def flush(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultReader:
+    """
+    映射二进制模拟结果文件并按需解析记录。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a simulation result file: {path}")
+        header_size, = struct.unpack_from("<I", self._mmap, len(MAGIC))
+        self.offset = len(MAGIC) + 4 + header_size
+        self.header: dict = json.loads(self._mmap[len(MAGIC) + 4:self.offset].decode("utf-8"))
+        self.cards: list[int] = self.header["cards"]
+        self.levels: dict[int, list[int]] = {int(k): v for k, v in self.header.get("levels", {}).items()}
+        self.data: dict[int, str] = {int(k): v for k, v in self.header.get("data", {}).items()}
+        self.music_id = self.header.get("music_id")
+        self.difficulty = self.header.get("difficulty")
+
+    def __len__(self) -> int:
+        return (len(self._mmap) - self.offset) // RECORD.size
+
+    def records(self):
+        """
+        逐条返回原始记录 (6个卡牌下标, C位下标, 助战下标, 得分, pt)。
+        """
+        view = memoryview(self._mmap)[self.offset:self.offset + len(self) * RECORD.size]
+        try:
+            yield from RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def record(self, row: int) -> tuple:
+        """
+        返回第 row 条原始记录。
+        """
+        return RECORD.unpack_from(self._mmap, self.offset + row * RECORD.size)
+
+    def to_result(self, record: tuple) -> dict:
+        cards = self.cards
+        result = {
+            "deck_card_ids": [cards[i] for i in record[:6]],
+            "center_card": cards[record[6]] if record[6] != NONE_INDEX else None,
+            "friend_card": cards[record[7]] if record[7] != NONE_INDEX else None,
+            "score": record[8],
+        }
+        if record[9] >= 0:
+            result["pt"] = record[9]
+        return result
+
+    def __iter__(self):
+        for record in self.records():
+            yield self.to_result(record)
+
+    def as_array(self):
+        """
+        以 numpy.memmap 返回全部记录，可按列 (cards / center / friend / score / pt) 访问。
+        """
+        if np is None:
+            raise ImportError("numpy is required for ResultReader.as_array()")
+        return np.memmap(self.path, dtype=RECORD_DTYPE, mode="r", offset=self.offset, shape=(len(self),))
+
+    def close(self):
+        if not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultAggregator:
+    """
+    在线汇总模拟结果，每个卡组组成只保留最高分的一条记录，并维护全局前 N 名。
+
+    组成以排序后的卡牌下标打包成一个整数作为键 (第一张在最高位，整数大小顺序即组成的字典序)，
+    值同样打包为一个整数: 得分 << 64 | C位下标 << 48 | 助战下标 << 32 | 卡组顺序，
+    其中卡组顺序为每个卡位在排序后组成中的位置 (每位 3 bit)。
+    内存占用只与组成数量有关，与模拟的顺序数量无关。
+
+    前 N 名默认按得分排名，给出 rank (C位卡牌id, 得分) -> 排名值 时按其排名 (如 pt)。
+    """
+
+    def __init__(self, cards: list[int], top_n: int = 0,
+                 rank: Callable[[Optional[int], int], int] = None) -> None:
+        self.cards = sorted(set(cards))
+        self.card_index = {card_id: i for i, card_id in enumerate(self.cards)}
+        self.table: dict[int, int] = {}
+        self.top_n = top_n
+        self.rank = rank
+        # 前 N 名: 组成键 -> 打包值，每个组成只占一个名额
+        self.top: dict[int, int] = {}
+        # (排名值, 组成键, 打包值) 小顶堆，同一组成提高得分后旧记录留在堆中，与 top 不一致即为过期，取出时跳过
+        self.top_heap: list[tuple[int, int, int]] = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def pack(self, deck_card_ids, center_card, friend_card, score: int) -> tuple[int, int]:
+        card_index = self.card_index
+        indices = [card_index[card_id] for card_id in deck_card_ids]
+        ordered = sorted(indices)
+        key = 0
+        order = 0
+        for i in range(6):
+            key |= ordered[i] << (16 * (5 - i))
+            order |= ordered.index(indices[i]) << (3 * i)
+        center = card_index[center_card] if center_card else NONE_INDEX
+        friend = card_index[friend_card] if friend_card else NONE_INDEX
+        return key, score << 64 | center << 48 | friend << 32 | order
+
+    def unpack(self, key: int, value: int) -> dict:
+        cards = self.cards
+        ordered = [(key >> (16 * (5 - i))) & 0xFFFF for i in range(6)]
+        center = (value >> 48) & 0xFFFF
+        friend = (value >> 32) & 0xFFFF
+        return {
+            "deck_card_ids": [cards[ordered[(value >> (3 * i)) & 0x7]] for i in range(6)],
+            "center_card": cards[center] if center != NONE_INDEX else None,
+            "friend_card": cards[friend] if friend != NONE_INDEX else None,
+            "score": value >> 64,
+        }
+
+    def add(self, deck_card_ids, center_card, friend_card, score: int) -> bool:
+        """
+        添加一条模拟结果，返回该组成的最高分是否被更新。
+        """
+        self.count += 1
+        key, value = self.pack(deck_card_ids, center_card, friend_card, score)
+        return self.add_packed(key, value)
+
+    def add_packed(self, key: int, value: int) -> bool:
+        old = self.table.get(key)
+        if old is not None and value >> 64 <= old >> 64:
+            return False
+        self.table[key] = value
+        self._push_top(key, value)
+        return True
+
+    def _push_top(self, key: int, value: int):
+        if not self.top_n:
+            return
+        top = self.top
+        heap = self.top_heap
+        rank = self._rank(value)
+        old = top.get(key)
+        if old is not None:
+            # 与 table 一致，同一组成只保留得分最高的记录
+            if value >> 64 <= old >> 64:
+                return
+        elif len(top) >= self.top_n:
+            self._drop_stale()
+            if rank <= heap[0][0]:
+                return
+            del top[heapq.heappop(heap)[1]]
+        top[key] = value
+        heapq.heappush(heap, (rank, key, value))
+        if len(heap) > 2 * self.top_n:
+            # 过期记录过多时重建堆
+            self.top_heap = [(self._rank(value), key, value) for key, value in top.items()]
+            heapq.heapify(self.top_heap)
+
+    def _rank(self, value: int) -> int:
+        if self.rank is None:
+            return value >> 64
+        center = (value >> 48) & 0xFFFF
+        return self.rank(self.cards[center] if center != NONE_INDEX else None, value >> 64)
+
+    def _drop_stale(self):
+        heap = self.top_heap
+        top = self.top
+        while heap and top.get(heap[0][1]) != heap[0][2]:
+            heapq.heappop(heap)
+
+    def seed_top(self, results: list[dict]):
+        """
+        将已保存的前 N 名 (如断点中记录的 top_results) 放回前 N 名堆，不计入当前批次。
+        """
+        for result in results:
+            self._push_top(*self.pack(result["deck_card_ids"], result["center_card"], result["friend_card"], result["score"]))
+
+    def top_results(self) -> list[dict]:
+        """
+        返回全局前 N 名 (按组成去重，按排名值降序)。
+        """
+        entries = sorted(self.top.items(), key=lambda item: self._rank(item[1]), reverse=True)
+        return [self.unpack(key, value) for key, value in entries]
+
+    def results(self, sort: bool = False):
+        """
+        返回每个组成的最高分结果，sort=True 时按组成 (composition_key) 排序。
+        """
+        table = self.table
+        for key in sorted(table) if sort else table:
+            yield self.unpack(key, table[key])
+
+    def dump(self, path: str, music_id: str = None, difficulty: str = None, levels: dict[int, list[int]] = None):
+        """
+        将当前汇总结果按组成排序后写入二进制文件并清空，前 N 名保留。
+        """
+        with ResultWriter(path, self.cards, music_id, difficulty, levels) as writer:
+            for result in self.results(sort=True):
+                writer.write_result(result)
+        self.table.clear()
+
+
+class JsonResultWriter:
+    """
+    流式写入 JSON log，输出格式与 json.dump(results, indent=0) 相同。
+    给出 levels / data 时关闭文件后写入练度记录，只记录出现在结果中的卡牌。
+    """
+
+    def __init__(self, path: str, levels: dict[int, list[int]] = None, data: dict[int, str] = None) -> None:
+        self.path = path
+        self.count = 0
+        self.levels = levels
+        self.data = data
+        self.cards = set()
+        self._file = open(path, 'w', encoding='utf-8')
+        self._file.write("[")
+
+    def write_result(self, result: dict):
+        self._file.write(",\n" if self.count else "\n")
+        self._file.write(json.dumps(result, ensure_ascii=False, indent=0))
+        self.count += 1
+        if self.levels or self.data:
+            self.cards.update(collect_cards([result]))
+
+    def close(self):
+        if not self._file.closed:
+            self._file.write("\n]" if self.count else "]")
+            self._file.close()
+            save_card_meta(self.path, self.cards, self.levels, self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_writer(path: str, cards: list[int] = None, music_id: str = None, difficulty: str = None,
+                levels: dict[int, list[int]] = None, data: dict[int, str] = None):
+    """
+    按扩展名返回流式写入器，二进制格式需要预先给出所有卡牌id。
+    """
+    if path.endswith(".bin"):
+        return ResultWriter(path, cards, music_id, difficulty, levels, data=data)
+    return JsonResultWriter(path, levels, data)
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20):
+    """
+    逐个解析 JSON 数组中的元素 (元素需为对象或数组)，不将整个文件读入内存。
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+        while True:
+            # 跳过空白与分隔符，必要时读入更多数据
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                buffer = f.read(chunk_size)
+                pos = 0
+                eof = not buffer
+            if pos >= len(buffer):
+                raise ValueError(f"Unexpected end of JSON array in {path}")
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"Expected a JSON array in {path}")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+                if end >= len(buffer) and not eof:
+                    raise json.JSONDecodeError("Element may be truncated", buffer, end)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield obj
+            pos = end
+
+
+def iter_results(path: str):
+    """
+    按扩展名逐条读取 JSON 或二进制格式的结果，内存占用与文件大小无关。
+    """
+    if path.endswith(".bin"):
+        with ResultReader(path) as reader:
+            yield from reader
+    else:
+        yield from iter_json_array(path)
+
+
+def iter_compositions(path: str):
+    """
+    逐条读取结果的卡组组成 (composition_key) 与得分，不构造完整的结果 dict。
+    """
+    if path.endswith(".bin"):
+        with ResultReader(path) as reader:
+            cards = reader.cards
+            for record in reader.records():
+                yield tuple(sorted([cards[i] for i in record[:6]])), record[8]
+    else:
+        for result in iter_json_array(path):
+            yield composition_key(result), result["score"]
+
+
+def load_top_results(path: str, n: int, dedup: bool = False) -> tuple[list[dict], int]:
+    """
+    流式读取结果，只在大小为 n 的堆中保留 pt 最高的记录，时间 O(行数·log n)，内存 O(n)。
+    同分时保留文件中靠前的记录，结果与完整读取后按 pt 稳定排序再截取前 n 条相同。
+    二进制 log 只对进入前 n 名的记录构造 dict。
+
+    Args:
+        path: JSON 或二进制 log 路径。
+        n: 保留的记录数量。
+        dedup: 每个卡组组成 (不考虑顺序) 只保留 pt 最高的一条。
+
+    Returns:
+        tuple[list[dict], int]: 按 pt 降序的结果与读取的总条数。
+    """
+    if path.endswith(".bin"):
+        reader = ResultReader(path)
+        records = reader.records()
+        rows = ((record[9], record) for record in records)
+        composition = lambda record: tuple(sorted(record[:6]))
+        convert = reader.to_result
+    else:
+        reader = None
+        rows = ((result["pt"], result) for result in iter_json_array(path))
+        composition = composition_key
+        convert = None
+
+    # 小顶堆: (pt, -行号, 组成, 记录)，dedup 时被替换的旧条目惰性删除
+    heap: list[tuple] = []
+    # dedup: 组成 -> 堆中有效条目的 (pt, -行号)
+    current: dict[tuple, tuple[int, int]] = {}
+    total = 0
+    try:
+        for index, (pt, row) in enumerate(rows):
+            total += 1
+            rank = (pt, -index)
+            size = len(current) if dedup else len(heap)
+            if n <= 0 or (size >= n and rank < heap[0][:2]):
+                continue
+            if not dedup:
+                if len(heap) < n:
+                    heapq.heappush(heap, (pt, -index, None, row))
+                else:
+                    heapq.heappushpop(heap, (pt, -index, None, row))
+                continue
+
+            key = composition(row)
+            old = current.get(key)
+            if old is not None and pt <= old[0]:
+                continue
+            current[key] = rank
+            heapq.heappush(heap, (pt, -index, key, row))
+            # 移除超出 n 的最低条目，过期条目直接丢弃
+            while len(current) > n:
+                low = heapq.heappop(heap)
+                if current.get(low[2]) == low[:2]:
+                    del current[low[2]]
+            while heap and current.get(heap[0][2]) != heap[0][:2]:
+                heapq.heappop(heap)
+            # 过期条目过多时重建堆
+            if len(heap) > 2 * n + 64:
+                heap = [entry for entry in heap if current.get(entry[2]) == entry[:2]]
+                heapq.heapify(heap)
+
+        if dedup:
+            heap = [entry for entry in heap if current.get(entry[2]) == entry[:2]]
+        heap.sort(reverse=True)
+        results = [entry[3] for entry in heap]
+        if convert is not None:
+            results = [convert(record) for record in results]
+    finally:
+        if reader is not None:
+            records.close()
+            reader.close()
+    return results, total
+
+
+def card_row_index(path: str) -> dict[int, list[int]]:
+    """
+    建立卡牌id -> 包含该卡牌 (卡组或助战) 的行号列表的索引，行号按升序排列。
+    二进制 log 在安装 numpy 时按列计算。
+    """
+    index: dict[int, list[int]] = {}
+    if not path.endswith(".bin"):
+        for row, result in enumerate(iter_json_array(path)):
+            cards = set(result["deck_card_ids"])
+            if result.get("friend_card"):
+                cards.add(result["friend_card"])
+            for card_id in cards:
+                index.setdefault(card_id, []).append(row)
+        return index
+
+    with ResultReader(path) as reader:
+        if np is not None and len(reader):
+            array = reader.as_array()
+            for i, card_id in enumerate(reader.cards):
+                rows = np.flatnonzero((array["cards"] == i).any(axis=1) | (array["friend"] == i))
+                if len(rows):
+                    index[card_id] = rows.tolist()
+            del array
+            return index
+        cards = reader.cards
+        records = reader.records()
+        try:
+            for row, record in enumerate(records):
+                indices = set(record[:6])
+                if record[7] != NONE_INDEX:
+                    indices.add(record[7])
+                for i in indices:
+                    index.setdefault(cards[i], []).append(row)
+        finally:
+            records.close()
+    return index
+
+
+def read_rows(path: str, rows) -> list[dict]:
+    """
+    按行号读取结果，返回顺序与 rows 排序后相同。二进制 log 直接定位，JSON log 需要顺序读取。
+    """
+    rows = sorted(set(rows))
+    if path.endswith(".bin"):
+        with ResultReader(path) as reader:
+            return [reader.to_result(reader.record(row)) for row in rows]
+    wanted = set(rows)
+    return [result for row, result in enumerate(iter_json_array(path)) if row in wanted]
+
+
+def composition_key(result: dict) -> tuple[int, ...]:
+    """
+    卡组组成 (不考虑顺序) 的比较键。
+    """
+    return tuple(sorted(result["deck_card_ids"]))
+
+
+def collect_cards(results: list[dict]) -> set[int]:
+    """
+    收集结果中出现的所有卡牌id (含C位、助战)。
+    """
+    cards = set()
+    for result in results:
+        cards.update(result["deck_card_ids"])
+        if result.get("center_card"):
+            cards.add(result["center_card"])
+        if result.get("friend_card"):
+            cards.add(result["friend_card"])
+    return cards
+
+
+def save_results(results: list[dict], path: str, music_id: str = None, difficulty: str = None,
+                 levels: dict[int, list[int]] = None, data: dict[int, str] = None):
+    """
+    按扩展名将结果保存为 JSON 或二进制格式。
+    """
+    if path.endswith(".bin"):
+        with ResultWriter(path, collect_cards(results), music_id, difficulty, levels, data=data) as writer:
+            for result in results:
+                writer.write_result(result)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=0)
+        save_card_meta(path, collect_cards(results), levels, data)
+
+
+def load_results(path: str) -> list[dict]:
+    """
+    按扩展名读取 JSON 或二进制格式的结果。
+    """
+    if path.endswith(".bin"):
+        with ResultReader(path) as reader:
+            return list(reader)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def json_to_bin(json_path: str, bin_path: str = None, music_id: str = None, difficulty: str = None,
+                levels: dict[int, list[int]] = None) -> str:
+    """
+    将 JSON log 转换为二进制格式。
+    """
+    bin_path = bin_path or os.path.splitext(json_path)[0] + ".bin"
+    recorded_levels, recorded_data = load_card_meta(json_path)
+    save_results(load_results(json_path), bin_path, music_id, difficulty, levels or recorded_levels, recorded_data)
+    logger.info(f"Converted {json_path} -> {bin_path}")
+    return bin_path
+
+
+def bin_to_json(bin_path: str, json_path: str = None) -> str:
+    """
+    将二进制log转换为 JSON 格式。
+    """
+    json_path = json_path or os.path.splitext(bin_path)[0] + ".json"
+    levels, data = load_card_meta(bin_path)
+    save_results(load_results(bin_path), json_path, levels=levels, data=data)
+    logger.info(f"Converted {bin_path} -> {json_path}")
+    return json_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    parser = argparse.ArgumentParser(description="Convert simulation results between JSON and binary format.")
+    parser.add_argument("files", nargs="+", help="Input .json or .bin files.")
+    args = parser.parse_args()
+
+    for file in args.files:
+        if file.endswith(".bin"):
+            bin_to_json(file)
+        else:
+            json_to_bin(file)
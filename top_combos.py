@@ -0,0 +1,98 @@
+"""
+多曲组合求解的前 K 名记录
+
+保存总 Pt 最高的 K 个组合，可要求任意两个组合之间至少有 m 张卡牌不同。
+threshold 为新组合进入前 K 名需要超过的总 Pt，搜索时以此剪枝；K=1 时即当前最优总 Pt。
+
+限制最少不同卡牌数时采用贪心规则: 新组合与已有组合相似 (不同卡牌少于 m 张) 时，
+只有总 Pt 高于所有相似组合才会加入，并替换掉这些组合。
+"""
+import heapq
+import itertools
+from typing import Callable, Hashable, Iterable, Optional
+
+
+class TopCombos:
+    def __init__(self, k: int = 1, min_diff: int = 0, cards_of: Optional[Callable[[object], Iterable[int]]] = None,
+                 key_of: Optional[Callable[[object], Hashable]] = None):
+        """
+        Args:
+            k: 保留的组合数量。
+            min_diff: 两个组合之间至少不同的卡牌数量，0 为不限制。
+            cards_of: 由组合取得其使用的全部卡牌id，min_diff > 0 时必须提供。
+            key_of: 由组合取得唯一标识，提供时同一组合不会重复加入 (如多次搜索合并结果时)，
+                    同一组合的总 Pt 提高时替换原有记录。
+        """
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        if min_diff > 0 and cards_of is None:
+            raise ValueError("cards_of is required when min_diff > 0")
+        self.k = k
+        self.min_diff = min_diff
+        self.cards_of = cards_of
+        self.key_of = key_of
+        # 小顶堆: (总Pt, 插入序号, 卡牌集合, 组合)
+        self._heap: list[tuple[int, int, Optional[frozenset], object]] = []
+        self._counter = itertools.count()
+        self.threshold = -1
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def offer(self, total_pt: int, combo) -> bool:
+        """
+        尝试加入一个组合，返回是否加入。
+        """
+        if total_pt <= self.threshold:
+            return False
+        if self.key_of is not None:
+            key = self.key_of(combo)
+            same = [entry for entry in self._heap if self.key_of(entry[3]) == key]
+            if same:
+                if same[0][0] >= total_pt:
+                    return False
+                self._heap = [entry for entry in self._heap if entry is not same[0]]
+                heapq.heapify(self._heap)
+
+        cards = None
+        if self.min_diff > 0:
+            cards = frozenset(self.cards_of(combo))
+            similar = [entry for entry in self._heap if len(cards - entry[2]) < self.min_diff]
+            if any(entry[0] >= total_pt for entry in similar):
+                return False
+            if similar:
+                replaced = {entry[1] for entry in similar}
+                self._heap = [entry for entry in self._heap if entry[1] not in replaced]
+                heapq.heapify(self._heap)
+
+        entry = (total_pt, next(self._counter), cards, combo)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        else:
+            heapq.heapreplace(self._heap, entry)
+        self.threshold = self._heap[0][0] if len(self._heap) == self.k else -1
+        return True
+
+    def merge(self, ranked: Iterable[tuple[int, object]]):
+        """
+        合并另一份 ranked() 结果 (如其他进程的搜索结果)。
+        """
+        for total_pt, combo in ranked:
+            self.offer(total_pt, combo)
+
+    @property
+    def best(self) -> tuple[int, object]:
+        """
+        总 Pt 最高的组合，没有组合时为 (-1, None)。
+        """
+        if not self._heap:
+            return -1, None
+        entry = max(self._heap, key=lambda entry: (entry[0], -entry[1]))
+        return entry[0], entry[3]
+
+    def ranked(self) -> list[tuple[int, object]]:
+        """
+        按总 Pt 降序 (同分时先找到的在前) 返回 [(总Pt, 组合), ...]。
+        """
+        entries = sorted(self._heap, key=lambda entry: (-entry[0], entry[1]))
+        return [(entry[0], entry[3]) for entry in entries]